@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bufet_project.settings')
+# Persistent connections are for the WSGI profile: under ASGI each
+# sync_to_async thread would hold its own, and none of them is ever closed
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
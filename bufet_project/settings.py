@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 from pathlib import Path
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -23,8 +25,20 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = 'django-insecure-w6%t(o67omdm9+m8*rotbz-8x#_pkjz3f7$w0h-+f_bz4^v_1r'
 
+# Check unknown codes against passes hashed before lookup keys existed. Each
+# such pass costs a PBKDF2 run per unmatched scan; set QR_LEGACY_FALLBACK=0
+# once `manage.py retire_legacy_passes` has reissued or deactivated them.
+QR_LEGACY_FALLBACK = os.getenv('QR_LEGACY_FALLBACK', '1') == '1'
+
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.getenv('DJANGO_DEBUG', '1') == '1'
+
+# Key for QR pass hashes and lookup fingerprints. Kept separate from SECRET_KEY
+# so that rotating SECRET_KEY does not invalidate every printed pass; only
+# development (DEBUG on) falls back to SECRET_KEY.
+QR_TOKEN_SECRET = os.getenv('QR_TOKEN_SECRET', SECRET_KEY if DEBUG else '')
+if not QR_TOKEN_SECRET:
+    raise ImproperlyConfigured('Set QR_TOKEN_SECRET when DJANGO_DEBUG is off')
 
 ALLOWED_HOSTS = ['alpha.argonix.eu', 'localhost', '127.0.0.1', '[::1]', '192.168.25.232', '192.168.1.118', '10.42.0.1']
 
@@ -43,11 +57,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.metrics.MetricsMiddleware',  # First, so it times the whole request
     'django.middleware.security.SecurityMiddleware',
+    'main.assets.StaticFilesMiddleware',  # WhiteNoise, async-capable
+    'main.ratelimit.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'main.sessions.SessionMaintenanceMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -79,9 +97,38 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Reuse a worker's connection across requests instead of reopening
+        # the file (and rerunning the pragmas) every time. WSGI only: the
+        # ASGI entry point (bufet_project/asgi.py) defaults this to 0
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so concurrent
+            # checkouts queue on the busy timeout instead of failing with
+            # "database is locked" when a read lock cannot be upgraded
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,  # Seconds to wait for the lock
+        },
+        # File-backed test database so concurrency tests can share it
+        # across threads (an in-memory database is per-connection)
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Applied to every new SQLite connection (main/db.py). WAL lets readers run
+# while a checkout writes; synchronous=NORMAL is durable across application
+# crashes in WAL mode and only risks the last commits on power loss.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,  # Milliseconds, matches OPTIONS['timeout']
+    'cache_size': -20000,  # Negative = KiB, so about 20 MB per connection
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -118,21 +165,111 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STATICFILES_DIRS = [BASE_DIR / 'static']
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        # collectstatic writes content-hashed names plus .gz/.br copies, and
+        # WhiteNoise serves the hashed files with far-future immutable
+        # caching. Without DEBUG this needs `manage.py collectstatic`.
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
+
+# Rate limits per path (token bucket, shared by all workers via the database)
+# 'rate' requests are allowed per 'per' seconds; see main/ratelimit.py
+RATE_LIMITS = {
+    '/api/scan-qr/': {'rate': 10, 'per': 60},
+    '/api/orders/': {'rate': 20, 'per': 60},
+    '/api/stripe-session/': {'rate': 10, 'per': 60},
+    '/login/': {'rate': 5, 'per': 60, 'methods': ['POST']},
+}
 
-# Caching for rate limiting
+# File-based so every worker process sees the same entries (menu snapshots
+# and their version token must be shared for invalidation to work)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        # FileBasedCache that counts hits and misses for /metrics
+        'BACKEND': 'main.metrics.InstrumentedFileBasedCache',
+        'LOCATION': BASE_DIR / '.django_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
+# Lifetime of a cached menu snapshot/fragment. Changes to FoodItem start a new
+# menu version immediately, so this only bounds how long unused entries stay.
+MENU_CACHE_SECONDS = 3600
+
 # Session Security Settings
 SESSION_COOKIE_SECURE = True  # Only send over HTTPS
 SESSION_COOKIE_HTTPONLY = True  # Prevent JavaScript access
 SESSION_COOKIE_SAMESITE = 'Strict'  # Prevent CSRF
 SESSION_COOKIE_AGE = 300  # 5 minutes default
-SESSION_SAVE_EVERY_REQUEST = True  # Refresh session on each request
+# Only write sessions when they change; see main/sessions.py
+SESSION_SAVE_EVERY_REQUEST = False
+# SESSION_BACKEND: 'cached_db' (default, reads come from the shared cache),
+# 'signed_cookies' (no server-side storage; a session cannot be revoked
+# before it expires), 'cache' or 'db'
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.getenv('SESSION_BACKEND', 'cached_db')
+SESSION_REFRESH_INTERVAL = 60  # Seconds between re-saves of an active staff session
+SESSION_PRUNE_INTERVAL = 3600  # Seconds between expired-session cleanups
+
+# Request metrics (see main/metrics.py). Each worker writes its numbers to
+# METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds; /metrics adds them
+# up. Staff can open /metrics; a scraper sends "Authorization: Bearer
+# <METRICS_TOKEN>" instead (disabled while empty).
+METRICS_DIR = Path(os.getenv('METRICS_DIR', BASE_DIR / '.metrics'))
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# One JSON object per log line on stderr (see main/logs.py)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'main.logs.JSONFormatter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['console'],
+            'level': os.getenv('DJANGO_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+        # Django logs every 4xx response here as a WARNING. Status codes are
+        # already counted in /metrics, so only 5xx errors are logged.
+        'django.request': {
+            'handlers': ['console'],
+            'level': os.getenv('DJANGO_REQUEST_LOG_LEVEL', 'ERROR'),
+            'propagate': False,
+        },
+        'main': {
+            'handlers': ['console'],
+            'level': os.getenv('LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/6.0/ref/settings/#default-auto-field
@@ -146,4 +283,28 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # Stripe
 # Use environment variables to avoid committing secrets
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
-STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
\ No newline at end of file
+STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
+# Signing secret of the checkout.session.completed webhook endpoint
+# (/payments/stripe-webhook/). Without it, the success redirect confirms
+# payments by calling the Stripe API itself.
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
+
+# How long stock stays held for an unpaid Stripe checkout (seconds). Stripe
+# sessions last 31 minutes from when they are created (Stripe's minimum is
+# 30), and the hold must outlive them by STRIPE_EXPIRY_MARGIN (5 minutes)
+# plus the time it takes to create the session.
+# Release expired holds with: python manage.py release_expired_holds
+STOCK_HOLD_SECONDS = 40 * 60
+
+# Orders per page in the admin orders panel (?per_page= overrides, max 200)
+ADMIN_ORDERS_PAGE_SIZE = 50
+
+# Live stock/order streams (Server-Sent Events, see main/events.py)
+LIVE_EVENTS_POLL_INTERVAL = 1.0  # Seconds between LiveEvent polls per worker
+LIVE_EVENTS_CLIENT_BUFFER = 100  # Events queued per client before it must resync
+LIVE_EVENTS_HEARTBEAT = 15  # Seconds between keep-alive comments
+LIVE_EVENTS_RETENTION = 3600  # Seconds LiveEvent rows are kept (see prune_expired_data)
+
+# Seconds an Idempotency-Key is remembered (see main/idempotency.py). Deleted
+# by prune_expired_data; keep it longer than any client retries a request.
+IDEMPOTENCY_KEY_RETENTION = 24 * 3600
@@ -1,13 +1,15 @@
 from django.contrib import admin
 from django.utils import timezone
 from datetime import timedelta
-from .models import QRCodePass, FoodItem, Order, OrderItem
+from .models import QRCodePass, FoodItem, Order, OrderItem, PendingCheckout, SalesRollup
+from . import events, rollups
 @admin.register(FoodItem)
 class FoodItemAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'stock_count', 'is_available', 'updated_at')
+    list_display = ('name', 'price', 'stock_count', 'reserved_count', 'is_available', 'updated_at')
     list_filter = ('is_available', 'created_at')
     search_fields = ('name', 'description')
     list_editable = ('price', 'stock_count', 'is_available')
+    readonly_fields = ('reserved_count',)
 @admin.register(QRCodePass)
 class QRCodePassAdmin(admin.ModelAdmin):
     list_display = ('id', 'user_identifier', 'created_at', 'expires_at', 'is_active', 'use_count')
@@ -53,5 +55,41 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'user_identifier', 'created_at', 'status', 'payment_method', 'payment_status', 'total_amount')
     list_filter = ('status', 'payment_method', 'payment_status', 'created_at')
     search_fields = ('user_identifier',)
-    readonly_fields = ('created_at', 'total_amount', 'stripe_session_id', 'paid_at')
+    readonly_fields = ('created_at', 'total_amount', 'stripe_session_id', 'paid_at', 'version')
     inlines = [OrderItemInline]
+    
+    def save_model(self, request, obj, form, change):
+        """Keep the sales rollups in step with payment status edits"""
+        old_status = Order.objects.values_list('payment_status', flat=True).get(pk=obj.pk) if change else None
+        if change and 'status' in form.changed_data:
+            obj.version += 1  # Kitchen clients holding the old version get a conflict
+        super().save_model(request, obj, form, change)
+        if change:
+            rollups.record_payment_status_change(obj, old_status)
+        events.publish_order(obj)
+    
+    def save_related(self, request, form, formsets, change):
+        """Count new orders once their items are saved, so food item rollups match rebuild()"""
+        super().save_related(request, form, formsets, change)
+        if not change:
+            rollups.record_order(form.instance, form.instance.items.values_list('food_item_id', 'quantity', 'unit_price'))
+
+
+@admin.register(SalesRollup)
+class SalesRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'dimension', 'key', 'order_count', 'quantity', 'total_amount')
+    list_filter = ('dimension', 'day')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(PendingCheckout)
+class PendingCheckoutAdmin(admin.ModelAdmin):
+    list_display = ('stripe_session_id', 'user_identifier', 'created_at', 'completed_at', 'hold_expires_at', 'order', 'error')
+    list_filter = ('completed_at', 'created_at')
+    search_fields = ('stripe_session_id', 'user_identifier')
+    readonly_fields = ('stripe_session_id', 'user_identifier', 'items', 'created_at', 'completed_at', 'hold_expires_at', 'order', 'error')
@@ -0,0 +1,34 @@
+"""Static file serving that works on both the WSGI and the ASGI stack.
+
+WhiteNoise's middleware is sync-only, and a single sync middleware makes
+Django run every async view behind it through a thread. This subclass keeps
+requests for application URLs on the event loop under ASGI. Static files
+are still found in WhiteNoise's in-memory index and served directly.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response=None, *args, **kwargs):
+		super().__init__(get_response, *args, **kwargs)
+		self.is_async = iscoroutinefunction(get_response)
+		if self.is_async:
+			markcoroutinefunction(self)
+
+	def __call__(self, request):
+		if self.is_async:
+			return self.__acall__(request)
+		return super().__call__(request)
+
+	async def __acall__(self, request):
+		if self.autorefresh:
+			static_file = self.find_file(request.path_info)
+		else:
+			static_file = self.files.get(request.path_info)
+		if static_file is not None:
+			return self.serve(static_file, request)
+		return await self.get_response(request)
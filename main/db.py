@@ -0,0 +1,23 @@
+"""SQLite connection tuning.
+
+Every new SQLite connection runs the pragmas in settings.SQLITE_PRAGMAS.
+Together with CONN_MAX_AGE this happens once per worker connection, not once
+per request.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def pragma_statements(pragmas=None):
+	pragmas = settings.SQLITE_PRAGMAS if pragmas is None else pragmas
+	return [f"PRAGMA {name} = {value}" for name, value in pragmas.items()]
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+	if connection.vendor != 'sqlite':
+		return
+	with connection.cursor() as cursor:
+		for statement in pragma_statements():
+			cursor.execute(statement)
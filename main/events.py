@@ -0,0 +1,167 @@
+"""Live stock and order events for Server-Sent Events streams.
+
+Writers call publish() inside their transaction, which appends a LiveEvent
+row; the event becomes visible to readers when the transaction commits. The
+LiveEvent table is the pub/sub backend shared by all worker processes.
+
+Each worker runs a single EventBroker task that tails the table (one query
+per poll interval, however many clients are connected) and fans new events
+out to its subscribers. Every subscriber has a bounded queue: a client that
+cannot keep up loses its oldest events and is told to resync instead of
+making the worker buffer without limit.
+
+The broker lives on the event loop of the ASGI server, so the stream views
+need the ASGI entry point (bufet_project/asgi.py). Under WSGI they answer 204
+instead: EventSource stops reconnecting and the pages fall back to polling.
+
+Old rows are deleted by prune(), which ``python manage.py
+prune_expired_data`` runs, so the table stays small whichever server is
+used.
+"""
+import asyncio
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import FoodItem, LiveEvent
+
+def publish(kind, payload):
+	"""Append an event; it is delivered once the current transaction commits"""
+	LiveEvent.objects.create(kind=kind, payload=json.loads(json.dumps(payload, cls=DjangoJSONEncoder)))
+
+
+def prune(now=None):
+	"""Delete events older than LIVE_EVENTS_RETENTION seconds. Returns how many."""
+	cutoff = (now or timezone.now()) - timedelta(seconds=settings.LIVE_EVENTS_RETENTION)
+	deleted, _ = LiveEvent.objects.filter(created_at__lt=cutoff).delete()
+	return deleted
+
+
+def publish_stock(food_item_ids):
+	publish('stock', {'ids': sorted(set(food_item_ids))})
+
+
+def _order_payload(order):
+	return {
+		'id': order.id,
+		'user_identifier': order.user_identifier,
+		'status': order.status,
+		'version': order.version,
+		'payment_method': order.payment_method,
+		'payment_status': order.payment_status,
+		'total_amount': str(order.total_amount),
+		'created_at': order.created_at,
+	}
+
+
+def publish_order(order):
+	publish('order', _order_payload(order))
+
+
+def publish_orders(orders):
+	"""One event per order, written with a single INSERT"""
+	LiveEvent.objects.bulk_create([
+		LiveEvent(kind='order', payload=json.loads(json.dumps(_order_payload(order), cls=DjangoJSONEncoder)))
+		for order in orders
+	])
+
+
+class Subscriber:
+	"""One connected client: a bounded queue of (kind, data) pairs"""
+
+	def __init__(self, kinds, maxsize):
+		self.kinds = kinds
+		self.queue = asyncio.Queue(maxsize=maxsize)
+
+	def put(self, kind, data):
+		if self.queue.full():
+			# Slow client: drop its backlog and ask it to reload its state
+			while not self.queue.empty():
+				self.queue.get_nowait()
+			kind, data = 'resync', '{}'
+		self.queue.put_nowait((kind, data))
+
+
+class EventBroker:
+	"""Per-process fan-out of LiveEvent rows to subscribers"""
+
+	def __init__(self):
+		self.subscribers = set()
+		self.task = None
+		self.loop = None
+
+	def subscribe(self, kinds):
+		subscriber = Subscriber(kinds, settings.LIVE_EVENTS_CLIENT_BUFFER)
+		self.subscribers.add(subscriber)
+		loop = asyncio.get_running_loop()
+		if self.task is None or self.task.done() or self.loop is not loop:
+			self.loop = loop
+			self.task = loop.create_task(self.run())
+		return subscriber
+
+	def unsubscribe(self, subscriber):
+		self.subscribers.discard(subscriber)
+
+	async def run(self):
+		last = await LiveEvent.objects.order_by('-id').values_list('id', flat=True).afirst() or 0
+		while self.subscribers:
+			await asyncio.sleep(settings.LIVE_EVENTS_POLL_INTERVAL)
+			events = [
+				event async for event in
+				LiveEvent.objects.filter(id__gt=last).order_by('id').values('id', 'kind', 'payload')[:500]
+			]
+			if events:
+				last = events[-1]['id']
+				await self.dispatch(events)
+
+	async def dispatch(self, events):
+		messages = []
+		stock_ids = set()
+		for event in events:
+			if event['kind'] == 'stock':
+				stock_ids.update(event['payload']['ids'])
+			else:
+				messages.append((event['kind'], json.dumps(event['payload'])))
+
+		if stock_ids:
+			# One query per poll for all stock changes, shared by every client
+			found = {
+				item['id']: item async for item in
+				FoodItem.objects.filter(id__in=stock_ids).values('id', 'stock_count', 'reserved_count', 'is_available')
+			}
+			stock = [
+				{
+					'id': food_id,
+					'available': max(0, found[food_id]['stock_count'] - found[food_id]['reserved_count'])
+					if food_id in found and found[food_id]['is_available'] else 0,
+				}
+				for food_id in sorted(stock_ids)
+			]
+			messages.append(('stock', json.dumps(stock, separators=(',', ':'))))
+
+		for subscriber in list(self.subscribers):
+			for kind, data in messages:
+				if kind in subscriber.kinds:
+					subscriber.put(kind, data)
+
+
+broker = EventBroker()
+
+
+async def stream(kinds):
+	"""SSE body for a client interested in the given event kinds"""
+	subscriber = broker.subscribe(kinds)
+	try:
+		yield 'retry: 3000\n\n'
+		while True:
+			try:
+				kind, data = await asyncio.wait_for(subscriber.queue.get(), timeout=settings.LIVE_EVENTS_HEARTBEAT)
+			except asyncio.TimeoutError:
+				yield ': ping\n\n'
+				continue
+			yield f'event: {kind}\ndata: {data}\n\n'
+	finally:
+		broker.unsubscribe(subscriber)
@@ -0,0 +1,178 @@
+"""Idempotency keys for JSON endpoints that must not run twice.
+
+Clients send an ``Idempotency-Key`` header with a value that stays the same
+when they retry a request. The first request with a key records it before the
+view runs and stores the JSON response when it succeeds. Repeats get that
+stored response back after one indexed read, without running the view again.
+
+Keys are scoped to the endpoint and the session, so different users cannot
+collide. A hash of the request body is stored with the key, and a repeat with
+a different body is rejected with 422 instead of being answered with the
+first response. Failed responses are not stored, which lets the client retry
+them. Keys are deleted IDEMPOTENCY_KEY_RETENTION seconds after they were
+created by prune(), which prune_expired_data runs from cron.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+# A key whose request has not finished after this long is treated as abandoned
+IN_PROGRESS_TIMEOUT = timedelta(seconds=60)
+
+
+def _replay(record):
+	response = JsonResponse(record.response_body, status=record.response_status, safe=False)
+	response['Idempotent-Replayed'] = 'true'
+	return response
+
+
+def _in_progress():
+	return JsonResponse({
+		'success': False,
+		'message': 'This request is already being processed. Please wait.'
+	}, status=409)
+
+
+def _mismatch():
+	return JsonResponse({
+		'success': False,
+		'message': 'This Idempotency-Key was already used with a different request.'
+	}, status=422)
+
+
+def _claim(key, request_hash):
+	"""Record key as in progress. Returns False if it already exists."""
+	try:
+		IdempotencyKey.objects.create(key=key, request_hash=request_hash)
+		return True
+	except IntegrityError:
+		pass
+
+	abandoned = IdempotencyKey.objects.filter(
+		key=key,
+		response_status__isnull=True,
+		created_at__lt=timezone.now() - IN_PROGRESS_TIMEOUT
+	).delete()[0]
+	if not abandoned:
+		return False
+	try:
+		IdempotencyKey.objects.create(key=key, request_hash=request_hash)
+		return True
+	except IntegrityError:
+		return False
+
+
+def _run(key, view, request, *args, **kwargs):
+	"""Run the view for a claimed key and store a successful response"""
+	try:
+		response = view(request, *args, **kwargs)
+	except Exception:
+		IdempotencyKey.objects.filter(key=key).delete()
+		raise
+
+	if 200 <= response.status_code < 300:
+		IdempotencyKey.objects.filter(key=key).update(
+			response_status=response.status_code,
+			response_body=json.loads(response.content)
+		)
+	else:
+		IdempotencyKey.objects.filter(key=key).delete()
+	return response
+
+
+async def _arun(key, view, request, *args, **kwargs):
+	"""_run() for async views"""
+	try:
+		response = await view(request, *args, **kwargs)
+	except BaseException:
+		# Including CancelledError when the client disconnects, so a retry
+		# is not answered with 409 until the key is abandoned
+		await IdempotencyKey.objects.filter(key=key).adelete()
+		raise
+
+	if 200 <= response.status_code < 300:
+		await IdempotencyKey.objects.filter(key=key).aupdate(
+			response_status=response.status_code,
+			response_body=json.loads(response.content)
+		)
+	else:
+		await IdempotencyKey.objects.filter(key=key).adelete()
+	return response
+
+
+def _answer(record, request_hash):
+	"""Response for a key that another request already claimed"""
+	if record is None:
+		return _in_progress()
+	# Keys stored before request hashes existed have none
+	if record.request_hash and record.request_hash != request_hash:
+		return _mismatch()
+	if record.response_status is None:
+		return _in_progress()
+	return _replay(record)
+
+
+def _request_hash(request):
+	return hashlib.sha256(request.body).hexdigest()
+
+
+def prune(now=None):
+	"""Delete keys older than IDEMPOTENCY_KEY_RETENTION seconds. Returns how many."""
+	cutoff = (now or timezone.now()) - timedelta(seconds=settings.IDEMPOTENCY_KEY_RETENTION)
+	deleted, _ = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+	return deleted
+
+
+def _request_key(scope, request):
+	"""Storage key for the request's Idempotency-Key header, or None"""
+	client_key = request.headers.get('Idempotency-Key', '').strip()
+	if not client_key or len(client_key) > 255:
+		return None
+	session_key = request.session.session_key or ''
+	return hashlib.sha256(f"{scope}\n{session_key}\n{client_key}".encode()).hexdigest()
+
+
+def idempotent(scope):
+	"""Make a JSON view (sync or async) replay its first successful response for a repeated key"""
+	def decorator(view):
+		if iscoroutinefunction(view):
+			@wraps(view)
+			async def async_wrapper(request, *args, **kwargs):
+				key = _request_key(scope, request)
+				if key is None:
+					return await view(request, *args, **kwargs)
+
+				request_hash = _request_hash(request)
+				record = await IdempotencyKey.objects.filter(key=key).afirst()
+				if record is None or record.response_status is None:
+					if await sync_to_async(_claim)(key, request_hash):
+						return await _arun(key, view, request, *args, **kwargs)
+					record = await IdempotencyKey.objects.filter(key=key).afirst()
+				return _answer(record, request_hash)
+			return async_wrapper
+
+		@wraps(view)
+		def wrapper(request, *args, **kwargs):
+			key = _request_key(scope, request)
+			if key is None:
+				return view(request, *args, **kwargs)
+
+			request_hash = _request_hash(request)
+			record = IdempotencyKey.objects.filter(key=key).first()
+			if record is None or record.response_status is None:
+				if _claim(key, request_hash):
+					return _run(key, view, request, *args, **kwargs)
+				record = IdempotencyKey.objects.filter(key=key).first()
+			return _answer(record, request_hash)
+		return wrapper
+	return decorator
@@ -0,0 +1,103 @@
+"""Upload-time processing of food photos.
+
+A new FoodItem.image is re-encoded before it is stored: rotated according to
+its EXIF orientation, stripped of metadata (EXIF, GPS, ICC profiles), and
+capped at MAX_ORIGINAL_SIZE pixels. Square, centre-cropped variants for the
+menu tiles are written next to it in WebP and JPEG and recorded in
+FoodItem.image_variants, together with the size of the stored image under
+'original'. Keeping the size there (rather than in ImageField width/height
+fields) means loading a FoodItem never opens its image file. The food_picture template tag turns them into a
+<picture> with srcset.
+
+``python manage.py process_food_images`` builds variants for images that
+were uploaded before this existed.
+"""
+import io
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+MAX_ORIGINAL_SIZE = 1600
+# Menu tiles are 140-250 CSS pixels wide; medium covers them on 2x screens
+VARIANT_SIZES = {
+	'thumb': 240,
+	'medium': 480,
+}
+FORMATS = {
+	'webp': ('WEBP', {'quality': 80, 'method': 6}),
+	'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANTS_DIR = 'food_items/variants'
+
+
+def _open(file):
+	file.seek(0)
+	image = Image.open(file)
+	image = ImageOps.exif_transpose(image)
+	if image.mode in ('RGBA', 'LA', 'P'):
+		# JPEG has no alpha: flatten transparent images onto white
+		image = image.convert('RGBA')
+		background = Image.new('RGB', image.size, (255, 255, 255))
+		background.paste(image, mask=image.getchannel('A'))
+		return background
+	return image.convert('RGB')
+
+
+def _encode(image, image_format):
+	# A fresh save without exif=/icc_profile= writes no metadata
+	pil_format, options = FORMATS[image_format]
+	buffer = io.BytesIO()
+	image.save(buffer, pil_format, **options)
+	return buffer.getvalue()
+
+
+def image_size(food_item):
+	"""(width, height) of the stored image, or None if it is not known yet"""
+	original = (food_item.image_variants or {}).get('original')
+	return (original['width'], original['height']) if original else None
+
+
+def delete_variants(variants):
+	for variant in (variants or {}).values():
+		if isinstance(variant, dict):
+			for image_format in FORMATS:
+				if variant.get(image_format):
+					default_storage.delete(variant[image_format])
+
+
+def build_variants(image, stem):
+	"""Write every size/format variant of image; returns the image_variants dict"""
+	variants = {'original': {'width': image.width, 'height': image.height}}
+	for name, size in VARIANT_SIZES.items():
+		variant = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+		variants[name] = {'width': size, 'height': size}
+		for image_format in FORMATS:
+			extension = 'jpg' if image_format == 'jpeg' else image_format
+			variants[name][image_format] = default_storage.save(
+				f"{VARIANTS_DIR}/{stem}-{name}.{extension}",
+				ContentFile(_encode(variant, image_format))
+			)
+	return variants
+
+
+def process_upload(food_item):
+	"""Normalise a newly assigned image and build its variants (before saving)"""
+	upload = food_item.image
+	image = _open(upload.file)
+	image.thumbnail((MAX_ORIGINAL_SIZE, MAX_ORIGINAL_SIZE), Image.Resampling.LANCZOS)
+	stem = PurePosixPath(upload.name).stem
+
+	delete_variants(food_item.image_variants)
+	# Stores the clean JPEG under the image's name
+	upload.save(f"{stem}.jpg", ContentFile(_encode(image, 'jpeg'), name=f"{stem}.jpg"), save=False)
+	food_item.image_variants = build_variants(image, PurePosixPath(upload.name).stem)
+
+
+def process_stored(food_item):
+	"""Build variants for an image that is already in storage"""
+	with food_item.image.open('rb') as file:
+		image = _open(file)
+	delete_variants(food_item.image_variants)
+	food_item.image_variants = build_variants(image, PurePosixPath(food_item.image.name).stem)
@@ -0,0 +1,33 @@
+"""JSON log lines, one object per record.
+
+Every record has time, level, logger and message. Fields passed with
+``extra=`` are added as they are, and a traceback goes in ``exception``.
+Configured through settings.LOGGING.
+"""
+import json
+import logging
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else came from extra=
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class JSONFormatter(logging.Formatter):
+	def format(self, record):
+		entry = {
+			'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+			'level': record.levelname,
+			'logger': record.name,
+			'message': record.getMessage(),
+		}
+		for name, value in vars(record).items():
+			if name not in RECORD_ATTRIBUTES and not name.startswith('_'):
+				entry[name] = value
+		if record.exc_info:
+			entry['exception'] = self.formatException(record.exc_info)
+		elif record.exc_text:
+			entry['exception'] = record.exc_text
+		if record.stack_info:
+			entry['stack'] = self.formatStack(record.stack_info)
+		# Objects such as Django's request are logged by their repr
+		return json.dumps(entry, default=repr)
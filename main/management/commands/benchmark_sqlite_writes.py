@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.db import pragma_statements
+
+SCHEMA = (
+    'CREATE TABLE food (id INTEGER PRIMARY KEY, stock INTEGER NOT NULL)',
+    'CREATE TABLE orders (id INTEGER PRIMARY KEY, user TEXT, total TEXT, created REAL)',
+    'CREATE TABLE order_items (id INTEGER PRIMARY KEY, order_id INTEGER, food_id INTEGER, quantity INTEGER)',
+)
+
+# Python's sqlite3 default, i.e. what Django used before OPTIONS['timeout']
+DEFAULT_TIMEOUT = 5.0
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare concurrent checkout-style write throughput on a scratch SQLite '
+        'database with the default settings and with the production profile'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--transactions', type=int, default=200, help='Per thread')
+
+    def handle(self, *args, **options):
+        profiles = (
+            # Rollback journal, deferred BEGIN, a new connection per transaction
+            ('default', dict(pragmas=[], begin='BEGIN', timeout=DEFAULT_TIMEOUT, persistent=False)),
+            ('production', dict(
+                pragmas=pragma_statements(),
+                begin='BEGIN IMMEDIATE',
+                timeout=settings.DATABASES['default'].get('OPTIONS', {}).get('timeout', DEFAULT_TIMEOUT),
+                persistent=True,
+            )),
+        )
+        for name, profile in profiles:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                committed, failed, latencies, elapsed = self.run(path, options['threads'], options['transactions'], **profile)
+            ordered = sorted(latencies) or [0.0]
+            self.stdout.write(
+                f"{name:>10}: {committed} committed, {failed} failed in {elapsed:.2f}s "
+                f"({committed / elapsed:.0f} tx/s), p50 {statistics.median(ordered) * 1000:.1f}ms, "
+                f"p99 {ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000:.1f}ms"
+            )
+
+    def run(self, path, threads, transactions, pragmas, begin, timeout, persistent):
+        def connect():
+            conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+            for statement in pragmas:
+                conn.execute(statement)
+            return conn
+
+        setup = connect()
+        for statement in SCHEMA:
+            setup.execute(statement)
+        setup.executemany('INSERT INTO food (id, stock) VALUES (?, ?)', [(i, 10 ** 9) for i in range(1, 21)])
+        setup.close()
+
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads)
+        results = {'committed': 0, 'failed': 0, 'latencies': []}
+
+        def checkout(conn, worker, n):
+            # Same shape as create_order: read stock, decrement it, insert the order and its items
+            food_id = (worker * transactions + n) % 20 + 1
+            conn.execute(begin)
+            try:
+                conn.execute('SELECT stock FROM food WHERE id = ?', (food_id,)).fetchone()
+                conn.execute('UPDATE food SET stock = stock - 1 WHERE id = ? AND stock >= 1', (food_id,))
+                order_id = conn.execute(
+                    'INSERT INTO orders (user, total, created) VALUES (?, ?, ?)', (f'student-{worker}', '2.50', time.time())
+                ).lastrowid
+                conn.execute('INSERT INTO order_items (order_id, food_id, quantity) VALUES (?, ?, 1)', (order_id, food_id))
+                conn.execute('COMMIT')
+            except sqlite3.OperationalError:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+
+        def worker(index):
+            conn = connect() if persistent else None
+            committed, failed, latencies = 0, 0, []
+            barrier.wait()
+            for n in range(transactions):
+                started = time.perf_counter()
+                current = conn or connect()
+                try:
+                    checkout(current, index, n)
+                    committed += 1
+                    latencies.append(time.perf_counter() - started)
+                except sqlite3.OperationalError:
+                    failed += 1
+                finally:
+                    if not persistent:
+                        current.close()
+            if conn:
+                conn.close()
+            with lock:
+                results['committed'] += committed
+                results['failed'] += failed
+                results['latencies'].extend(latencies)
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return results['committed'], results['failed'], results['latencies'], elapsed
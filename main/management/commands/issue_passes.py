@@ -0,0 +1,27 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main import passes
+
+
+class Command(BaseCommand):
+    help = 'Issue QR passes for every user identifier in a CSV and write a ZIP of codes and a printable sheet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='CSV with one user identifier per row')
+        parser.add_argument('--output', help='ZIP path (default: qr-passes-<timestamp>.zip)')
+        parser.add_argument('--days', type=int, default=passes.PASS_VALIDITY_DAYS, help='Days until the passes expire')
+
+    def handle(self, *args, **options):
+        try:
+            text = Path(options['csv_file']).read_text(encoding='utf-8-sig')
+            identifiers = passes.read_identifiers(text)
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            raise CommandError(str(e))
+
+        issued = passes.issue_passes(identifiers, days=options['days'])
+        output = Path(options['output'] or f"qr-passes-{timezone.localtime().strftime('%Y%m%d-%H%M%S')}.zip")
+        output.write_bytes(passes.build_bundle(issued))
+        self.stdout.write(f'Issued {len(issued)} pass(es); codes written to {output}')
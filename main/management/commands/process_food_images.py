@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from main import images
+from main.menu import bump_menu_version
+from main.models import FoodItem
+
+
+class Command(BaseCommand):
+    help = 'Build resized WebP/JPEG variants for food images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild variants for every image')
+
+    def handle(self, *args, **options):
+        processed = 0
+        for item in FoodItem.objects.exclude(image='').exclude(image__isnull=True):
+            if item.image_variants and not options['force']:
+                continue
+            try:
+                images.process_stored(item)
+            except (OSError, ValueError) as e:
+                self.stderr.write(f'Skipped {item.name}: {e}')
+                continue
+            # update() so the menu is not invalidated once per item
+            FoodItem.objects.filter(pk=item.pk).update(image_variants=item.image_variants)
+            processed += 1
+        if processed:
+            bump_menu_version()
+        self.stdout.write(f'Processed {processed} image(s)')
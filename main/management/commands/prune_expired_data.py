@@ -0,0 +1,33 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import events, idempotency
+from main.ratelimit import prune_idle_buckets
+
+logger = logging.getLogger(__name__)
+
+# (what is deleted, function returning how many rows it deleted)
+STEPS = (
+    ('old live event(s)', events.prune),
+    ('old idempotency key(s)', idempotency.prune),
+    ('idle rate limit bucket(s)', prune_idle_buckets),
+)
+
+
+class Command(BaseCommand):
+    help = 'Delete old live events, idempotency keys and idle rate limit buckets (run from cron)'
+
+    def handle(self, *args, **options):
+        failed = []
+        for label, prune in STEPS:
+            # One failing step must not keep the others from running
+            try:
+                deleted = prune()
+            except Exception:
+                logger.exception('Could not delete %s', label)
+                failed.append(label)
+                continue
+            self.stdout.write(f'Deleted {deleted} {label}')
+        if failed:
+            raise CommandError(f"Failed to delete {', '.join(failed)}")
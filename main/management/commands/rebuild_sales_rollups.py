@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the SalesRollup table from all orders'
+
+    def handle(self, *args, **options):
+        rows = rebuild()
+        self.stdout.write(f'Rebuilt {rows} sales rollup row(s)')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from main import search
+
+
+class Command(BaseCommand):
+    help = 'Recreate the user_identifier search index and its triggers (SQLite only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if not search.supports_trigram(connection):
+            raise CommandError('This database has no FTS5 trigram support; search uses icontains instead')
+        search.install(connection)
+        self.stdout.write('Rebuilt the user_identifier search index')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.reservations import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Give back stock held by expired Stripe checkouts (run from cron)'
+
+    def handle(self, *args, **options):
+        released = release_expired_holds()
+        self.stdout.write(f'Released {released} expired stock hold(s)')
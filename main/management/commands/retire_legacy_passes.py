@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from main import passes
+from main.models import QRCodePass
+
+
+class Command(BaseCommand):
+    help = (
+        'Reissue or deactivate active QR passes hashed before lookup keys existed, '
+        'so QR_LEGACY_FALLBACK can be turned off'
+    )
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument('--reissue', action='store_true', help='Give each legacy pass a new code and write a ZIP of codes and a printable sheet')
+        action.add_argument('--deactivate', action='store_true', help='Deactivate every legacy pass')
+        parser.add_argument('--output', help='ZIP path for --reissue (default: legacy-passes-<timestamp>.zip)')
+        parser.add_argument('--days', type=int, default=passes.PASS_VALIDITY_DAYS, help='Days until reissued passes expire')
+
+    def handle(self, *args, **options):
+        legacy = QRCodePass.objects.filter(is_active=True, lookup_key__isnull=True)
+
+        if options['deactivate']:
+            count = legacy.update(is_active=False)
+            self.stdout.write(f'Deactivated {count} legacy pass(es)')
+        elif options['reissue']:
+            output = Path(options['output'] or f"legacy-passes-{timezone.localtime().strftime('%Y%m%d-%H%M%S')}.zip")
+            try:
+                # Keep the old codes if the new ones cannot be written out
+                with transaction.atomic():
+                    issued = passes.reissue_passes(legacy.order_by('pk'), days=options['days'])
+                    if not issued:
+                        self.stdout.write('No legacy passes to reissue')
+                        return
+                    output.write_bytes(passes.build_bundle(issued))
+            except OSError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f'Reissued {len(issued)} pass(es); codes written to {output}')
+        else:
+            self.stdout.write(
+                f'{legacy.count()} active legacy pass(es); run with --reissue or --deactivate, '
+                'then set QR_LEGACY_FALLBACK=0'
+            )
@@ -0,0 +1,81 @@
+"""Cached snapshot of the menu, keyed by a version token.
+
+The menu version is a random token kept in the shared cache. Any change to a
+FoodItem (saved or deleted through the ORM, or stock moved by a checkout)
+replaces the token after the transaction commits, which makes every cached
+snapshot and template fragment of the old menu unreachable at once. Readers
+only ever build a snapshot for the version they saw, so a stale menu can
+never be stored under a newer version.
+"""
+import json
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import events
+from .models import FoodItem
+
+MENU_VERSION_KEY = 'menu:version'
+
+
+def _new_version():
+	return f"{time.time_ns():x}{secrets.token_hex(2)}"
+
+
+def get_menu_version():
+	"""Current menu version token"""
+	version = cache.get(MENU_VERSION_KEY)
+	if version is None:
+		cache.add(MENU_VERSION_KEY, _new_version(), None)
+		version = cache.get(MENU_VERSION_KEY)
+	return version
+
+
+def bump_menu_version():
+	cache.set(MENU_VERSION_KEY, _new_version(), None)
+
+
+def invalidate_menu(food_item_ids=()):
+	"""Start a new menu version once the current transaction commits.
+	
+	Also tells live stock streams which items changed.
+	"""
+	transaction.on_commit(bump_menu_version)
+	if food_item_ids:
+		events.publish_stock(food_item_ids)
+
+
+def get_menu_items(version=None):
+	"""Available food items for a menu version, from the cache when possible"""
+	version = version or get_menu_version()
+	key = f'menu:items:{version}'
+	items = cache.get(key)
+	if items is None:
+		items = list(FoodItem.objects.filter(is_available=True).order_by('name'))
+		cache.set(key, items, settings.MENU_CACHE_SECONDS)
+	return items
+
+
+def get_menu_json(version=None):
+	"""Compact JSON of the menu for a version (see the /api/menu/ view)"""
+	version = version or get_menu_version()
+	key = f'menu:json:{version}'
+	payload = cache.get(key)
+	if payload is None:
+		payload = json.dumps({
+			'version': version,
+			'items': [
+				{
+					'id': item.id,
+					'name': item.name,
+					'price': str(item.price),
+					'available': item.available_count,
+				}
+				for item in get_menu_items(version)
+			],
+		}, separators=(',', ':'))
+		cache.set(key, payload, settings.MENU_CACHE_SECONDS)
+	return payload
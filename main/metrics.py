@@ -0,0 +1,320 @@
+"""Request metrics in the Prometheus text format.
+
+Each worker process keeps its own registry of counters and histograms.
+MetricsMiddleware times every request and records the queries it ran (a
+wrapper installed on each new database connection reports to the request
+through a context variable, so queries run by sync_to_async count too).
+InstrumentedFileBasedCache counts cache hits and misses, and stripe_call()
+times calls to the Stripe API.
+
+At most every METRICS_FLUSH_INTERVAL seconds, a worker writes its registry to
+METRICS_DIR/<pid>.json. The staff-only /metrics view adds up the files of
+running workers; files left by workers that have exited are removed, so the
+totals restart from zero (a counter reset to Prometheus) after a reload.
+"""
+import copy
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache.backends import filebased
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.urls import Resolver404, resolve
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# name: (type, help, buckets)
+METRICS = {
+	'bufet_request_duration_seconds': ('histogram', 'Time to produce a response, by route', LATENCY_BUCKETS),
+	'bufet_request_db_queries': ('histogram', 'Database queries per request, by route', QUERY_COUNT_BUCKETS),
+	'bufet_request_db_seconds': ('histogram', 'Time spent in database queries per request, by route', LATENCY_BUCKETS),
+	'bufet_cache_requests_total': ('counter', 'Cache lookups, by key prefix and result', None),
+	'bufet_stripe_request_duration_seconds': ('histogram', 'Stripe API call latency, by operation', LATENCY_BUCKETS),
+}
+
+UNMATCHED_ROUTE = '<unmatched>'
+SESSION_CACHE_PREFIX = 'django.contrib.sessions.'
+# Anything else is recorded as 'other', so clients cannot add label values
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+logger = logging.getLogger(__name__)
+
+
+class Registry:
+	"""Counters and histograms of this process, keyed by (name, labels)"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.samples = {}
+		self.flushed_at = 0.0
+
+	def inc(self, name, value=1, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.samples[key] = self.samples.get(key, 0) + value
+
+	def observe(self, name, value, **labels):
+		buckets = METRICS[name][2]
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			sample = self.samples.get(key)
+			if sample is None:
+				sample = self.samples[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+			for index, bound in enumerate(buckets):
+				if value <= bound:
+					sample['buckets'][index] += 1
+					break
+			sample['sum'] += value
+			sample['count'] += 1
+
+	def clear(self):
+		with self.lock:
+			self.samples.clear()
+
+	def snapshot(self):
+		with self.lock:
+			return [
+				{'name': name, 'labels': dict(labels), 'value': copy.deepcopy(sample)}
+				for (name, labels), sample in self.samples.items()
+			]
+
+	def flush(self):
+		"""Write this process's samples to METRICS_DIR/<pid>.json"""
+		directory = Path(settings.METRICS_DIR)
+		directory.mkdir(parents=True, exist_ok=True)
+		self.flushed_at = time.monotonic()
+		handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+		with os.fdopen(handle, 'w') as file:
+			json.dump(self.snapshot(), file)
+		# Readers never see a half-written file
+		os.replace(temp_path, directory / f'{os.getpid()}.json')
+
+	def maybe_flush(self):
+		if time.monotonic() - self.flushed_at >= settings.METRICS_FLUSH_INTERVAL:
+			try:
+				self.flush()
+			except OSError:
+				# Metrics must never fail a request
+				logger.exception('Could not write metrics', extra={'metrics_dir': str(settings.METRICS_DIR)})
+
+
+registry = Registry()
+
+# Query count and time of the request running in this context
+_request_stats = ContextVar('request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+	stats = _request_stats.get()
+	if stats is None:
+		return execute(sql, params, many, context)
+	started = time.perf_counter()
+	try:
+		return execute(sql, params, many, context)
+	finally:
+		stats['queries'] += 1
+		stats['seconds'] += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def install_query_wrapper(sender, connection, **kwargs):
+	# A connection object reconnects after CONN_MAX_AGE; install once
+	if record_query not in connection.execute_wrappers:
+		connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def stripe_call(operation):
+	"""Time a Stripe API call (the with block)"""
+	started = time.perf_counter()
+	outcome = 'error'
+	try:
+		yield
+		outcome = 'ok'
+	finally:
+		registry.observe('bufet_stripe_request_duration_seconds', time.perf_counter() - started, operation=operation, outcome=outcome)
+
+
+def _key_prefix(key):
+	# 'menu:items:<version>' -> 'menu'; session keys end in the random session key
+	if key.startswith(SESSION_CACHE_PREFIX):
+		return 'sessions'
+	return key.split(':', 1)[0] if ':' in key else 'other'
+
+
+def _count_lookup(key, hit):
+	registry.inc('bufet_cache_requests_total', prefix=_key_prefix(key), result='hit' if hit else 'miss')
+
+
+class InstrumentedFileBasedCache(filebased.FileBasedCache):
+	"""FileBasedCache that counts hits and misses by key prefix.
+	
+	get(), has_key() and add() are counted; add() is a hit when the key was
+	already there. get_many() and the async methods go through these, so they
+	count once per key.
+	"""
+
+	_missing = object()
+
+	def get(self, key, default=None, version=None):
+		value = super().get(key, self._missing, version)
+		hit = value is not self._missing
+		_count_lookup(key, hit)
+		return value if hit else default
+
+	def has_key(self, key, version=None):
+		hit = super().has_key(key, version)
+		_count_lookup(key, hit)
+		return hit
+
+	def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+		# FileBasedCache.add() would also count through self.has_key()
+		if super().has_key(key, version):
+			_count_lookup(key, True)
+			return False
+		self.set(key, value, timeout, version)
+		_count_lookup(key, False)
+		return True
+
+
+def _route(request):
+	match = request.resolver_match
+	if match is None:
+		# Answered before URL resolution, e.g. a 429 from the rate limiter
+		try:
+			match = resolve(request.path_info)
+		except Resolver404:
+			return UNMATCHED_ROUTE
+	return match.view_name or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+	"""Record latency and database work per route; place it first"""
+
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		self.is_async = iscoroutinefunction(get_response)
+		if self.is_async:
+			markcoroutinefunction(self)
+
+	def __call__(self, request):
+		if self.is_async:
+			return self.__acall__(request)
+		stats = {'queries': 0, 'seconds': 0.0}
+		token = _request_stats.set(stats)
+		started = time.perf_counter()
+		try:
+			response = self.get_response(request)
+		finally:
+			_request_stats.reset(token)
+		self.record(request, response, time.perf_counter() - started, stats)
+		return response
+
+	async def __acall__(self, request):
+		stats = {'queries': 0, 'seconds': 0.0}
+		# sync_to_async copies the context, so queries in worker threads count too
+		token = _request_stats.set(stats)
+		started = time.perf_counter()
+		try:
+			response = await self.get_response(request)
+		finally:
+			_request_stats.reset(token)
+		self.record(request, response, time.perf_counter() - started, stats)
+		return response
+
+	def record(self, request, response, elapsed, stats):
+		route = _route(request)
+		method = request.method if request.method in METHODS else 'other'
+		registry.observe('bufet_request_duration_seconds', elapsed, route=route, method=method, status=str(response.status_code))
+		registry.observe('bufet_request_db_queries', stats['queries'], route=route)
+		registry.observe('bufet_request_db_seconds', stats['seconds'], route=route)
+		registry.maybe_flush()
+
+
+def _process_alive(pid):
+	if os.name != 'posix':
+		# os.kill() would terminate the process on Windows; keep every file
+		return True
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		return True
+	return True
+
+
+def collect():
+	"""Samples of the running workers in METRICS_DIR, added up"""
+	totals = {}
+	for path in Path(settings.METRICS_DIR).glob('*.json'):
+		if path.stem.isdigit() and not _process_alive(int(path.stem)):
+			# Left by a worker that exited; its counts would never change again
+			path.unlink(missing_ok=True)
+			continue
+		try:
+			samples = json.loads(path.read_text())
+		except (OSError, ValueError):
+			# Removed or replaced while listing
+			continue
+		for sample in samples:
+			if sample['name'] not in METRICS:
+				continue
+			key = (sample['name'], tuple(sorted(sample['labels'].items())))
+			value = sample['value']
+			if key not in totals:
+				totals[key] = value
+			elif isinstance(value, dict):
+				total = totals[key]
+				total['buckets'] = [a + b for a, b in zip(total['buckets'], value['buckets'])]
+				total['sum'] += value['sum']
+				total['count'] += value['count']
+			else:
+				totals[key] += value
+	return totals
+
+
+def _escape(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+	if not labels:
+		return ''
+	return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def render(totals):
+	"""Prometheus text exposition format (version 0.0.4)"""
+	lines = []
+	for name, (metric_type, help_text, buckets) in METRICS.items():
+		lines.append(f'# HELP {name} {help_text}')
+		lines.append(f'# TYPE {name} {metric_type}')
+		for (sample_name, labels), value in sorted(totals.items()):
+			if sample_name != name:
+				continue
+			if metric_type == 'counter':
+				lines.append(f'{name}{_labels(labels)} {value}')
+				continue
+			cumulative = 0
+			for bound, count in zip(buckets, value['buckets']):
+				cumulative += count
+				lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+			lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {value["count"]}')
+			lines.append(f'{name}_sum{_labels(labels)} {value["sum"]}')
+			lines.append(f'{name}_count{_labels(labels)} {value["count"]}')
+	return '\n'.join(lines) + '\n'
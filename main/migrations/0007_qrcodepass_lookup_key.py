@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_order_paid_at_order_payment_method_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='qrcodepass',
+            name='lookup_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-17 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fooditem',
+            name='reserved_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pendingcheckout',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 6.0.1 on 2026-10-17 17:50
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def build_rollups(apps, schema_editor):
+    """Fill SalesRollup from the orders that already exist"""
+    Order = apps.get_model('main', 'Order')
+    OrderItem = apps.get_model('main', 'OrderItem')
+    SalesRollup = apps.get_model('main', 'SalesRollup')
+
+    totals = defaultdict(lambda: [0, 0, Decimal('0.00')])
+    days = {}
+    for order in Order.objects.only('id', 'created_at', 'payment_status', 'payment_method', 'total_amount').iterator():
+        day = days[order.id] = timezone.localdate(order.created_at)
+        for dimension in ('payment_status', 'payment_method'):
+            row = totals[(day, dimension, getattr(order, dimension))]
+            row[0] += 1
+            row[2] += order.total_amount
+    food_orders = defaultdict(set)
+    for item in OrderItem.objects.only('order_id', 'food_item_id', 'quantity', 'unit_price').iterator():
+        key = (days[item.order_id], 'food_item', str(item.food_item_id))
+        food_orders[key].add(item.order_id)
+        totals[key][1] += item.quantity
+        totals[key][2] += item.unit_price * item.quantity
+    for key, order_ids in food_orders.items():
+        totals[key][0] = len(order_ids)
+
+    SalesRollup.objects.bulk_create([
+        SalesRollup(day=day, dimension=dimension, key=key, order_count=count, quantity=quantity, total_amount=amount)
+        for (day, dimension, key), (count, quantity, amount) in totals.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('dimension', models.CharField(choices=[('payment_status', 'Payment status'), ('payment_method', 'Payment method'), ('food_item', 'Food item')], max_length=20)),
+                ('key', models.CharField(max_length=100)),
+                ('order_count', models.IntegerField(default=0)),
+                ('quantity', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'ordering': ['-day', 'dimension', 'key'],
+                'constraints': [models.UniqueConstraint(fields=('day', 'dimension', 'key'), name='unique_sales_rollup')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0.1 on 2026-10-17 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_order_status_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='stripe_session_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-created_at', '-id'], name='order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='order_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_status', '-created_at', '-id'], name='order_payment_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='qrcodepass',
+            index=models.Index(fields=['-created_at'], name='qrpass_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='qrcodepass',
+            index=models.Index(fields=['is_active', '-created_at'], name='qrpass_active_created_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 6.0.1 on 2026-10-17 17:10
+
+from django.db import migrations
+
+# Frozen copy of the DDL main/search.py had when this migration was written,
+# so later changes to that module do not change what this migration does
+TABLES = ('main_order', 'main_qrcodepass')
+
+
+def install_search_index(apps, schema_editor):
+    """FTS5 trigram index on user_identifier (SQLite only, see main/search.py)"""
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or connection.Database.sqlite_version_info < (3, 34, 0):
+        return
+    with connection.cursor() as cursor:
+        for table in TABLES:
+            index = f'{table}_search'
+            cursor.execute(f'DROP TABLE IF EXISTS "{index}"')
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE "{index}" USING fts5('
+                f"user_identifier, content='{table}', content_rowid='id', tokenize='trigram')"
+            )
+            for trigger in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{index}_{trigger}"')
+            cursor.execute(
+                f'CREATE TRIGGER "{index}_ai" AFTER INSERT ON "{table}" BEGIN '
+                f'INSERT INTO "{index}"(rowid, user_identifier) VALUES (new.id, new.user_identifier); END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER "{index}_ad" AFTER DELETE ON "{table}" BEGIN '
+                f'INSERT INTO "{index}"("{index}", rowid, user_identifier) VALUES (\'delete\', old.id, old.user_identifier); END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER "{index}_au" AFTER UPDATE OF user_identifier ON "{table}" BEGIN '
+                f'INSERT INTO "{index}"("{index}", rowid, user_identifier) VALUES (\'delete\', old.id, old.user_identifier); '
+                f'INSERT INTO "{index}"(rowid, user_identifier) VALUES (new.id, new.user_identifier); END'
+            )
+            cursor.execute(f'INSERT INTO "{index}"("{index}") VALUES (\'rebuild\')')
+
+
+def remove_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            index = f'{table}_search'
+            for trigger in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{index}_{trigger}"')
+            cursor.execute(f'DROP TABLE IF EXISTS "{index}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, remove_search_index),
+    ]
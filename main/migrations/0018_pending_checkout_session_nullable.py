@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_food_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pendingcheckout',
+            name='stripe_session_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-17 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0019_idempotency_key_request_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='salesrollup',
+            index=models.Index(fields=['dimension', 'key'], name='salesrollup_dimension_key_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0.1 on 2026-10-17 21:30
+
+from django.db import migrations, models
+
+
+def copy_image_size(apps, schema_editor):
+    # Reads only the stored columns; no image file is opened, so rows whose
+    # file is missing are copied (or skipped when their size is NULL) safely
+    FoodItem = apps.get_model('main', 'FoodItem')
+    rows = FoodItem.objects.filter(image_width__isnull=False, image_height__isnull=False)
+    for pk, width, height, variants in rows.values_list('pk', 'image_width', 'image_height', 'image_variants'):
+        variants = dict(variants or {})
+        variants['original'] = {'width': width, 'height': height}
+        FoodItem.objects.filter(pk=pk).update(image_variants=variants)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_salesrollup_dimension_key_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fooditem',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to='food_items/'),
+        ),
+        migrations.RunPython(copy_image_size, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='fooditem',
+            name='image_height',
+        ),
+        migrations.RemoveField(
+            model_name='fooditem',
+            name='image_width',
+        ),
+    ]
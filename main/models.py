@@ -1,6 +1,8 @@
 from django.db import models
 from django.utils import timezone
-from django.contrib.auth.hashers import make_password, check_password
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.utils.crypto import constant_time_compare, salted_hmac
 import secrets
 from datetime import timedelta
 
@@ -8,8 +10,11 @@ class FoodItem(models.Model):
     name = models.CharField(max_length=200)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_count = models.IntegerField(default=0)
+    reserved_count = models.IntegerField(default=0)  # Held for unpaid Stripe checkouts
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='food_items/', blank=True, null=True)
+    # Size of the stored image and its resized WebP/JPEG copies, see main/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -19,9 +24,17 @@ class FoodItem(models.Model):
     
     def __str__(self):
         return f"{self.name} - €{self.price}"
+    
+    @property
+    def available_count(self):
+        """Stock that is not held by a pending checkout"""
+        return max(0, self.stock_count - self.reserved_count)
 
 class QRCodePass(models.Model):
     code_hash = models.CharField(max_length=255, unique=True)  # Hashed QR code
+    # Keyed fingerprint of the raw code, used to find the pass with one indexed
+    # lookup. NULL for passes issued before fingerprints existed.
+    lookup_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
@@ -29,8 +42,14 @@ class QRCodePass(models.Model):
     use_count = models.IntegerField(default=0)  # How many times it was used
     user_identifier = models.CharField(max_length=100, blank=True)  # Optional: link to user
     
+    TOKEN_HASH_PREFIX = 'hmac_sha256$'
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='qrpass_created_idx'),
+            models.Index(fields=['is_active', '-created_at'], name='qrpass_active_created_idx'),
+        ]
     
     def __str__(self):
         return f"Pass (Active: {self.is_active}, Uses: {self.use_count})"
@@ -40,13 +59,70 @@ class QRCodePass(models.Model):
         """Generate a cryptographically secure random token"""
         return secrets.token_urlsafe(32)
     
+    @staticmethod
+    def make_lookup_key(raw_code):
+        """Deterministic keyed fingerprint of a raw code (safe to index)"""
+        return salted_hmac(
+            'main.QRCodePass.lookup_key', raw_code,
+            secret=settings.QR_TOKEN_SECRET, algorithm='sha256'
+        ).hexdigest()
+    
+    @staticmethod
+    def make_code_hash(raw_code):
+        """Keyed HMAC-SHA256 of a raw code.
+        
+        Codes are 256-bit random tokens, so a slow password hasher adds no
+        security here; a keyed hash is enough and costs microseconds.
+        """
+        digest = salted_hmac(
+            'main.QRCodePass.code_hash', raw_code,
+            secret=settings.QR_TOKEN_SECRET, algorithm='sha256'
+        ).hexdigest()
+        return f'{QRCodePass.TOKEN_HASH_PREFIX}{digest}'
+    
+    @classmethod
+    def find_by_code(cls, raw_code):
+        """Return the active pass matching raw_code, or None.
+        
+        Passes with a lookup key are found with a single indexed query and
+        verified once. Legacy passes without one are checked the old way (one
+        PBKDF2 run each) and get upgraded by check_code() on a successful
+        match, until QR_LEGACY_FALLBACK is turned off after
+        `manage.py retire_legacy_passes`.
+        """
+        lookup_key = cls.make_lookup_key(raw_code)
+        qr_pass = cls.objects.filter(lookup_key=lookup_key, is_active=True).first()
+        if qr_pass is not None:
+            return qr_pass if qr_pass.check_code(raw_code) else None
+        
+        if not settings.QR_LEGACY_FALLBACK:
+            return None
+        for qr_pass in cls.objects.filter(is_active=True, lookup_key__isnull=True):
+            if qr_pass.check_code(raw_code):
+                return qr_pass
+        return None
+    
     def set_code(self, raw_code):
         """Hash and store the QR code securely"""
-        self.code_hash = make_password(raw_code)
+        self.code_hash = self.make_code_hash(raw_code)
+        self.lookup_key = self.make_lookup_key(raw_code)
     
     def check_code(self, raw_code):
-        """Verify the raw code against the stored hash"""
-        return check_password(raw_code, self.code_hash)
+        """Verify the raw code against the stored hash.
+        
+        Legacy PBKDF2 hashes are rehashed with the token hasher (and given a
+        lookup key) the first time they verify successfully.
+        """
+        if self.code_hash.startswith(self.TOKEN_HASH_PREFIX):
+            return constant_time_compare(self.code_hash, self.make_code_hash(raw_code))
+        
+        if not check_password(raw_code, self.code_hash):
+            return False
+        
+        self.set_code(raw_code)
+        if self.pk:
+            self.save(update_fields=['code_hash', 'lookup_key'])
+        return True
     
     def is_valid(self):
         """Check if the pass is still valid"""
@@ -64,6 +140,12 @@ class QRCodePass(models.Model):
         self.use_count += 1
         self.used_at = timezone.now()
         self.save()
+    
+    async def amark_used(self):
+        """Async version of mark_used() for the async scan view"""
+        self.use_count += 1
+        self.used_at = timezone.now()
+        await self.asave()
 
 
 class Order(models.Model):
@@ -77,18 +159,42 @@ class Order(models.Model):
         ('failed', 'Failed'),
         ('cancelled', 'Cancelled'),
     )
+    ORDER_STATUSES = (
+        ('pending', 'Pending'),
+        ('paid', 'Paid'),
+        ('preparing', 'Preparing'),
+        ('ready', 'Ready'),
+        ('collected', 'Collected'),
+        ('cancelled', 'Cancelled'),
+    )
+    # Statuses still in the kitchen queue
+    OPEN_STATUSES = ('pending', 'paid', 'preparing', 'ready')
+    # Target status -> statuses an order may move to it from
+    STATUS_TRANSITIONS = {
+        'preparing': ('pending', 'paid'),
+        'ready': ('pending', 'paid', 'preparing'),
+        'collected': ('ready',),
+        'cancelled': ('pending', 'paid', 'preparing', 'ready'),
+    }
 
     user_identifier = models.CharField(max_length=100, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    status = models.CharField(max_length=20, default='pending')
+    status = models.CharField(max_length=20, choices=ORDER_STATUSES, default='pending')
+    version = models.PositiveIntegerField(default=0)  # Bumped on every status change (optimistic locking)
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHODS, default='in_person')
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUSES, default='pending')
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    stripe_session_id = models.CharField(max_length=255, blank=True)
+    stripe_session_id = models.CharField(max_length=255, blank=True, db_index=True)
     paid_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Newest-first listing and the (created_at, id) keyset pagination
+            models.Index(fields=['-created_at', '-id'], name='order_created_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='order_status_created_idx'),
+            models.Index(fields=['payment_status', '-created_at', '-id'], name='order_payment_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} - {self.total_amount}"
@@ -105,3 +211,92 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.food_item.name} x{self.quantity}"
+
+
+class SalesRollup(models.Model):
+    """Per-day sales totals, kept up to date as orders change (see main.rollups)"""
+    DIMENSIONS = (
+        ('payment_status', 'Payment status'),
+        ('payment_method', 'Payment method'),
+        ('food_item', 'Food item'),
+    )
+
+    day = models.DateField()
+    dimension = models.CharField(max_length=20, choices=DIMENSIONS)
+    key = models.CharField(max_length=100)  # Status/method value, or food item id
+    order_count = models.IntegerField(default=0)
+    quantity = models.IntegerField(default=0)  # Items sold (food_item rows only)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['-day', 'dimension', 'key']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'dimension', 'key'], name='unique_sales_rollup'),
+        ]
+        indexes = [
+            # rollups.summary() groups one dimension by key across all days
+            models.Index(fields=['dimension', 'key'], name='salesrollup_dimension_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.dimension}={self.key}: {self.order_count} orders, €{self.total_amount}"
+
+
+class PendingCheckout(models.Model):
+    """Cart of a Stripe Checkout session waiting to be turned into an order"""
+    # Empty (NULL) from when the stock is held until Stripe has created the session
+    stripe_session_id = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    user_identifier = models.CharField(max_length=100, blank=True)
+    items = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)  # Set once, when finalised
+    order = models.OneToOneField(Order, null=True, blank=True, on_delete=models.SET_NULL, related_name='pending_checkout')
+    error = models.CharField(max_length=255, blank=True)  # Why a paid checkout produced no order
+    # While set, the cart's quantities are counted in FoodItem.reserved_count
+    hold_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Checkout {self.stripe_session_id or f'#{self.pk}'} ({'completed' if self.completed_at else 'pending'})"
+
+
+class IdempotencyKey(models.Model):
+    """Stored result of a request made with an Idempotency-Key header (see main.idempotency)"""
+    key = models.CharField(max_length=64, unique=True)  # sha256 of scope, session and client key
+    request_hash = models.CharField(max_length=64, blank=True)  # sha256 of the request body
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)  # NULL while in progress
+    response_body = models.JSONField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.key[:12]}... ({self.response_status or 'in progress'})"
+
+
+class LiveEvent(models.Model):
+    """Append-only log of stock/order changes tailed by main.events for live streams"""
+    KINDS = (
+        ('stock', 'Stock'),
+        ('order', 'Order'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.kind} event #{self.id}"
+
+
+class RateLimitBucket(models.Model):
+    """Token bucket state shared by all worker processes (see main.ratelimit)"""
+    key = models.CharField(max_length=200, primary_key=True)
+    tokens = models.FloatField()
+    updated_at = models.FloatField()  # Unix timestamp of the last refill
+
+    def __str__(self):
+        return f"{self.key} ({self.tokens:.1f} tokens)"
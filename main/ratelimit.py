@@ -0,0 +1,123 @@
+"""Token bucket rate limiting shared across worker processes.
+
+Buckets live in the database (RateLimitBucket), so every worker sees the same
+counts. Taking a token is one conditional UPDATE that refills the bucket for
+the elapsed time and subtracts a token only if at least one is available, so
+concurrent requests cannot both spend the last token.
+
+Limits are configured per path in settings.RATE_LIMITS:
+
+    RATE_LIMITS = {
+        '/api/scan-qr/': {'rate': 10, 'per': 60},
+        '/login/': {'rate': 5, 'per': 60, 'methods': ['POST']},
+    }
+
+``rate`` requests are allowed per ``per`` seconds (the bucket capacity), and
+tokens trickle back continuously rather than all at once at the end of a
+window. ``methods`` defaults to POST only.
+
+Buckets are keyed by REMOTE_ADDR. Client-supplied X-Forwarded-For headers are
+ignored, since anyone could change them to get a fresh bucket. Behind a
+reverse proxy, the server sets REMOTE_ADDR from the proxy's header
+(start_asgi.sh runs Uvicorn with --proxy-headers). A bucket left alone for
+the longest ``per`` is full again, which is the same as having no row, so
+prune_idle_buckets() deletes it.
+"""
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Least
+from django.http import HttpResponse, JsonResponse
+
+from .models import RateLimitBucket
+
+
+def get_client_ip(request):
+	"""Client IP address as seen by the server (never a client-supplied header)"""
+	return request.META.get('REMOTE_ADDR', '')
+
+
+def consume(key, rate, per, now=None):
+	"""Take one token from the bucket for key. Returns False when empty."""
+	now = time.time() if now is None else now
+	refill_per_second = rate / per
+	available = Least(
+		Value(float(rate)),
+		F('tokens') + (Value(now) - F('updated_at')) * Value(refill_per_second)
+	)
+
+	for _ in range(2):
+		updated = (
+			RateLimitBucket.objects
+			.filter(key=key)
+			.alias(available=available)
+			.filter(available__gte=1)
+			.update(tokens=available - 1, updated_at=now)
+		)
+		if updated:
+			return True
+		if RateLimitBucket.objects.filter(key=key).exists():
+			return False
+		try:
+			with transaction.atomic():
+				RateLimitBucket.objects.create(key=key, tokens=rate - 1, updated_at=now)
+			return True
+		except IntegrityError:
+			# Another request created the bucket first; retry the update
+			continue
+	return False
+
+
+def prune_idle_buckets(now=None):
+	"""Delete buckets that have refilled completely. Returns how many."""
+	longest = max((rule['per'] for rule in getattr(settings, 'RATE_LIMITS', {}).values()), default=0)
+	cutoff = (time.time() if now is None else now) - longest
+	deleted, _ = RateLimitBucket.objects.filter(updated_at__lt=cutoff).delete()
+	return deleted
+
+
+class RateLimitMiddleware:
+	"""Apply settings.RATE_LIMITS to matching request paths, keyed by client IP"""
+
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		self.limits = getattr(settings, 'RATE_LIMITS', {})
+		self.is_async = iscoroutinefunction(get_response)
+		if self.is_async:
+			markcoroutinefunction(self)
+
+	def bucket(self, request):
+		"""(key, rate, per) of the bucket this request spends from, or None"""
+		rule = self.limits.get(request.path)
+		if rule and request.method in rule.get('methods', ['POST']):
+			return f"{request.path}:{get_client_ip(request)}", rule['rate'], rule['per']
+		return None
+
+	def __call__(self, request):
+		if self.is_async:
+			return self.__acall__(request)
+		bucket = self.bucket(request)
+		if bucket and not consume(*bucket):
+			return self.too_many_requests(request)
+		return self.get_response(request)
+
+	async def __acall__(self, request):
+		bucket = self.bucket(request)
+		if bucket and not await sync_to_async(consume)(*bucket):
+			return self.too_many_requests(request)
+		return await self.get_response(request)
+
+	def too_many_requests(self, request):
+		message = 'Too many attempts. Please wait a minute.'
+		if request.path.startswith('/api/'):
+			return JsonResponse({
+				'success': False,
+				'message': message
+			}, status=429)
+		return HttpResponse(message, status=429, content_type='text/plain')
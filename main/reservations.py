@@ -0,0 +1,142 @@
+"""Time-limited stock holds for Stripe checkouts.
+
+Creating a Stripe Checkout session holds the cart's quantities by adding them
+to FoodItem.reserved_count, so nobody else can buy that stock while the
+student is paying. Available stock is ``stock_count - reserved_count``.
+
+A hold belongs to a PendingCheckout and lasts until its hold_expires_at. The
+row is written in the same transaction as the hold, before Stripe is called,
+so every hold is visible to the sweeper even if the request dies halfway.
+Paying turns the hold into a sale. Expired holds are given back in bulk by
+``python manage.py release_expired_holds``, and a checkout.session.expired
+webhook gives its hold back right away. Every change to the counters is a
+single conditional UPDATE over all lines of the cart.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .menu import invalidate_menu
+from .models import FoodItem, PendingCheckout
+
+
+def _quantities(item_map):
+	return Case(
+		*[When(id=item_id, then=Value(qty)) for item_id, qty in item_map.items()],
+		output_field=IntegerField()
+	)
+
+
+def cart_item_map(items):
+	"""{food item id: quantity} for a cart stored on a PendingCheckout"""
+	item_map = Counter()
+	for item in items:
+		item_map[item['id']] += item['quantity']
+	return dict(item_map)
+
+
+def hold_expiry():
+	"""When a hold taken now expires"""
+	return timezone.now() + timedelta(seconds=settings.STOCK_HOLD_SECONDS)
+
+
+def hold_stock(item_map):
+	"""Reserve item_map quantities. Returns False (holding nothing) if any line lacks stock."""
+	quantities = _quantities(item_map)
+	with transaction.atomic():
+		held = FoodItem.objects.filter(
+			id__in=item_map.keys(),
+			is_available=True,
+			stock_count__gte=F('reserved_count') + quantities
+		).update(reserved_count=F('reserved_count') + quantities)
+		if held != len(item_map):
+			transaction.set_rollback(True)
+			return False
+		invalidate_menu(item_map.keys())
+	return True
+
+
+def release_stock(item_map):
+	"""Give back a hold taken with hold_stock()"""
+	quantities = _quantities(item_map)
+	FoodItem.objects.filter(id__in=item_map.keys()).update(
+		reserved_count=F('reserved_count') - quantities
+	)
+	invalidate_menu(item_map.keys())
+
+
+def hold_checkout(item_map, user_identifier):
+	"""Hold the cart and record its PendingCheckout (no Stripe session yet).
+	
+	Returns None, holding nothing, if any line lacks stock.
+	"""
+	with transaction.atomic():
+		if not hold_stock(item_map):
+			return None
+		return PendingCheckout.objects.create(
+			user_identifier=user_identifier,
+			items=[{'id': item_id, 'quantity': qty} for item_id, qty in item_map.items()],
+			hold_expires_at=hold_expiry()
+		)
+
+
+def cancel_checkout(pending_id):
+	"""Give back the hold of a checkout that never got a Stripe session, and drop it"""
+	with transaction.atomic():
+		pending = PendingCheckout.objects.filter(
+			pk=pending_id,
+			stripe_session_id__isnull=True,
+			hold_expires_at__isnull=False
+		).only('items').first()
+		if pending is None:
+			return False
+		# Conditional, so the hold is given back once even if the sweeper got there first
+		deleted, _ = PendingCheckout.objects.filter(
+			pk=pending.pk,
+			hold_expires_at__isnull=False
+		).delete()
+		if deleted:
+			release_stock(cart_item_map(pending.items))
+		return bool(deleted)
+
+
+def release_checkout_hold(stripe_session_id):
+	"""Release the hold of one unfinished checkout (e.g. when Stripe expires it)"""
+	with transaction.atomic():
+		pending = PendingCheckout.objects.filter(
+			stripe_session_id=stripe_session_id,
+			completed_at__isnull=True,
+			hold_expires_at__isnull=False
+		).only('items').first()
+		if pending is None:
+			return False
+		released = PendingCheckout.objects.filter(
+			pk=pending.pk,
+			hold_expires_at__isnull=False
+		).update(hold_expires_at=None)
+		if released:
+			release_stock(cart_item_map(pending.items))
+		return bool(released)
+
+
+def release_expired_holds(now=None):
+	"""Release every expired hold with one UPDATE per table. Returns how many."""
+	now = now or timezone.now()
+	with transaction.atomic():
+		expired = list(
+			PendingCheckout.objects.select_for_update()
+			.filter(hold_expires_at__lt=now)
+			.only('id', 'items')
+		)
+		if not expired:
+			return 0
+		PendingCheckout.objects.filter(pk__in=[p.pk for p in expired]).update(hold_expires_at=None)
+		item_map = Counter()
+		for pending in expired:
+			item_map.update(cart_item_map(pending.items))
+		release_stock(dict(item_map))
+	return len(expired)
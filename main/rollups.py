@@ -0,0 +1,175 @@
+"""Incrementally maintained sales totals.
+
+SalesRollup keeps one row per day for each payment status, payment method and
+food item. The rows are updated in the same transaction that creates an order
+or changes its payment status, so reports read a few precomputed rows instead
+of aggregating the whole Order table.
+
+If the rows drift (for example after orders are deleted or edited outside the
+app), ``python manage.py rebuild_sales_rollups`` recomputes them from scratch.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Order, OrderItem, SalesRollup
+
+
+def _day(order):
+	return timezone.localdate(order.created_at)
+
+
+def _bump(day, dimension, key, order_count=0, quantity=0, total_amount=Decimal('0.00')):
+	"""Add to one rollup row, creating it if needed"""
+	key = str(key)
+	for _ in range(2):
+		updated = SalesRollup.objects.filter(day=day, dimension=dimension, key=key).update(
+			order_count=F('order_count') + order_count,
+			quantity=F('quantity') + quantity,
+			total_amount=F('total_amount') + total_amount
+		)
+		if updated:
+			return
+		try:
+			with transaction.atomic():
+				SalesRollup.objects.create(
+					day=day, dimension=dimension, key=key,
+					order_count=order_count, quantity=quantity, total_amount=total_amount
+				)
+			return
+		except IntegrityError:
+			# Created concurrently; add to it instead
+			continue
+
+
+def _bump_many(day, deltas):
+	"""Add to several rollup rows of one day with a single UPDATE.
+	
+	deltas maps (dimension, key) to (order_count, quantity, total_amount).
+	Rows that do not exist yet (the first sale of the day) are then inserted
+	together; only if another transaction created some of them first are they
+	added to row by row.
+	"""
+	deltas = {(dimension, str(key)): delta for (dimension, key), delta in deltas.items()}
+	match = Q()
+	for dimension, key in deltas:
+		match |= Q(dimension=dimension, key=key)
+
+	def delta_case(index, output_field):
+		return Case(
+			*[When(dimension=dimension, key=key, then=Value(delta[index])) for (dimension, key), delta in deltas.items()],
+			output_field=output_field
+		)
+
+	updated = SalesRollup.objects.filter(match, day=day).update(
+		order_count=F('order_count') + delta_case(0, IntegerField()),
+		quantity=F('quantity') + delta_case(1, IntegerField()),
+		total_amount=F('total_amount') + delta_case(2, DecimalField(max_digits=12, decimal_places=2))
+	)
+	if updated == len(deltas):
+		return
+
+	existing = set(SalesRollup.objects.filter(match, day=day).values_list('dimension', 'key'))
+	missing = {row: delta for row, delta in deltas.items() if row not in existing}
+	try:
+		with transaction.atomic():
+			SalesRollup.objects.bulk_create([
+				SalesRollup(
+					day=day, dimension=dimension, key=key,
+					order_count=order_count, quantity=quantity, total_amount=total_amount
+				)
+				for (dimension, key), (order_count, quantity, total_amount) in missing.items()
+			])
+	except IntegrityError:
+		# Some were created concurrently; nothing was inserted, so add to each
+		for (dimension, key), (order_count, quantity, total_amount) in missing.items():
+			_bump(day, dimension, key, order_count, quantity, total_amount)
+
+
+def record_order(order, lines):
+	"""Count a new order. lines is an iterable of (food_item_id, quantity, unit_price)."""
+	deltas = {
+		('payment_status', order.payment_status): (1, 0, order.total_amount),
+		('payment_method', order.payment_method): (1, 0, order.total_amount),
+	}
+	for food_item_id, quantity, unit_price in lines:
+		deltas[('food_item', food_item_id)] = (1, quantity, unit_price * quantity)
+	_bump_many(_day(order), deltas)
+
+
+def record_payment_status_change(order, old_status):
+	"""Move an order from old_status to its current payment_status"""
+	if old_status == order.payment_status:
+		return
+	_bump_many(_day(order), {
+		('payment_status', old_status): (-1, 0, -order.total_amount),
+		('payment_status', order.payment_status): (1, 0, order.total_amount),
+	})
+
+
+def summary_rows(dimension='payment_status'):
+	"""Rollup rows of one dimension summed across all days, grouped by key"""
+	return (
+		SalesRollup.objects.filter(dimension=dimension)
+		.values('key')
+		.annotate(order_count=Sum('order_count'), total=Sum('total_amount'))
+	)
+
+
+def summary():
+	"""Totals across all days per payment status: {status: {'order_count', 'total_amount'}}"""
+	rows = summary_rows()
+	totals = defaultdict(lambda: {'order_count': 0, 'total_amount': Decimal('0.00')})
+	for row in rows:
+		totals[row['key']] = {
+			'order_count': row['order_count'],
+			'total_amount': (row['total'] or Decimal('0.00')).quantize(Decimal('0.01'))
+		}
+	return totals
+
+
+def rebuild():
+	"""Recompute every rollup row from Order and OrderItem. Returns the row count."""
+	rollups = []
+	for dimension in ('payment_status', 'payment_method'):
+		rows = (
+			Order.objects.annotate(day=TruncDate('created_at'))
+			.values('day', dimension)
+			.annotate(order_count=Count('id'), total=Sum('total_amount'))
+			.order_by()
+		)
+		rollups += [
+			SalesRollup(
+				day=row['day'], dimension=dimension, key=row[dimension],
+				order_count=row['order_count'], total_amount=row['total']
+			)
+			for row in rows
+		]
+
+	line_total = ExpressionWrapper(F('unit_price') * F('quantity'), output_field=DecimalField(max_digits=12, decimal_places=2))
+	rows = (
+		OrderItem.objects.annotate(day=TruncDate('order__created_at'))
+		.values('day', 'food_item_id')
+		.annotate(
+			order_count=Count('order_id', distinct=True),
+			items=Sum('quantity'),
+			total=Sum(line_total)
+		)
+		.order_by()
+	)
+	rollups += [
+		SalesRollup(
+			day=row['day'], dimension='food_item', key=str(row['food_item_id']),
+			order_count=row['order_count'], quantity=row['items'], total_amount=row['total']
+		)
+		for row in rows
+	]
+
+	with transaction.atomic():
+		SalesRollup.objects.all().delete()
+		SalesRollup.objects.bulk_create(rollups, batch_size=500)
+	return len(rollups)
@@ -0,0 +1,135 @@
+"""Substring search on user_identifier for orders and QR passes.
+
+On SQLite every searchable table gets an FTS5 index with the trigram
+tokenizer, so ``contains`` queries of three or more characters are answered
+from the index instead of a LIKE '%...%' scan over the whole table. The index
+is an external-content FTS table: it stores only the trigrams, and triggers
+on the source table keep it in step with inserts, updates, deletes and bulk
+operations that bypass model signals.
+
+Other databases, SQLite builds without trigram support and shorter queries
+fall back to ``icontains``.
+
+SQLite rebuilds a table when a migration alters some of its columns, which
+drops the triggers. is_available() then reports the index as unusable (and
+logs a warning), so search falls back to ``icontains`` rather than returning
+stale rows. ``python manage.py rebuild_search_index`` reinstalls the triggers
+and reindexes the existing rows.
+"""
+import logging
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+from .models import Order, QRCodePass
+
+# The trigram tokenizer cannot match anything shorter than one trigram
+MIN_QUERY_LENGTH = 3
+
+SEARCH_FIELD = 'user_identifier'
+SEARCH_MODELS = (Order, QRCodePass)
+TRIGGERS = ('ai', 'ad', 'au')
+
+# Per database alias: whether the FTS tables and triggers are installed
+_available = {}
+
+logger = logging.getLogger(__name__)
+
+
+def index_table(model):
+	return f"{model._meta.db_table}_search"
+
+
+def supports_trigram(connection):
+	"""The trigram tokenizer needs SQLite 3.34+ built with FTS5"""
+	return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 34, 0)
+
+
+def install(connection, models=SEARCH_MODELS):
+	"""Create (or recreate) the FTS tables and triggers and index existing rows"""
+	with connection.cursor() as cursor:
+		for model in models:
+			table = model._meta.db_table
+			index = index_table(model)
+			cursor.execute(f'DROP TABLE IF EXISTS "{index}"')
+			cursor.execute(
+				f'CREATE VIRTUAL TABLE "{index}" USING fts5('
+				f"{SEARCH_FIELD}, content='{table}', content_rowid='id', tokenize='trigram')"
+			)
+			for trigger in TRIGGERS:
+				cursor.execute(f'DROP TRIGGER IF EXISTS "{index}_{trigger}"')
+			cursor.execute(
+				f'CREATE TRIGGER "{index}_ai" AFTER INSERT ON "{table}" BEGIN '
+				f'INSERT INTO "{index}"(rowid, {SEARCH_FIELD}) VALUES (new.id, new.{SEARCH_FIELD}); END'
+			)
+			cursor.execute(
+				f'CREATE TRIGGER "{index}_ad" AFTER DELETE ON "{table}" BEGIN '
+				f'INSERT INTO "{index}"("{index}", rowid, {SEARCH_FIELD}) VALUES (\'delete\', old.id, old.{SEARCH_FIELD}); END'
+			)
+			cursor.execute(
+				f'CREATE TRIGGER "{index}_au" AFTER UPDATE OF {SEARCH_FIELD} ON "{table}" BEGIN '
+				f'INSERT INTO "{index}"("{index}", rowid, {SEARCH_FIELD}) VALUES (\'delete\', old.id, old.{SEARCH_FIELD}); '
+				f'INSERT INTO "{index}"(rowid, {SEARCH_FIELD}) VALUES (new.id, new.{SEARCH_FIELD}); END'
+			)
+			cursor.execute(f'INSERT INTO "{index}"("{index}") VALUES (\'rebuild\')')
+	_available.pop(connection.alias, None)
+
+
+def uninstall(connection, models=SEARCH_MODELS):
+	with connection.cursor() as cursor:
+		for model in models:
+			index = index_table(model)
+			for trigger in TRIGGERS:
+				cursor.execute(f'DROP TRIGGER IF EXISTS "{index}_{trigger}"')
+			cursor.execute(f'DROP TABLE IF EXISTS "{index}"')
+	_available.pop(connection.alias, None)
+
+
+def missing_objects(connection):
+	"""Names of the FTS tables and triggers that are not in the database"""
+	expected = {('table', index_table(model)) for model in SEARCH_MODELS} | {
+		('trigger', f'{index_table(model)}_{trigger}') for model in SEARCH_MODELS for trigger in TRIGGERS
+	}
+	with connection.cursor() as cursor:
+		cursor.execute("SELECT type, name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+		present = set(cursor.fetchall())
+	return sorted(name for object_type, name in expected - present)
+
+
+def is_available(using='default'):
+	"""Whether the FTS tables and their triggers exist (checked once per process)"""
+	if using not in _available:
+		connection = connections[using]
+		missing = missing_objects(connection) if supports_trigram(connection) else None
+		if missing:
+			# Without its triggers the index goes stale; icontains stays correct
+			logger.warning(
+				'Search index incomplete, using icontains; run manage.py rebuild_search_index',
+				extra={'missing': missing}
+			)
+		_available[using] = missing == []
+	return _available[using]
+
+
+def match_phrase(query):
+	"""Quote the query as a single FTS5 phrase so operators in it are literal"""
+	return '"' + query.replace('"', '""') + '"'
+
+
+def filter_contains(queryset, query):
+	"""Narrow queryset to rows whose user_identifier contains query (case-insensitive).
+
+	The queryset keeps its own ordering, so callers that paginate on it
+	(newest first) are unaffected.
+	"""
+	query = query.strip()
+	if not query:
+		return queryset
+	if len(query) < MIN_QUERY_LENGTH or not is_available(queryset.db):
+		return queryset.filter(**{f'{SEARCH_FIELD}__icontains': query})
+
+	index = index_table(queryset.model)
+	return queryset.filter(id__in=RawSQL(
+		f'SELECT rowid FROM "{index}" WHERE "{index}" MATCH %s', (match_phrase(query),)
+	))
+
@@ -0,0 +1,75 @@
+"""Session housekeeping that keeps page views read-only on the database.
+
+SESSION_SAVE_EVERY_REQUEST is off, so a session is only written when its
+contents change. QR sessions have a fixed lifetime from the scan (checked
+against qr_auth_time in the views), so they never need refreshing. Staff
+sessions still slide: they are re-saved at most once per
+SESSION_REFRESH_INTERVAL seconds while the user is active.
+
+Expired rows of the database-backed engines are removed at most once per
+SESSION_PRUNE_INTERVAL seconds across all workers. A cache.add() on a
+shared key decides which request does the cleanup.
+"""
+import time
+from importlib import import_module
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+PRUNE_LOCK_KEY = 'sessions:prune'
+REFRESHED_KEY = '_refreshed_at'
+
+
+def prune_expired_sessions():
+	"""Delete expired sessions unless another worker did so recently"""
+	if not cache.add(PRUNE_LOCK_KEY, 1, settings.SESSION_PRUNE_INTERVAL):
+		return False
+	import_module(settings.SESSION_ENGINE).SessionStore.clear_expired()
+	return True
+
+
+async def aprune_expired_sessions():
+	if not await cache.aadd(PRUNE_LOCK_KEY, 1, settings.SESSION_PRUNE_INTERVAL):
+		return False
+	await sync_to_async(import_module(settings.SESSION_ENGINE).SessionStore.clear_expired)()
+	return True
+
+
+class SessionMaintenanceMiddleware:
+	"""Refresh active staff sessions sparingly and prune expired sessions"""
+
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		self.is_async = iscoroutinefunction(get_response)
+		if self.is_async:
+			markcoroutinefunction(self)
+
+	def __call__(self, request):
+		if self.is_async:
+			return self.__acall__(request)
+		response = self.get_response(request)
+
+		user = getattr(request, 'user', None)
+		if user is not None and user.is_authenticated:
+			now = int(time.time())
+			if now - request.session.get(REFRESHED_KEY, 0) >= settings.SESSION_REFRESH_INTERVAL:
+				# Saved (and the cookie re-sent) by SessionMiddleware on the way out
+				request.session[REFRESHED_KEY] = now
+
+		prune_expired_sessions()
+		return response
+
+	async def __acall__(self, request):
+		response = await self.get_response(request)
+
+		if hasattr(request, 'auser') and (await request.auser()).is_authenticated:
+			now = int(time.time())
+			if now - await request.session.aget(REFRESHED_KEY, 0) >= settings.SESSION_REFRESH_INTERVAL:
+				await request.session.aset(REFRESHED_KEY, now)
+
+		await aprune_expired_sessions()
+		return response
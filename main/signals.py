@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import images
+from .menu import invalidate_menu
+from .models import FoodItem
+
+
+@receiver(pre_save, sender=FoodItem)
+def process_food_image(sender, instance, raw=False, **kwargs):
+    """Resize, strip and build variants of a newly uploaded image"""
+    if raw:
+        return
+    if instance.image and not instance.image._committed:
+        images.process_upload(instance)
+    elif not instance.image and instance.image_variants:
+        images.delete_variants(instance.image_variants)
+        instance.image_variants = {}
+
+
+@receiver(post_save, sender=FoodItem)
+@receiver(post_delete, sender=FoodItem)
+def food_item_changed(sender, instance, **kwargs):
+    invalidate_menu([instance.pk])
@@ -0,0 +1,48 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from main import images
+
+register = template.Library()
+
+# The menu grid tiles are at most about 250 CSS pixels wide
+DEFAULT_SIZES = '(max-width: 480px) 45vw, 220px'
+
+
+def _srcset(variants, image_format):
+    return format_html_join(
+        ', ', '{} {}w',
+        ((default_storage.url(variant[image_format]), variant['width']) for variant in variants)
+    )
+
+
+@register.simple_tag
+def food_picture(item, css_class='food-image', sizes=DEFAULT_SIZES):
+    """Responsive, lazily loaded <picture> for a FoodItem image.
+
+    Uses the WebP/JPEG variants from main.images when they exist and falls
+    back to the stored image otherwise.
+    """
+    variants = sorted(
+        (variant for name, variant in (item.image_variants or {}).items() if name in images.VARIANT_SIZES),
+        key=lambda variant: variant['width']
+    )
+    if not variants:
+        size = images.image_size(item)
+        return format_html(
+            '<img src="{}" alt="{}" class="{}"{} loading="lazy" decoding="async">',
+            item.image.url, item.name, css_class,
+            format_html(' width="{}" height="{}"', *size) if size else ''
+        )
+
+    fallback = variants[0]
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}" loading="lazy" decoding="async">'
+        '</picture>',
+        _srcset(variants, 'webp'), sizes,
+        default_storage.url(fallback['jpeg']), _srcset(variants, 'jpeg'), sizes,
+        fallback['width'], fallback['height'], item.name, css_class
+    )
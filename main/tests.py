@@ -1,3 +1,1624 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.templatetags.static import static
+from PIL import Image
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+
+from . import events, images, menu, metrics, ratelimit, reservations, rollups, search, sessions
+from .logs import JSONFormatter
+from .management.commands import prune_expired_data
+from .urls import urlpatterns
+from .views import _decode_order_cursor, _encode_order_cursor
+from .models import (
+    FoodItem, IdempotencyKey, LiveEvent, Order, OrderItem, PendingCheckout, QRCodePass, RateLimitBucket, SalesRollup,
+)
+
+
+def authenticated_client(user_identifier='student'):
+    """Test client with a QR-authenticated session"""
+    client = Client()
+    session = client.session
+    session['qr_authenticated'] = True
+    session['user_identifier'] = user_identifier
+    session['qr_auth_time'] = timezone.now().isoformat()
+    session.save()
+    # Cookie-based engines change the key when the contents change
+    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+    return client
+
+
+def use_temporary_cache(test):
+    """Point the default cache at an empty directory for the rest of a test.
+
+    Keeps tests that clear or count the cache away from the real one in
+    BASE_DIR/.django_cache (and the sessions stored in it).
+    """
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    test.enterContext(override_settings(CACHES={'default': {**settings.CACHES['default'], 'LOCATION': directory.name}}))
+
+
+def run_concurrently(fn, jobs, workers=16):
+    """Run fn(job) for every job on `workers` threads started together.
+
+    Returns (results, latencies in seconds, wall time in seconds). Each thread
+    uses its own database connection and closes it when done.
+    """
+    results = [None] * len(jobs)
+    latencies = [0.0] * len(jobs)
+    next_job = iter(range(len(jobs)))
+    lock = threading.Lock()
+    barrier = threading.Barrier(workers)
+
+    def worker():
+        try:
+            barrier.wait()
+            while True:
+                with lock:
+                    index = next(next_job, None)
+                if index is None:
+                    return
+                started = time.perf_counter()
+                results[index] = fn(jobs[index])
+                latencies[index] = time.perf_counter() - started
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, latencies, time.perf_counter() - started
+
+
+def report(name, latencies, elapsed):
+    """Print throughput and p50/p99 latency for a concurrent run when BENCH=1"""
+    if os.getenv('BENCH') != '1':
+        return
+    ordered = sorted(latencies)
+    p50 = statistics.median(ordered) * 1000
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000
+    print(
+        f"\n[bench] {name}: {len(ordered)} requests in {elapsed:.2f}s "
+        f"({len(ordered) / elapsed:.1f} req/s), p50 {p50:.1f}ms, p99 {p99:.1f}ms"
+    )
+
+
+def signed_webhook(payload, secret):
+    """Body and Stripe-Signature header for a webhook event"""
+    body = json.dumps(payload)
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{body}".encode(), hashlib.sha256).hexdigest()
+    return body, f"t={timestamp},v1={signature}"
+
+
+class StripeStub:
+    """In-process stand-in for the parts of the Stripe API the views use"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def create(self, **kwargs):
+        with self.lock:
+            session_id = f"cs_test_{len(self.sessions) + 1}"
+            session = SimpleNamespace(
+                id=session_id,
+                url=f"https://checkout.stripe.test/{session_id}",
+                payment_status='paid',
+                metadata=kwargs.get('metadata', {}),
+                expires_at=kwargs.get('expires_at'),
+            )
+            self.sessions[session_id] = session
+        return session
+
+    def retrieve(self, session_id):
+        return self.sessions[session_id]
+
+    async def create_async(self, **kwargs):
+        return self.create(**kwargs)
+
+    async def retrieve_async(self, session_id):
+        return self.retrieve(session_id)
+
+
+# Transactions must really commit for other threads to see them, so these
+# tests use TransactionTestCase against the file-backed test database. Run
+# them with BENCH=1 to print throughput and p50/p99 latency.
+@override_settings(RATE_LIMITS={})
+class ConcurrentCheckoutTests(TransactionTestCase):
+    CHECKOUTS = 200
+    WORKERS = 16
+
+    def setUp(self):
+        self.sandwich = FoodItem.objects.create(name='Sandwich', price='2.50', stock_count=50)
+        self.juice = FoodItem.objects.create(name='Juice', price='1.20', stock_count=80)
+
+    def assert_stock_consistent(self, food, initial_stock):
+        food.refresh_from_db()
+        sold = OrderItem.objects.filter(food_item=food).aggregate(total=Sum('quantity'))['total'] or 0
+        self.assertGreaterEqual(food.stock_count, 0)
+        self.assertEqual(initial_stock - food.stock_count, sold)
+        return sold
+
+    def test_concurrent_orders_do_not_oversell(self):
+        clients = [authenticated_client(f"student-{i}") for i in range(self.WORKERS)]
+        cart = json.dumps({'items': [
+            {'id': self.sandwich.id, 'quantity': 1},
+            {'id': self.juice.id, 'quantity': 1},
+        ]})
+
+        def checkout(index):
+            client = clients[index % len(clients)]
+            return client.post('/api/orders/', cart, content_type='application/json').status_code
+
+        # Sold-out checkouts are expected 400s, not errors
+        with self.assertNoLogs('main', 'ERROR'):
+            statuses, latencies, elapsed = run_concurrently(checkout, list(range(self.CHECKOUTS)), self.WORKERS)
+        report('create_order', latencies, elapsed)
+
+        self.assertEqual(set(statuses) - {200, 400}, set())
+        placed = statuses.count(200)
+        self.assertEqual(placed, 50)
+        self.assertEqual(Order.objects.count(), placed)
+        self.assertEqual(self.assert_stock_consistent(self.sandwich, 50), placed)
+        self.assertEqual(self.assert_stock_consistent(self.juice, 80), placed)
+
+    def test_retried_order_with_same_idempotency_key_is_placed_once(self):
+        owner = authenticated_client()
+        cart = json.dumps({'items': [{'id': self.sandwich.id, 'quantity': 3}]})
+
+        def submit(_):
+            client = Client()
+            client.cookies = owner.cookies
+            response = client.post(
+                '/api/orders/', cart,
+                content_type='application/json', HTTP_IDEMPOTENCY_KEY='retry-me'
+            )
+            return response.status_code, response.json().get('order_id')
+
+        with self.assertNoLogs('main', 'ERROR'):
+            results, latencies, elapsed = run_concurrently(submit, list(range(40)), self.WORKERS)
+        report('create_order (same key)', latencies, elapsed)
+
+        self.assertEqual({status for status, _ in results} - {200, 409}, set())
+        self.assertEqual(Order.objects.count(), 1)
+        order = Order.objects.get()
+        self.assertEqual({order_id for status, order_id in results if status == 200}, {order.id})
+
+        status, order_id = submit(None)
+        self.assertEqual((status, order_id), (200, order.id))
+        self.assertEqual(self.assert_stock_consistent(self.sandwich, 50), 3)
+
+    @override_settings(STRIPE_SECRET_KEY='sk_test_stub')
+    def test_concurrent_stripe_completions_do_not_oversell(self):
+        stripe_stub = StripeStub()
+        client = authenticated_client()
+        cart = json.dumps({'items': [{'id': self.sandwich.id, 'quantity': 1}]})
+
+        with mock.patch('stripe.checkout.Session.create_async', stripe_stub.create_async), \
+                mock.patch('stripe.checkout.Session.retrieve_async', stripe_stub.retrieve_async):
+            statuses = [
+                client.post('/api/stripe-session/', cart, content_type='application/json').status_code
+                for _ in range(self.CHECKOUTS // 2)
+            ]
+            # Only as many checkouts as there is stock can hold it
+            self.assertEqual(statuses.count(200), 50)
+            self.assertEqual(set(statuses), {200, 400})
+
+            def complete(session_id):
+                response = Client().get('/payments/stripe-success/', {'session_id': session_id})
+                return response['Location']
+
+            with self.assertNoLogs('main', 'ERROR'):
+                locations, latencies, elapsed = run_concurrently(complete, list(stripe_stub.sessions), self.WORKERS)
+        report('stripe_success', latencies, elapsed)
+
+        completed = [location for location in locations if 'payment=success' in location]
+        self.assertEqual(len(completed), 50)
+        self.assertEqual(Order.objects.filter(payment_status='paid').count(), 50)
+        self.assertEqual(
+            Order.objects.values('stripe_session_id').distinct().count(),
+            Order.objects.count()
+        )
+        self.assertEqual(self.assert_stock_consistent(self.sandwich, 50), 50)
+        self.assertEqual(self.sandwich.reserved_count, 0)
+
+    @override_settings(STRIPE_SECRET_KEY='sk_test_stub')
+    def test_expired_holds_are_released(self):
+        stripe_stub = StripeStub()
+        cart = json.dumps({'items': [{'id': self.sandwich.id, 'quantity': 20}]})
+        with mock.patch('stripe.checkout.Session.create_async', stripe_stub.create_async):
+            for _ in range(2):
+                response = authenticated_client().post('/api/stripe-session/', cart, content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+            response = authenticated_client().post('/api/stripe-session/', cart, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+        self.sandwich.refresh_from_db()
+        self.assertEqual((self.sandwich.stock_count, self.sandwich.available_count), (50, 10))
+
+        PendingCheckout.objects.update(hold_expires_at=timezone.now() - timedelta(seconds=1))
+        call_command('release_expired_holds', stdout=StringIO())
+        self.sandwich.refresh_from_db()
+        self.assertEqual((self.sandwich.stock_count, self.sandwich.reserved_count), (50, 0))
+        self.assertFalse(PendingCheckout.objects.filter(hold_expires_at__isnull=False).exists())
+
+    @override_settings(STRIPE_SECRET_KEY='sk_test_stub', STRIPE_WEBHOOK_SECRET='whsec_test')
+    def test_duplicate_webhook_deliveries_create_one_order(self):
+        stripe_stub = StripeStub()
+        cart = json.dumps({'items': [{'id': self.sandwich.id, 'quantity': 2}]})
+        with mock.patch('stripe.checkout.Session.create_async', stripe_stub.create_async):
+            response = authenticated_client().post('/api/stripe-session/', cart, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        session_id = next(iter(stripe_stub.sessions))
+
+        body, signature = signed_webhook({
+            'id': 'evt_test',
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'data': {'object': {'id': session_id, 'object': 'checkout.session', 'payment_status': 'paid'}},
+        }, 'whsec_test')
+
+        def deliver(_):
+            return Client().post(
+                '/payments/stripe-webhook/', body,
+                content_type='application/json', HTTP_STRIPE_SIGNATURE=signature
+            ).status_code
+
+        with self.assertNoLogs('main', 'ERROR'):
+            statuses, latencies, elapsed = run_concurrently(deliver, list(range(40)), self.WORKERS)
+        report('stripe_webhook', latencies, elapsed)
+
+        self.assertEqual(set(statuses), {200})
+        self.assertEqual(Order.objects.filter(stripe_session_id=session_id).count(), 1)
+        self.assertEqual(self.assert_stock_consistent(self.sandwich, 50), 2)
+
+        response = Client().get('/payments/stripe-success/', {'session_id': session_id})
+        order = Order.objects.get(stripe_session_id=session_id)
+        self.assertEqual(response['Location'], f'/success/?payment=success&order_id={order.id}')
+
+    @override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+    def test_webhook_rejects_bad_signature(self):
+        body, _ = signed_webhook({'type': 'checkout.session.completed'}, 'whsec_test')
+        response = Client().post(
+            '/payments/stripe-webhook/', body,
+            content_type='application/json', HTTP_STRIPE_SIGNATURE='t=1,v1=bad'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class StockHoldTests(TestCase):
+    def setUp(self):
+        self.sandwich = FoodItem.objects.create(name='Sandwich', price='2.50', stock_count=5)
+        self.cart = json.dumps({'items': [{'id': self.sandwich.id, 'quantity': 2}]})
+        self.stripe_stub = StripeStub()
+        self.enterContext(override_settings(STRIPE_SECRET_KEY='sk_test_stub', STRIPE_WEBHOOK_SECRET=''))
+        self.enterContext(mock.patch('stripe.checkout.Session.create_async', self.stripe_stub.create_async))
+        self.enterContext(mock.patch('stripe.checkout.Session.retrieve_async', self.stripe_stub.retrieve_async))
+
+    def test_checkout_is_recorded_with_its_hold(self):
+        response = authenticated_client().post('/api/stripe-session/', self.cart, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        pending = PendingCheckout.objects.get()
+        self.assertEqual(pending.stripe_session_id, next(iter(self.stripe_stub.sessions)))
+        self.assertIsNotNone(pending.hold_expires_at)
+        self.sandwich.refresh_from_db()
+        self.assertEqual(self.sandwich.reserved_count, 2)
+
+    def test_stripe_session_outlasts_stripes_minimum_and_ends_before_the_hold(self):
+        authenticated_client().post('/api/stripe-session/', self.cart, content_type='application/json')
+        expires_at = next(iter(self.stripe_stub.sessions.values())).expires_at
+        # Stripe rejects sessions that expire less than 30 minutes from now
+        self.assertGreaterEqual(expires_at, (timezone.now() + timedelta(minutes=30)).timestamp())
+        hold_expires_at = PendingCheckout.objects.get().hold_expires_at
+        self.assertLessEqual(expires_at, (hold_expires_at - timedelta(minutes=5)).timestamp())
+
+    def test_failed_stripe_call_gives_the_hold_back(self):
+        with mock.patch('stripe.checkout.Session.create_async', side_effect=RuntimeError('Stripe is down')), \
+                self.assertLogs('main.views', 'ERROR'), self.assertLogs('django.request', 'ERROR'):
+            response = authenticated_client().post('/api/stripe-session/', self.cart, content_type='application/json')
+        self.assertEqual(response.status_code, 500)
+        self.sandwich.refresh_from_db()
+        self.assertEqual(self.sandwich.reserved_count, 0)
+        self.assertFalse(PendingCheckout.objects.exists())
+
+    def test_unfulfilable_paid_checkout_releases_its_hold(self):
+        authenticated_client().post('/api/stripe-session/', self.cart, content_type='application/json')
+        session_id = next(iter(self.stripe_stub.sessions))
+        # Staff take the item off the menu while the student is paying
+        FoodItem.objects.filter(pk=self.sandwich.pk).update(is_available=False)
+
+        response = Client().get('/payments/stripe-success/', {'session_id': session_id})
+        self.assertEqual(response['Location'], '/payment-error/')
+        pending = PendingCheckout.objects.get()
+        self.assertEqual(pending.error, 'Some items are unavailable')
+        self.assertIsNone(pending.hold_expires_at)
+        self.sandwich.refresh_from_db()
+        self.assertEqual((self.sandwich.stock_count, self.sandwich.reserved_count), (5, 0))
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.sandwich = FoodItem.objects.create(name='Sandwich', price='2.50', stock_count=10)
+        self.client = authenticated_client()
+
+    def order(self, quantity, key='order-1'):
+        cart = json.dumps({'items': [{'id': self.sandwich.id, 'quantity': quantity}]})
+        return self.client.post('/api/orders/', cart, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_repeat_is_replayed_only_for_the_same_body(self):
+        first = self.order(2)
+        self.assertEqual(first.status_code, 200)
+        replay = self.order(2)
+        self.assertEqual((replay.status_code, replay.json()), (200, first.json()))
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+
+        self.assertEqual(self.order(3).status_code, 422)
+        self.assertEqual(self.order(3, key='order-2').status_code, 200)
+        self.assertEqual(list(Order.objects.values_list('items__quantity', flat=True).order_by('id')), [2, 3])
+
+    def test_old_keys_are_pruned_from_cron(self):
+        self.order(1, key='old')
+        self.order(1, key='new')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_RETENTION + 1))
+        self.order(1, key='fresh')
+        out = StringIO()
+        call_command('prune_expired_data', stdout=out)
+        self.assertIn('Deleted 2 old idempotency key(s)', out.getvalue())
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+
+class RateLimitTests(TransactionTestCase):
+    """Token buckets; a TransactionTestCase so threads share committed buckets"""
+
+    def test_capacity_then_continuous_refill(self):
+        for _ in range(3):
+            self.assertTrue(ratelimit.consume('k', rate=3, per=60, now=1000.0))
+        self.assertFalse(ratelimit.consume('k', rate=3, per=60, now=1000.0))
+        # One token comes back every 20 seconds, never more than the capacity
+        self.assertFalse(ratelimit.consume('k', rate=3, per=60, now=1019.0))
+        self.assertTrue(ratelimit.consume('k', rate=3, per=60, now=1020.5))
+        self.assertFalse(ratelimit.consume('k', rate=3, per=60, now=1020.5))
+        for _ in range(3):
+            self.assertTrue(ratelimit.consume('k', rate=3, per=60, now=5000.0))
+        self.assertFalse(ratelimit.consume('k', rate=3, per=60, now=5000.0))
+
+    def test_concurrent_requests_cannot_share_the_last_token(self):
+        self.assertTrue(ratelimit.consume('last', rate=2, per=3600))
+
+        def take(_):
+            return ratelimit.consume('last', rate=2, per=3600)
+
+        results, _, _ = run_concurrently(take, list(range(32)))
+        self.assertEqual(results.count(True), 1)
+
+    @override_settings(RATE_LIMITS={'/login/': {'rate': 2, 'per': 60}})
+    def test_only_post_is_limited_by_default(self):
+        client = Client()
+        for _ in range(4):
+            self.assertEqual(client.get('/login/').status_code, 200)
+        statuses = [client.post('/login/', {'username': 'x', 'password': 'y'}).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    @override_settings(RATE_LIMITS={'/login/': {'rate': 1, 'per': 60}})
+    def test_forwarded_for_header_does_not_give_a_new_bucket(self):
+        client = Client()
+        self.assertEqual(client.post('/login/', HTTP_X_FORWARDED_FOR='10.0.0.1').status_code, 200)
+        self.assertEqual(client.post('/login/', HTTP_X_FORWARDED_FOR='10.0.0.2').status_code, 429)
+        self.assertEqual(RateLimitBucket.objects.count(), 1)
+
+    @override_settings(RATE_LIMITS={'/a/': {'rate': 5, 'per': 60}, '/b/': {'rate': 5, 'per': 600}})
+    def test_idle_buckets_are_pruned(self):
+        ratelimit.consume('idle', rate=5, per=60, now=1000.0)
+        ratelimit.consume('active', rate=5, per=60, now=1500.0)
+        # Idle for longer than the longest window: the bucket is full anyway
+        self.assertEqual(ratelimit.prune_idle_buckets(now=1700.0), 1)
+        self.assertEqual(list(RateLimitBucket.objects.values_list('key', flat=True)), ['active'])
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.sandwich = FoodItem.objects.create(name='Sandwich', price='2.50', stock_count=50)
+        self.juice = FoodItem.objects.create(name='Juice', price='1.20', stock_count=50)
+
+    def rollup_rows(self):
+        return sorted(SalesRollup.objects.values_list(
+            'day', 'dimension', 'key', 'order_count', 'quantity', 'total_amount'
+        ))
+
+    def test_incremental_rollups_match_rebuild(self):
+        client = authenticated_client()
+        for cart in (
+            [{'id': self.sandwich.id, 'quantity': 2}],
+            [{'id': self.sandwich.id, 'quantity': 1}, {'id': self.juice.id, 'quantity': 3}],
+        ):
+            response = client.post('/api/orders/', json.dumps({'items': cart}), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        order = Order.objects.first()
+        order.payment_status = 'paid'
+        order.save()
+        rollups.record_payment_status_change(order, 'pending')
+
+        incremental = self.rollup_rows()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.rollup_rows())
+
+        totals = rollups.summary()
+        self.assertEqual(totals['paid']['order_count'], 1)
+        self.assertEqual(totals['pending']['order_count'], 1)
+        self.assertEqual(totals['paid']['total_amount'] + totals['pending']['total_amount'], Decimal('11.10'))
+
+    def admin_order_form(self, order=None, **fields):
+        """POST data for the Order admin add/change form, items inline included"""
+        items = list(order.items.all()) if order else []
+        data = {
+            'user_identifier': order.user_identifier if order else 'Counter',
+            'status': order.status if order else 'pending',
+            'payment_method': order.payment_method if order else 'in_person',
+            'payment_status': order.payment_status if order else 'pending',
+            'paid_at_0': '', 'paid_at_1': '',
+            'items-TOTAL_FORMS': len(items), 'items-INITIAL_FORMS': len(items),
+            'items-MIN_NUM_FORMS': 0, 'items-MAX_NUM_FORMS': 1000,
+        }
+        for index, item in enumerate(items):
+            data[f'items-{index}-id'] = item.id
+            data[f'items-{index}-order'] = order.id
+        data.update(fields)
+        return data
+
+    def test_admin_order_edits_keep_rollups_in_step(self):
+        cart = [{'id': self.sandwich.id, 'quantity': 2}, {'id': self.juice.id, 'quantity': 1}]
+        response = authenticated_client().post('/api/orders/', json.dumps({'items': cart}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get()
+        staff = Client()
+        staff.force_login(User.objects.create_superuser('rollup-admin', password='x'))
+
+        response = staff.post(
+            reverse('admin:main_order_change', args=[order.id]), self.admin_order_form(order, payment_status='paid')
+        )
+        self.assertEqual(response.status_code, 302)
+        response = staff.post(reverse('admin:main_order_add'), self.admin_order_form())
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.count(), 2)
+
+        incremental = self.rollup_rows()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.rollup_rows())
+        self.assertEqual(rollups.summary()['paid']['order_count'], 1)
+
+
+class KitchenQueueTests(TestCase):
+    def setUp(self):
+        self.staff = Client()
+        self.staff.force_login(User.objects.create_user('cook', password='x', is_staff=True))
+        self.orders = [Order.objects.create(user_identifier=f'student-{i}', total_amount='2.50') for i in range(3)]
+
+    def set_status(self, order, status, version):
+        return self.staff.post(
+            f'/api/kitchen/orders/{order.id}/status/',
+            json.dumps({'status': status, 'version': version}), content_type='application/json'
+        )
+
+    def test_queue_lists_open_orders_oldest_first(self):
+        Order.objects.filter(id=self.orders[0].id).update(status='collected')
+        response = self.staff.get('/api/kitchen/orders/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([order['id'] for order in response.json()['orders']], [o.id for o in self.orders[1:]])
+        self.assertEqual(authenticated_client().get('/api/kitchen/orders/').status_code, 403)
+
+    def test_stale_version_is_rejected(self):
+        order = self.orders[0]
+        self.assertEqual(self.set_status(order, 'preparing', 0).status_code, 200)
+        response = self.set_status(order, 'ready', 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['order']['version'], 1)
+        self.assertEqual(self.set_status(order, 'ready', 1).status_code, 200)
+        # collected -> preparing is not an allowed transition
+        self.assertEqual(self.set_status(order, 'collected', 2).status_code, 200)
+        self.assertEqual(self.set_status(order, 'preparing', 3).status_code, 409)
+
+    def test_bulk_status_updates_only_allowed_orders(self):
+        Order.objects.filter(id=self.orders[0].id).update(status='ready')
+        ids = [order.id for order in self.orders]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.staff.post(
+                '/api/kitchen/orders/bulk-status/',
+                json.dumps({'ids': ids, 'status': 'collected'}), content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 1)
+        order_updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "main_order"')]
+        self.assertEqual(len(order_updates), 1)
+        self.assertEqual(
+            dict(Order.objects.values_list('id', 'status')),
+            {ids[0]: 'collected', ids[1]: 'pending', ids[2]: 'pending'}
+        )
+
+    def test_bulk_status_publishes_only_changed_orders(self):
+        Order.objects.filter(id=self.orders[0].id).update(status='preparing')
+        ids = [order.id for order in self.orders]
+        response = self.staff.post(
+            '/api/kitchen/orders/bulk-status/',
+            json.dumps({'ids': ids, 'status': 'preparing'}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 2)
+        published = sorted(event.payload['id'] for event in LiveEvent.objects.filter(kind='order'))
+        self.assertEqual(published, ids[1:])
+        self.assertEqual(Order.objects.get(id=ids[0]).version, 0)
+
+
+class OrderPaginationTests(TestCase):
+    def setUp(self):
+        self.staff = Client()
+        self.staff.force_login(User.objects.create_user('ops', password='x', is_staff=True))
+        start = timezone.now() - timedelta(days=1)
+        # Three orders share a created_at, so the page boundary falls inside a tie
+        times = [start, start + timedelta(minutes=1)] + [start + timedelta(minutes=2)] * 3 + [
+            start + timedelta(minutes=3), start + timedelta(minutes=4)
+        ]
+        for index, created_at in enumerate(times):
+            order = Order.objects.create(user_identifier=f'Student {index}', status='ready' if index % 2 else 'pending')
+            Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        self.newest_first = list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def get_page(self, query):
+        response = self.staff.get('/admin/orders/?' + query)
+        self.assertEqual(response.status_code, 200)
+        links = dict(re.findall(r'href="\?([^"]*)">(← Newer|Older →)</a>', response.content.decode()))
+        links = {label: query.replace('&amp;', '&') for query, label in links.items()}
+        return [order.id for order in response.context['orders']], links
+
+    def test_walks_older_then_newer_across_ties(self):
+        pages = []
+        ids, links = self.get_page('per_page=2')
+        pages.append(ids)
+        self.assertNotIn('← Newer', links)
+        while 'Older →' in links:
+            ids, links = self.get_page(links['Older →'])
+            pages.append(ids)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        self.assertEqual(sum(pages, []), self.newest_first)
+
+        newer_pages = [pages[-1]]
+        while '← Newer' in links:
+            ids, links = self.get_page(links['← Newer'])
+            newer_pages.append(ids)
+        self.assertEqual(newer_pages[::-1], pages)
+
+    def test_filters_are_carried_across_pages(self):
+        ready = list(Order.objects.filter(status='ready').order_by('-created_at', '-id').values_list('id', flat=True))
+        ids, links = self.get_page('status=ready&per_page=2')
+        self.assertIn('status=ready', links['Older →'])
+        self.assertIn('per_page=2', links['Older →'])
+        older_ids, links = self.get_page(links['Older →'])
+        self.assertEqual(ids + older_ids, ready[:4])
+        self.assertIn('status=ready', links['← Newer'])
+        self.assertEqual(self.get_page(links['← Newer'])[0], ids)
+
+    def test_cursor_round_trip_and_malformed_cursors(self):
+        order = Order.objects.get(pk=self.newest_first[3])
+        self.assertEqual(_decode_order_cursor(_encode_order_cursor(order)), (order.created_at, order.id))
+        for cursor in ('', 'abc', '12', '1-2-3', '-5-1', '1.5-2', f'{10 ** 30}-1'):
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(_decode_order_cursor(cursor))
+                self.assertEqual(self.get_page(f'per_page=2&before={cursor}')[0], self.newest_first[:2])
+                self.assertEqual(self.get_page(f'per_page=2&after={cursor}')[0], self.newest_first[:2])
+
+    def test_per_page_is_clamped(self):
+        Order.objects.bulk_create([Order(user_identifier='bulk') for _ in range(200)])
+        self.assertEqual(len(self.get_page('per_page=0')[0]), 1)
+        self.assertEqual(len(self.get_page('per_page=-3')[0]), 1)
+        self.assertEqual(len(self.get_page('per_page=500')[0]), 200)
+        self.assertEqual(len(self.get_page('per_page=lots')[0]), settings.ADMIN_ORDERS_PAGE_SIZE)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.staff = Client()
+        self.staff.force_login(User.objects.create_user('ops', password='x', is_staff=True))
+        sandwich = FoodItem.objects.create(name='Sandwich', price='2.50', stock_count=50)
+        juice = FoodItem.objects.create(name='Juice, "fresh"', price='1.20', stock_count=50)
+        self.orders = []
+        for created_at, status, payment_status in (
+            ('2026-03-01T00:00:00', 'collected', 'paid'),
+            ('2026-03-02T23:59:59', 'pending', 'pending'),
+            ('2026-03-03T00:00:00', 'collected', 'paid'),
+        ):
+            order = Order.objects.create(user_identifier='Ana', status=status, payment_status=payment_status, total_amount='6.20')
+            OrderItem.objects.create(order=order, food_item=sandwich, quantity=2, unit_price='2.50')
+            OrderItem.objects.create(order=order, food_item=juice, quantity=1, unit_price='1.20')
+            Order.objects.filter(pk=order.pk).update(created_at=timezone.make_aware(datetime.fromisoformat(created_at)))
+            self.orders.append(order)
+
+    def export(self, **params):
+        response = self.staff.get('/admin/orders/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def csv_rows(self, **params):
+        _, body = self.export(format='csv', **params)
+        return list(csv.DictReader(io.StringIO(body)))
+
+    def test_csv_items_and_orders(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertRegex(response['Content-Disposition'], r'attachment; filename="items-\d{8}\.csv"')
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(
+            [(row['order_id'], row['food_item'], row['quantity'], row['unit_price'], row['line_total']) for row in rows[:2]],
+            [(str(self.orders[0].pk), 'Sandwich', '2', '2.50', '5.00'), (str(self.orders[0].pk), 'Juice, "fresh"', '1', '1.20', '1.20')]
+        )
+
+        rows = self.csv_rows(kind='orders')
+        self.assertEqual([int(row['order_id']) for row in rows], [order.pk for order in self.orders])
+        self.assertEqual(rows[0]['total_amount'], '6.20')
+        self.assertNotIn('food_item', rows[0])
+
+    def test_jsonl(self):
+        response, body = self.export(format='jsonl', kind='orders')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertTrue(response['Content-Disposition'].endswith('.jsonl"'))
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([line['order_id'] for line in lines], [order.pk for order in self.orders])
+        self.assertEqual((lines[1]['status'], lines[1]['total_amount']), ('pending', '6.20'))
+
+        _, body = self.export(format='jsonl', kind='items')
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(lines), 6)
+        self.assertEqual((lines[0]['food_item'], lines[0]['line_total']), ('Sandwich', '5.00'))
+
+    def test_csv_cells_cannot_run_as_formulas(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(user_identifier='=HYPERLINK("http://evil.test","x")')
+        rows = self.csv_rows(kind='orders')
+        self.assertEqual(rows[0]['user_identifier'], '\'=HYPERLINK("http://evil.test","x")')
+        self.assertEqual(rows[0]['total_amount'], '6.20')
+        self.assertEqual(self.csv_rows(kind='items')[0]['user_identifier'], '\'=HYPERLINK("http://evil.test","x")')
+        # JSONL is data, not a spreadsheet: left as it is
+        _, body = self.export(format='jsonl', kind='orders')
+        self.assertEqual(json.loads(body.splitlines()[0])['user_identifier'], '=HYPERLINK("http://evil.test","x")')
+
+    def test_status_payment_and_inclusive_date_filters(self):
+        def order_ids(**params):
+            return [int(row['order_id']) for row in self.csv_rows(kind='orders', **params)]
+
+        first, second, third = [order.pk for order in self.orders]
+        self.assertEqual(order_ids(status='collected'), [first, third])
+        self.assertEqual(order_ids(payment='pending'), [second])
+        self.assertEqual(order_ids(status='collected', payment='pending'), [])
+        self.assertEqual(order_ids(**{'from': '2026-03-01', 'to': '2026-03-02'}), [first, second])
+        self.assertEqual(order_ids(**{'from': '2026-03-02', 'to': '2026-03-02'}), [second])
+        self.assertEqual(order_ids(**{'from': '2026-03-03'}), [third])
+        self.assertEqual(order_ids(to='2026-02-28'), [])
+        self.assertEqual(len(self.csv_rows(kind='items', status='collected', **{'from': '2026-03-02'})), 2)
+
+    def test_rejects_bad_parameters(self):
+        for params in (
+            {'from': '01.03.2026'},
+            {'to': '2026-02-30'},
+            {'format': 'xlsx'},
+            {'kind': 'customers'},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.staff.get('/admin/orders/export/', params).status_code, 400)
+        self.assertEqual(authenticated_client().get('/admin/orders/export/').status_code, 403)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class QueryPlanTests(TestCase):
+    """Hot view queries must be served by an index, never a full table scan"""
+
+    # "SCAN main_order" alone is a full scan; "SCAN ... USING INDEX" is fine
+    FULL_SCAN = re.compile(r'\bSCAN (main_\w+)(?: AS \w+)?\s*$', re.MULTILINE)
+
+    def assert_indexed(self, queryset):
+        plan = queryset.explain()
+        self.assertIsNone(self.FULL_SCAN.search(plan), f"Full table scan in:\n{queryset.query}\n{plan}")
+
+    def assert_view_indexed(self, client, method, path, **kwargs):
+        """Run EXPLAIN QUERY PLAN on every query the view really ran"""
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(path, **kwargs)
+        self.assertLess(response.status_code, 500)
+        statements = [q['sql'] for q in queries.captured_queries if q['sql'].startswith(('SELECT', 'UPDATE', 'DELETE'))]
+        self.assertTrue(statements, f'{path} ran no queries')
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = '\n'.join(row[-1] for row in cursor.fetchall())
+                with self.subTest(path=path, sql=sql):
+                    self.assertIsNone(self.FULL_SCAN.search(plan), f"Full table scan in:\n{sql}\n{plan}")
+
+    def setUp(self):
+        self.staff = Client()
+        self.staff.force_login(User.objects.create_user('planner', password='x', is_staff=True))
+        sandwich = FoodItem.objects.create(name='Sandwich', price='2.50', stock_count=50)
+        self.orders = []
+        for index, status in enumerate(('pending', 'paid', 'ready', 'collected')):
+            order = Order.objects.create(user_identifier=f'Student {index}', status=status, payment_status='paid', total_amount='2.50')
+            OrderItem.objects.create(order=order, food_item=sandwich, quantity=1, unit_price='2.50')
+            self.orders.append(order)
+
+    def test_admin_orders_queries_use_indexes(self):
+        cursor = _encode_order_cursor(self.orders[2])
+        for query in (
+            '', 'status=paid', 'payment=paid', 'status=paid&payment=paid',
+            f'before={cursor}', f'after={cursor}', f'status=paid&before={cursor}', f'payment=paid&before={cursor}',
+        ):
+            self.assert_view_indexed(self.staff, 'get', f'/admin/orders/?{query}')
+
+    def test_kitchen_queries_use_indexes(self):
+        self.assert_view_indexed(self.staff, 'get', '/api/kitchen/orders/')
+        self.assert_view_indexed(self.staff, 'get', '/api/kitchen/orders/?status=ready')
+        self.assert_view_indexed(
+            self.staff, 'post', f'/api/kitchen/orders/{self.orders[0].id}/status/',
+            data=json.dumps({'status': 'preparing', 'version': 0}), content_type='application/json'
+        )
+        self.assert_view_indexed(
+            self.staff, 'post', '/api/kitchen/orders/bulk-status/',
+            data=json.dumps({'ids': [order.id for order in self.orders], 'status': 'collected'}), content_type='application/json'
+        )
+
+    @override_settings(RATE_LIMITS={})
+    def test_qr_pass_queries_use_indexes(self):
+        raw_code = QRCodePass.generate_secure_code()
+        qr_pass = QRCodePass(user_identifier='Ana', expires_at=timezone.now() + timedelta(days=1))
+        qr_pass.set_code(raw_code)
+        qr_pass.save()
+        # A known code (indexed lookup and use count update) and an unknown
+        # one (also checked against legacy passes without a lookup key)
+        for code in (raw_code, 'not-a-pass'):
+            self.assert_view_indexed(
+                Client(), 'post', '/api/scan-qr/', data=json.dumps({'data': code}), content_type='application/json'
+            )
+        self.assert_view_indexed(self.staff, 'get', '/generate-qr/', secure=True)
+
+    def test_sales_summary_uses_index(self):
+        queryset = rollups.summary_rows()
+        self.assert_indexed(queryset)
+        self.assertNotIn('TEMP B-TREE', queryset.explain())
+
+
+@skipUnless(search.supports_trigram(connection), 'Needs SQLite with the FTS5 trigram tokenizer')
+class UserIdentifierSearchTests(TestCase):
+    def matches(self, query, queryset=None):
+        queryset = Order.objects.all() if queryset is None else queryset
+        return sorted(search.filter_contains(queryset, query).values_list('user_identifier', flat=True))
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        Order.objects.bulk_create([Order(user_identifier=name) for name in ('Ana Kovač', 'Marko', 'ANAMARIJA')])
+        self.assertTrue(search.is_available())
+        self.assertEqual(self.matches('ana'), ['ANAMARIJA', 'Ana Kovač'])
+        self.assertEqual(self.matches('kovač'), ['Ana Kovač'])
+
+        Order.objects.filter(user_identifier='Marko').update(user_identifier='Marko Anić')
+        Order.objects.filter(user_identifier='ANAMARIJA').delete()
+        self.assertEqual(self.matches('ana'), ['Ana Kovač'])
+        self.assertEqual(self.matches('anić'), ['Marko Anić'])
+
+    def test_query_is_matched_literally(self):
+        Order.objects.create(user_identifier='say "hi" OR NOT')
+        Order.objects.create(user_identifier='hi there')
+        self.assertEqual(self.matches('"hi" OR'), ['say "hi" OR NOT'])
+        self.assertEqual(self.matches('NOT'), ['say "hi" OR NOT'])
+        # Too short for a trigram: falls back to icontains
+        self.assertEqual(self.matches('hi'), ['hi there', 'say "hi" OR NOT'])
+
+    def test_views_use_the_index(self):
+        QRCodePass.objects.create(code_hash='x', user_identifier='Ivana Horvat')
+        QRCodePass.objects.create(code_hash='y', user_identifier='Petra')
+        self.assertEqual(self.matches('horv', QRCodePass.objects.all()), ['Ivana Horvat'])
+
+        plan = search.filter_contains(Order.objects.order_by('-created_at', '-id'), 'ana')[:51].explain()
+        self.assertIn('VIRTUAL TABLE INDEX', plan)
+        self.assertNotRegex(plan, QueryPlanTests.FULL_SCAN)
+
+    def test_dropped_triggers_fall_back_to_icontains_until_rebuilt(self):
+        self.addCleanup(search._available.clear)
+        with connection.cursor() as cursor:
+            # What a table rebuild by an AlterField migration does
+            cursor.execute('DROP TRIGGER "main_order_search_ai"')
+        search._available.clear()
+        Order.objects.create(user_identifier='Ana Kovač')
+        with self.assertLogs('main.search', 'WARNING'):
+            self.assertFalse(search.is_available())
+        self.assertEqual(self.matches('kovač'), ['Ana Kovač'])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertTrue(search.is_available())
+        self.assertEqual(self.matches('kovač'), ['Ana Kovač'])
+
+
+class MenuApiTests(TestCase):
+    def setUp(self):
+        use_temporary_cache(self)
+        self.sandwich = FoodItem.objects.create(name='Sandwich', price='2.50', stock_count=5)
+        FoodItem.objects.create(name='Soup', price='3.00', stock_count=5, is_available=False)
+        self.client = authenticated_client()
+
+    def test_requires_a_qr_session(self):
+        response = Client().get('/api/menu/')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['success'], False)
+
+    def test_etag_and_not_modified(self):
+        response = self.client.get('/api/menu/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        data = response.json()
+        self.assertEqual(response['ETag'], f'"{data["version"]}"')
+        self.assertEqual(data['items'], [{'id': self.sandwich.id, 'name': 'Sandwich', 'price': '2.50', 'available': 5}])
+
+        cached = self.client.get('/api/menu/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(self.client.get('/api/menu/', HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_stock_change_starts_a_new_version(self):
+        etag = self.client.get('/api/menu/')['ETag']
+        cart = json.dumps({'items': [{'id': self.sandwich.id, 'quantity': 2}]})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/api/orders/', cart, content_type='application/json').status_code, 200)
+
+        response = self.client.get('/api/menu/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['items'][0]['available'], 3)
+
+
+class MenuVersionTests(TestCase):
+    def setUp(self):
+        use_temporary_cache(self)
+        self.sandwich = FoodItem.objects.create(name='Sandwich', price='2.50', stock_count=5)
+
+    def assert_new_version(self, change):
+        before = menu.get_menu_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertNotEqual(menu.get_menu_version(), before)
+
+    def test_checkouts_and_food_item_changes_start_a_new_version(self):
+        cart = json.dumps({'items': [{'id': self.sandwich.id, 'quantity': 1}]})
+        self.assert_new_version(lambda: authenticated_client().post('/api/orders/', cart, content_type='application/json'))
+        self.assert_new_version(lambda: reservations.hold_stock({self.sandwich.id: 1}))
+
+        self.sandwich.refresh_from_db()
+        self.sandwich.price = Decimal('2.80')
+        self.assert_new_version(self.sandwich.save)
+        self.assert_new_version(lambda: FoodItem.objects.create(name='Soup', price='3.00', stock_count=5))
+        self.assert_new_version(FoodItem.objects.get(name='Soup').delete)
+
+        before = menu.get_menu_version()
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            self.sandwich.save()
+            transaction.set_rollback(True)
+        self.assertEqual(menu.get_menu_version(), before)
+
+    def menu_queries(self, client):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/success/')
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries if 'main_fooditem' in query['sql']]
+
+    def test_warm_success_page_runs_no_menu_queries(self):
+        client = authenticated_client()
+        _, queries = self.menu_queries(client)
+        self.assertEqual(len(queries), 1)
+
+        response, queries = self.menu_queries(client)
+        self.assertEqual(queries, [])
+        self.assertContains(response, 'Sandwich')
+
+        self.sandwich.name = 'Toastie'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sandwich.save()
+        response, queries = self.menu_queries(client)
+        self.assertEqual(len(queries), 1)
+        self.assertContains(response, 'Toastie')
+
+
+class SessionTests(TestCase):
+    def setUp(self):
+        use_temporary_cache(self)
+        FoodItem.objects.create(name='Sandwich', price='2.50', stock_count=5)
+
+    def assert_page_views_do_not_write(self, client):
+        for _ in range(3):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get('/success/', secure=True)
+            self.assertEqual(response.status_code, 200)
+            writes = [q['sql'] for q in queries.captured_queries if not q['sql'].startswith('SELECT')]
+            self.assertEqual(writes, [])
+
+    def test_authenticated_page_views_are_read_only(self):
+        sessions.prune_expired_sessions()
+        self.assert_page_views_do_not_write(authenticated_client())
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions(self):
+        sessions.prune_expired_sessions()
+        client = authenticated_client('kiosk')
+        self.assertFalse(Session.objects.exists())
+        self.assert_page_views_do_not_write(client)
+
+    def test_expired_sessions_are_pruned_once_per_interval(self):
+        Session.objects.create(session_key='old', session_data='', expire_date=timezone.now() - timedelta(days=1))
+        self.assertTrue(sessions.prune_expired_sessions())
+        self.assertFalse(Session.objects.filter(session_key='old').exists())
+
+        Session.objects.create(session_key='older', session_data='', expire_date=timezone.now() - timedelta(days=1))
+        self.assertFalse(sessions.prune_expired_sessions())
+        self.assertTrue(Session.objects.filter(session_key='older').exists())
+
+    @override_settings(SESSION_REFRESH_INTERVAL=3600)
+    def test_staff_sessions_are_refreshed_sparingly(self):
+        client = Client()
+        client.force_login(User.objects.create_user('admin', password='x', is_staff=True))
+        first = client.get('/generate-qr/', secure=True)
+        self.assertIn(settings.SESSION_COOKIE_NAME, first.cookies)
+        second = client.get('/generate-qr/', secure=True)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, second.cookies)
+
+
+class QRPassLookupTests(TestCase):
+    def legacy_pass(self, raw_code, **fields):
+        """A pass as stored before keyed hashes and lookup keys"""
+        return QRCodePass.objects.create(code_hash=make_password(raw_code), **fields)
+
+    def test_keyed_hash_format_and_one_query_per_scan(self):
+        raw_code = QRCodePass.generate_secure_code()
+        qr_pass = QRCodePass()
+        qr_pass.set_code(raw_code)
+        qr_pass.save()
+        self.assertRegex(qr_pass.code_hash, r'^hmac_sha256\$[0-9a-f]{64}$')
+        self.assertNotIn(raw_code, qr_pass.code_hash)
+        self.assertEqual(qr_pass.lookup_key, QRCodePass.make_lookup_key(raw_code))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(QRCodePass.find_by_code(raw_code), qr_pass)
+        QRCodePass.objects.filter(pk=qr_pass.pk).update(is_active=False)
+        self.assertIsNone(QRCodePass.find_by_code(raw_code))
+
+    def test_legacy_pass_is_upgraded_on_its_first_scan(self):
+        raw_code = QRCodePass.generate_secure_code()
+        qr_pass = self.legacy_pass(raw_code)
+        self.assertIsNone(QRCodePass.find_by_code('typo'))
+
+        self.assertEqual(QRCodePass.find_by_code(raw_code), qr_pass)
+        qr_pass.refresh_from_db()
+        self.assertTrue(qr_pass.code_hash.startswith(QRCodePass.TOKEN_HASH_PREFIX))
+        self.assertEqual(qr_pass.lookup_key, QRCodePass.make_lookup_key(raw_code))
+        with mock.patch('main.models.check_password') as check_password, self.assertNumQueries(1):
+            self.assertEqual(QRCodePass.find_by_code(raw_code), qr_pass)
+        check_password.assert_not_called()
+
+    def test_unmatched_scans_skip_legacy_passes_after_cutover(self):
+        raw_code = QRCodePass.generate_secure_code()
+        self.legacy_pass(raw_code)
+        self.legacy_pass(QRCodePass.generate_secure_code())
+        with mock.patch('main.models.check_password', return_value=False) as check_password:
+            self.assertIsNone(QRCodePass.find_by_code('garbage'))
+        self.assertEqual(check_password.call_count, 2)
+
+        with override_settings(QR_LEGACY_FALLBACK=False):
+            with mock.patch('main.models.check_password') as check_password, self.assertNumQueries(2):
+                self.assertIsNone(QRCodePass.find_by_code('garbage'))
+                self.assertIsNone(QRCodePass.find_by_code(raw_code))
+        check_password.assert_not_called()
+
+    def test_retire_command_reissues_or_deactivates_legacy_passes(self):
+        old_code = QRCodePass.generate_secure_code()
+        legacy = self.legacy_pass(old_code, user_identifier='Ana')
+        current = QRCodePass()
+        current.set_code(QRCodePass.generate_secure_code())
+        current.save()
+
+        out = StringIO()
+        call_command('retire_legacy_passes', stdout=out)
+        self.assertIn('1 active legacy pass(es)', out.getvalue())
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'legacy.zip')
+            call_command('retire_legacy_passes', '--reissue', '--output', output, stdout=StringIO())
+            with zipfile.ZipFile(output) as bundle:
+                manifest = list(csv.DictReader(io.StringIO(bundle.read('manifest.csv').decode())))
+        self.assertEqual([(int(row['pass_id']), row['user_identifier']) for row in manifest], [(legacy.pk, 'Ana')])
+        current_hash = current.code_hash
+        current.refresh_from_db()
+        self.assertEqual(current.code_hash, current_hash)
+
+        with override_settings(QR_LEGACY_FALLBACK=False):
+            self.assertEqual(QRCodePass.find_by_code(manifest[0]['code']), legacy)
+            self.assertIsNone(QRCodePass.find_by_code(old_code))
+
+        stale = self.legacy_pass(QRCodePass.generate_secure_code())
+        call_command('retire_legacy_passes', '--deactivate', stdout=StringIO())
+        stale.refresh_from_db()
+        self.assertFalse(stale.is_active)
+        self.assertFalse(QRCodePass.objects.filter(is_active=True, lookup_key__isnull=True).exists())
+
+
+class BulkPassIssueTests(TestCase):
+    def setUp(self):
+        self.staff = Client()
+        self.staff.force_login(User.objects.create_user('teacher', password='x', is_staff=True))
+
+    def read_bundle(self, content):
+        with zipfile.ZipFile(io.BytesIO(content)) as bundle:
+            manifest = list(csv.DictReader(io.StringIO(bundle.read('manifest.csv').decode())))
+            sheet = bundle.read('passes.html').decode()
+        return manifest, sheet
+
+    def test_csv_upload_issues_a_class_of_passes(self):
+        names = ['user_identifier'] + [f'Student {i}' for i in range(1500)] + ['', '=HYPERLINK("x")']
+        upload = SimpleUploadedFile('class.csv', '\n'.join(names).encode(), content_type='text/csv')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.staff.post('/generate-qr/bulk/', {'identifiers': upload}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        # Inserted in batches, not one INSERT per pass (SQLite's parameter
+        # limit may split a BATCH_SIZE batch further)
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "main_qrcodepass"')]
+        self.assertLessEqual(len(inserts), 1501 // 100)
+        self.assertLess(len(queries), 30)
+
+        manifest, sheet = self.read_bundle(response.content)
+        self.assertEqual(len(manifest), 1501)
+        self.assertEqual(QRCodePass.objects.count(), 1501)
+        self.assertEqual(manifest[-1]['user_identifier'], '\'=HYPERLINK("x")')
+        # Drawn on the server: no script, one inline SVG per pass
+        self.assertEqual(sheet.count('<svg'), 1501)
+        self.assertNotIn('<script', sheet)
+
+        first = manifest[0]
+        qr_pass = QRCodePass.find_by_code(first['code'])
+        self.assertEqual((qr_pass.pk, qr_pass.user_identifier), (int(first['pass_id']), 'Student 0'))
+
+    def test_rejects_bad_uploads(self):
+        upload = SimpleUploadedFile('empty.csv', b'user_identifier\n\n', content_type='text/csv')
+        response = self.staff.post('/generate-qr/bulk/', {'identifiers': upload}, secure=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(QRCodePass.objects.exists())
+        self.assertEqual(authenticated_client().post('/generate-qr/bulk/', secure=True).status_code, 403)
+
+    def test_management_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'class.csv')
+            output = os.path.join(directory, 'passes.zip')
+            with open(source, 'w', encoding='utf-8') as f:
+                f.write('Ana\nIvan\n')
+            call_command('issue_passes', source, '--output', output, '--days', '7', stdout=StringIO())
+            with open(output, 'rb') as f:
+                manifest, _ = self.read_bundle(f.read())
+        self.assertEqual([row['user_identifier'] for row in manifest], ['Ana', 'Ivan'])
+        self.assertTrue(all(QRCodePass.find_by_code(row['code']) for row in manifest))
+
+
+class FoodImageTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+    def photo(self, size=(3000, 2000)):
+        exif = Image.Exif()
+        exif[0x010F] = 'PhoneMaker'  # Make
+        exif[0x0112] = 6  # Orientation: rotate 90° clockwise to display
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (200, 120, 40)).save(buffer, 'JPEG', exif=exif, quality=95)
+        return SimpleUploadedFile('burger.jpeg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_is_stripped_resized_and_gets_variants(self):
+        item = FoodItem.objects.create(name='Burger', price='4.00', stock_count=5, image=self.photo())
+
+        # Rotated upright by its EXIF orientation and capped at 1600px
+        self.assertEqual(images.image_size(item), (1067, 1600))
+        with Image.open(item.image.path) as stored:
+            self.assertEqual(stored.size, (1067, 1600))
+            self.assertEqual(dict(stored.getexif()), {})
+        self.assertEqual(set(item.image_variants), {'original', 'thumb', 'medium'})
+        for variant in (item.image_variants[name] for name in images.VARIANT_SIZES):
+            for image_format, pil_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+                with Image.open(os.path.join(settings.MEDIA_ROOT, variant[image_format])) as image:
+                    self.assertEqual((image.format, image.size), (pil_format, (variant['width'], variant['height'])))
+                    self.assertEqual(dict(image.getexif()), {})
+
+        html = Template('{% load food_images %}{% food_picture item %}').render(Context({'item': item}))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertIn('width="240" height="240"', html)
+        self.assertRegex(html, r'srcset="[^"]+-thumb\.jpg 240w, [^"]+-medium\.jpg 480w"')
+
+    def test_replacing_and_clearing_the_image_removes_old_variants(self):
+        item = FoodItem.objects.create(name='Burger', price='4.00', stock_count=5, image=self.photo())
+        old_files = [item.image_variants[name]['webp'] for name in images.VARIANT_SIZES]
+        item.image = self.photo((800, 800))
+        item.save()
+        self.assertFalse(any(os.path.exists(os.path.join(settings.MEDIA_ROOT, name)) for name in old_files))
+
+        item.image = None
+        item.save()
+        self.assertEqual(item.image_variants, {})
+        # Stock edits do not touch the image
+        FoodItem.objects.get(pk=item.pk).save()
+
+    def test_missing_image_file_does_not_break_loading(self):
+        FoodItem.objects.create(name='Old', price='1.00', stock_count=5, image='food_items/missing.jpg')
+        item = FoodItem.objects.get()
+        html = Template('{% load food_images %}{% food_picture item %}').render(Context({'item': item}))
+        self.assertIn('food_items/missing.jpg', html)
+        self.assertNotIn('width=', html)
+        stderr = StringIO()
+        call_command('process_food_images', stdout=StringIO(), stderr=stderr)
+        self.assertIn('Skipped Old', stderr.getvalue())
+
+
+class StaticAssetTests(TestCase):
+    MANIFEST_STORAGES = {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+    }
+
+    def test_pages_link_assets_instead_of_inlining_them(self):
+        response = authenticated_client().get('/success/', secure=True)
+        self.assertNotContains(response, '<style>')
+        self.assertNotContains(response, '<script>')
+        self.assertContains(response, 'css/success.css')
+        self.assertContains(response, 'js/success.js')
+
+    def test_collectstatic_hashes_and_precompresses_assets(self):
+        with tempfile.TemporaryDirectory() as root, \
+                override_settings(STATIC_ROOT=root, STORAGES=self.MANIFEST_STORAGES):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            for name in ('css/logged_in.css', 'js/logged_in.js', 'css/admin_orders.css', 'js/success.js'):
+                url = static(name)
+                stem, extension = os.path.splitext(name)
+                self.assertRegex(url, rf'^/static/{stem}\.[0-9a-f]{{12}}\{extension}$')
+                path = os.path.join(root, url[len('/static/'):])
+                for compressed in (path + '.gz', path + '.br'):
+                    self.assertTrue(os.path.exists(compressed), compressed)
+
+
+@override_settings(RATE_LIMITS={'/api/scan-qr/': {'rate': 2, 'per': 60}})
+class AsyncViewTests(TestCase):
+    async def test_scan_qr_over_asgi(self):
+        raw_code = QRCodePass.generate_secure_code()
+        qr_pass = QRCodePass(user_identifier='Ana', expires_at=timezone.now() + timedelta(days=1))
+        qr_pass.set_code(raw_code)
+        await qr_pass.asave()
+
+        client = AsyncClient()
+        response = await client.post('/api/scan-qr/', {'data': raw_code}, content_type='application/json', secure=True)
+        self.assertTrue(response.json()['valid'])
+        await qr_pass.arefresh_from_db()
+        self.assertEqual(qr_pass.use_count, 1)
+        self.assertEqual((await client.get('/success/', secure=True)).status_code, 200)
+
+        # The rate limit is enforced by the async middleware path too
+        response = await client.post('/api/scan-qr/', {'data': 'nope'}, content_type='application/json', secure=True)
+        self.assertFalse(response.json()['valid'])
+        response = await client.post('/api/scan-qr/', {'data': 'nope'}, content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 429)
+
+    async def asession_client(self):
+        client = AsyncClient()
+        session = await client.asession()
+        await session.aset('qr_authenticated', True)
+        await session.aset('qr_auth_time', timezone.now().isoformat())
+        await session.asave()
+        return client
+
+    @override_settings(STRIPE_SECRET_KEY='sk_test_stub')
+    async def test_disconnect_during_stripe_call_gives_the_hold_back(self):
+        sandwich = await FoodItem.objects.acreate(name='Sandwich', price='2.50', stock_count=5)
+        client = await self.asession_client()
+        cart = json.dumps({'items': [{'id': sandwich.id, 'quantity': 2}]})
+        # Django cancels the view task when the ASGI client goes away
+        with mock.patch('stripe.checkout.Session.create_async', side_effect=asyncio.CancelledError):
+            with self.assertRaises(asyncio.CancelledError):
+                await client.post('/api/stripe-session/', cart, content_type='application/json', HTTP_IDEMPOTENCY_KEY='pay-1')
+        await sandwich.arefresh_from_db()
+        self.assertEqual(sandwich.reserved_count, 0)
+        self.assertFalse(await PendingCheckout.objects.aexists())
+        # The key is free again, so the retry runs instead of getting 409
+        self.assertFalse(await IdempotencyKey.objects.aexists())
+
+    async def test_export_streams_asynchronously(self):
+        user = await User.objects.acreate_user('ops', password='x', is_staff=True)
+        client = AsyncClient()
+        await client.aforce_login(user)
+        sandwich = await FoodItem.objects.acreate(name='Sandwich', price='2.50', stock_count=5)
+        order = await Order.objects.acreate(user_identifier='Ana', total_amount=Decimal('5.00'))
+        await OrderItem.objects.acreate(order=order, food_item=sandwich, quantity=2, unit_price=Decimal('2.50'))
+
+        response = await client.get('/admin/orders/export/', {'format': 'csv'})
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0][-1], 'line_total')
+        self.assertEqual(rows[1][-3:], ['2', '2.50', '5.00'])
+
+
+@override_settings(LIVE_EVENTS_POLL_INTERVAL=0.05, LIVE_EVENTS_CLIENT_BUFFER=3)
+class LiveEventTests(TestCase):
+    def test_streams_answer_204_under_wsgi(self):
+        # An endless body would hold a WSGI worker; EventSource stops on 204
+        self.assertEqual(authenticated_client().get('/api/stream/stock/').status_code, 204)
+        staff = Client()
+        staff.force_login(User.objects.create_user('cook', password='x', is_staff=True))
+        self.assertEqual(staff.get('/admin/orders/stream/').status_code, 204)
+        self.assertEqual(Client().get('/api/stream/stock/').status_code, 403)
+
+    async def test_slow_subscriber_is_told_to_resync(self):
+        subscriber = events.Subscriber({'order'}, maxsize=3)
+        for n in range(3):
+            subscriber.put('order', str(n))
+        subscriber.put('order', '3')
+        # The backlog is dropped rather than growing past the buffer
+        self.assertEqual(subscriber.queue.qsize(), 1)
+        self.assertEqual(subscriber.queue.get_nowait(), ('resync', '{}'))
+
+    async def test_dispatch_fans_out_by_kind_with_one_stock_row_per_item(self):
+        sandwich = await FoodItem.objects.acreate(name='Sandwich', price='2.50', stock_count=5, reserved_count=2)
+        broker = events.EventBroker()
+        stock = events.Subscriber({'stock'}, 10)
+        orders = events.Subscriber({'order'}, 10)
+        broker.subscribers.update({stock, orders})
+
+        await broker.dispatch([
+            {'id': 1, 'kind': 'stock', 'payload': {'ids': [sandwich.id]}},
+            {'id': 2, 'kind': 'stock', 'payload': {'ids': [sandwich.id]}},
+            {'id': 3, 'kind': 'order', 'payload': {'id': 7}},
+        ])
+        self.assertEqual(stock.queue.qsize(), 1)
+        kind, data = stock.queue.get_nowait()
+        self.assertEqual((kind, json.loads(data)), ('stock', [{'id': sandwich.id, 'available': 3}]))
+        self.assertEqual(orders.queue.get_nowait(), ('order', '{"id": 7}'))
+        self.assertTrue(orders.queue.empty())
+
+    async def test_stream_delivers_published_events_over_asgi(self):
+        client = AsyncClient()
+        session = await client.asession()
+        await session.aset('qr_authenticated', True)
+        await session.aset('qr_auth_time', timezone.now().isoformat())
+        await session.asave()
+        sandwich = await FoodItem.objects.acreate(name='Sandwich', price='2.50', stock_count=4)
+
+        response = await client.get('/api/stream/stock/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = aiter(response.streaming_content)
+        self.assertEqual(await anext(body), b'retry: 3000\n\n')
+
+        # Let the broker note the last event id before publishing
+        await asyncio.sleep(0.1)
+        await sync_to_async(events.publish_stock)([sandwich.id])
+        chunk = await asyncio.wait_for(anext(body), timeout=5)
+        self.assertEqual(chunk, f'event: stock\ndata: [{{"id":{sandwich.id},"available":4}}]\n\n'.encode())
+
+        # A client disconnect cancels the task reading the stream
+        reader = asyncio.ensure_future(anext(body))
+        await asyncio.sleep(0)
+        reader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await reader
+        self.assertFalse(events.broker.subscribers)
+        await asyncio.wait_for(events.broker.task, timeout=5)
+
+    def test_prune_command_deletes_old_events(self):
+        old = LiveEvent.objects.create(kind='order', payload={})
+        LiveEvent.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(seconds=settings.LIVE_EVENTS_RETENTION + 60))
+        recent = LiveEvent.objects.create(kind='order', payload={})
+        out = StringIO()
+        call_command('prune_expired_data', stdout=out)
+        self.assertIn('Deleted 1 old live event(s)', out.getvalue())
+        self.assertEqual(list(LiveEvent.objects.values_list('pk', flat=True)), [recent.pk])
+
+    def test_prune_command_runs_every_step_when_one_fails(self):
+        old = LiveEvent.objects.create(kind='order', payload={})
+        LiveEvent.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(seconds=settings.LIVE_EVENTS_RETENTION + 60))
+        steps = list(prune_expired_data.STEPS)
+        steps[1] = (steps[1][0], mock.Mock(side_effect=RuntimeError('database is locked')))
+        out = StringIO()
+        with mock.patch.object(prune_expired_data, 'STEPS', steps), \
+                self.assertLogs('main.management.commands.prune_expired_data', 'ERROR'), \
+                self.assertRaisesMessage(CommandError, 'old idempotency key(s)'):
+            call_command('prune_expired_data', stdout=out)
+        self.assertIn('Deleted 1 old live event(s)', out.getvalue())
+        self.assertIn('idle rate limit bucket(s)', out.getvalue())
+        self.assertFalse(LiveEvent.objects.exists())
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        use_temporary_cache(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(METRICS_DIR=directory.name))
+        self.metrics_dir = directory.name
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+        self.staff = Client()
+        self.staff.force_login(User.objects.create_user('ops', password='x', is_staff=True))
+        FoodItem.objects.create(name='Sandwich', price='2.50', stock_count=50)
+
+    def scrape(self):
+        response = self.staff.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_records_latency_queries_and_cache_per_route(self):
+        cache.clear()
+        client = authenticated_client()
+        client.get('/api/menu/')
+        client.get('/api/menu/')
+        text = self.scrape()
+        self.assertIn('bufet_request_duration_seconds_count{method="GET",route="menu_api",status="200"} 2', text)
+        queries = re.search(r'^bufet_request_db_queries_sum\{route="menu_api"\} (\S+)$', text, re.MULTILINE)
+        # The first request builds the menu snapshot, the second is served from the cache
+        self.assertGreaterEqual(float(queries.group(1)), 1)
+        self.assertRegex(text, r'bufet_cache_requests_total\{prefix="menu",result="hit"\} [1-9]')
+        self.assertRegex(text, r'bufet_cache_requests_total\{prefix="menu",result="miss"\} [1-9]')
+
+    def test_adds_up_all_workers(self):
+        authenticated_client().get('/api/menu/')
+        # Another running worker: the test runner's parent process stands in
+        with open(os.path.join(self.metrics_dir, f'{os.getppid()}.json'), 'w') as file:
+            json.dump([{
+                'name': 'bufet_request_duration_seconds',
+                'labels': {'route': 'menu_api', 'method': 'GET', 'status': '200'},
+                'value': {'buckets': [1] + [0] * (len(metrics.LATENCY_BUCKETS) - 1), 'sum': 0.001, 'count': 1},
+            }], file)
+        self.assertIn('bufet_request_duration_seconds_count{method="GET",route="menu_api",status="200"} 2', self.scrape())
+
+    @skipUnless(os.name == 'posix', 'Worker liveness is only checked on POSIX')
+    def test_drops_files_of_exited_workers(self):
+        authenticated_client().get('/api/menu/')
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        stale = os.path.join(self.metrics_dir, f'{exited.pid}.json')
+        with open(stale, 'w') as file:
+            json.dump([{
+                'name': 'bufet_request_duration_seconds',
+                'labels': {'route': 'menu_api', 'method': 'GET', 'status': '200'},
+                'value': {'buckets': [1] + [0] * (len(metrics.LATENCY_BUCKETS) - 1), 'sum': 0.001, 'count': 1},
+            }], file)
+        self.assertIn('bufet_request_duration_seconds_count{method="GET",route="menu_api",status="200"} 1', self.scrape())
+        self.assertFalse(os.path.exists(stale))
+
+    def test_counts_has_key_and_add(self):
+        cache.clear()
+        self.assertTrue(cache.add('lock:prune', 1, 60))
+        self.assertFalse(cache.add('lock:prune', 1, 60))
+        self.assertTrue(cache.has_key('lock:prune'))
+        self.assertEqual(cache.get_many(['lock:prune', 'lock:other']), {'lock:prune': 1})
+        samples = {
+            tuple(sorted(sample['labels'].items())): sample['value']
+            for sample in metrics.registry.snapshot() if sample['name'] == 'bufet_cache_requests_total'
+        }
+        self.assertEqual(samples[(('prefix', 'lock'), ('result', 'hit'))], 3)
+        self.assertEqual(samples[(('prefix', 'lock'), ('result', 'miss'))], 2)
+
+    @override_settings(STRIPE_SECRET_KEY='sk_test_stub')
+    def test_times_stripe_calls(self):
+        stripe_stub = StripeStub()
+        cart = json.dumps({'items': [{'id': FoodItem.objects.get().id, 'quantity': 1}]})
+        with mock.patch('stripe.checkout.Session.create_async', stripe_stub.create_async):
+            response = authenticated_client().post('/api/stripe-session/', cart, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'bufet_stripe_request_duration_seconds_count{operation="checkout.Session.create",outcome="ok"} 1',
+            self.scrape()
+        )
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_staff_or_token_only(self):
+        self.assertEqual(Client().get('/metrics').status_code, 403)
+        self.assertEqual(authenticated_client().get('/metrics').status_code, 403)
+        self.assertEqual(Client().get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = Client().get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE bufet_request_duration_seconds histogram', response.content.decode())
+
+    def test_json_log_lines(self):
+        try:
+            raise RuntimeError('boom')
+        except RuntimeError:
+            record = logging.getLogger('main.views').makeRecord(
+                'main.views', logging.ERROR, __file__, 1, 'Stripe webhook failed', (), sys.exc_info(),
+                extra={'stripe_event_id': 'evt_1'}
+            )
+        entry = json.loads(JSONFormatter().format(record))
+        self.assertEqual(entry['level'], 'ERROR')
+        self.assertEqual(entry['message'], 'Stripe webhook failed')
+        self.assertEqual(entry['stripe_event_id'], 'evt_1')
+        self.assertIn('RuntimeError: boom', entry['exception'])
+
+
+def seed_shop(size):
+    """A menu of `size` items, 3 * size orders of three items each and 3 * size passes"""
+    foods = FoodItem.objects.bulk_create([
+        FoodItem(name=f'Item {n}', price=Decimal('1.50') + n, stock_count=1000)
+        for n in range(size)
+    ])
+    orders = Order.objects.bulk_create([
+        Order(user_identifier=f'student-{n}', status='paid', payment_status='paid', payment_method='stripe', total_amount=Decimal('4.50'))
+        for n in range(3 * size)
+    ])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, food_item=foods[(n + k) % size], quantity=1, unit_price=Decimal('1.50'))
+        for n, order in enumerate(orders) for k in range(3)
+    ])
+    raw_codes = []
+    passes = []
+    for n in range(3 * size):
+        raw_codes.append(QRCodePass.generate_secure_code())
+        qr_pass = QRCodePass(user_identifier=f'student-{n}', expires_at=timezone.now() + timedelta(days=30))
+        qr_pass.set_code(raw_codes[-1])
+        passes.append(qr_pass)
+    QRCodePass.objects.bulk_create(passes)
+    cart = [{'id': food.id, 'quantity': 1} for food in foods]
+    for session_id in ('cs_budget_redirect', 'cs_budget_webhook'):
+        PendingCheckout.objects.create(stripe_session_id=session_id, user_identifier='student', items=cart)
+    return SimpleNamespace(foods=foods, orders=orders, raw_code=raw_codes[0], cart=cart)
+
+
+def webhook_request(shop):
+    body, signature = signed_webhook({
+        'id': 'evt_budget',
+        'object': 'event',
+        'type': 'checkout.session.completed',
+        'data': {'object': {'id': 'cs_budget_webhook', 'object': 'checkout.session', 'payment_status': 'paid'}},
+    }, 'whsec_test')
+    return {'data': body, 'content_type': 'application/json', 'HTTP_STRIPE_SIGNATURE': signature}
+
+
+def json_request(payload):
+    return {'data': json.dumps(payload), 'content_type': 'application/json'}
+
+
+# URL name: how to request it and the most queries it may run. Each view is
+# run against seed_shop(SMALL) and seed_shop(LARGE) with an empty cache, so
+# the counts include loading the session and pruning expired ones; see
+# QueryBudgetTests. Carts and bulk requests cover every seeded item.
+QUERY_BUDGETS = {
+    'home': dict(budget=1),
+    'logged_in': dict(budget=1),
+    'logout': dict(client='student', status=302, budget=5),
+    'admin_login': dict(method='post', status=302, budget=10, request=lambda shop: {'data': {'username': 'budget-staff', 'password': 'x'}}),
+    'admin_logout': dict(client='staff', status=302, budget=5),
+    'scan_qr': dict(method='post', budget=7, request=lambda shop: json_request({'data': shop.raw_code})),
+    'create_order': dict(method='post', client='student', budget=15, request=lambda shop: json_request({'items': shop.cart})),
+    'menu_api': dict(client='student', budget=3),
+    'stock_stream': dict(client='student', status=204, budget=2),
+    'create_stripe_session': dict(method='post', client='student', budget=11, request=lambda shop: json_request({'items': shop.cart})),
+    'success': dict(client='student', budget=3),
+    'stripe_success': dict(status=302, budget=21, request=lambda shop: {'data': {'session_id': 'cs_budget_redirect'}}),
+    'stripe_cancel': dict(status=302, budget=1),
+    'stripe_webhook': dict(method='post', budget=20, request=webhook_request, settings={'STRIPE_WEBHOOK_SECRET': 'whsec_test'}),
+    'payment_error': dict(budget=1),
+    'generate_qr': dict(client='staff', budget=7),
+    'generate_qr_bulk': dict(
+        method='post', client='staff', budget=9,
+        request=lambda shop: {'data': {'identifiers': SimpleUploadedFile(
+            'class.csv', '\n'.join(f'student-{n}' for n in range(len(shop.orders))).encode()
+        )}}
+    ),
+    'admin_orders': dict(client='staff', budget=9),
+    'export_orders': dict(client='staff', budget=7, request=lambda shop: {'data': {'kind': 'items'}}),
+    'orders_stream': dict(client='staff', status=204, budget=7),
+    'kitchen_orders': dict(client='staff', budget=8),
+    'kitchen_bulk_status': dict(
+        method='post', client='staff', budget=12,
+        request=lambda shop: json_request({'ids': [order.id for order in shop.orders], 'status': 'preparing'})
+    ),
+    'kitchen_order_status': dict(
+        method='post', client='staff', budget=11,
+        path=lambda shop: reverse('kitchen_order_status', args=[shop.orders[0].id]),
+        request=lambda shop: json_request({'status': 'preparing', 'version': 0})
+    ),
+    'metrics': dict(client='staff', budget=6),
+}
+
+
+@override_settings(RATE_LIMITS={}, STRIPE_SECRET_KEY='sk_test_stub', STRIPE_WEBHOOK_SECRET='')
+class QueryBudgetTests(TestCase):
+    """Every URL runs at most its budgeted queries, however much data there is"""
+
+    SMALL = 2
+    LARGE = 40
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff_user = User.objects.create_user('budget-staff', password='x', is_staff=True)
+
+    def setUp(self):
+        use_temporary_cache(self)
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        self.enterContext(override_settings(METRICS_DIR=metrics_dir.name))
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        stripe_stub = StripeStub()
+        for session_id in ('cs_budget_redirect', 'cs_budget_webhook'):
+            stripe_stub.sessions[session_id] = SimpleNamespace(id=session_id, payment_status='paid')
+        self.enterContext(mock.patch('stripe.checkout.Session.create_async', stripe_stub.create_async))
+        self.enterContext(mock.patch('stripe.checkout.Session.retrieve_async', stripe_stub.retrieve_async))
+
+    def client_for(self, kind):
+        if kind == 'student':
+            return authenticated_client()
+        client = Client()
+        if kind == 'staff':
+            client.force_login(self.staff_user)
+        return client
+
+    def count_queries(self, name, case, size):
+        """Queries run by one request against seed_shop(size); the data is rolled back"""
+        with transaction.atomic(), override_settings(**case.get('settings', {})):
+            shop = seed_shop(size)
+            client = self.client_for(case.get('client'))
+            path = case['path'](shop) if 'path' in case else reverse(name)
+            kwargs = case['request'](shop) if 'request' in case else {}
+            # Every run starts cold: no cached menu or sessions
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(client, case.get('method', 'get'))(path, secure=True, **kwargs)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, case.get('status', 200), f'{name}: {response.content[:200] if not response.streaming else ""}')
+            transaction.set_rollback(True)
+        return len(queries)
+
+    def test_every_url_has_a_budget(self):
+        self.assertEqual(set(QUERY_BUDGETS), {pattern.name for pattern in urlpatterns})
+
+    def test_query_counts_do_not_grow_with_data(self):
+        for name, case in QUERY_BUDGETS.items():
+            with self.subTest(name):
+                small = self.count_queries(name, case, self.SMALL)
+                large = self.count_queries(name, case, self.LARGE)
+                self.assertEqual(large, small, f'{name} ran {small} queries with small data and {large} with large data')
+                self.assertLessEqual(large, case['budget'], f'{name} went over its query budget')
@@ -9,11 +9,21 @@ urlpatterns = [
     path('admin-logout/', views.admin_logout, name='admin_logout'),
     path('api/scan-qr/', views.scan_qr, name='scan_qr'),
     path('api/orders/', views.create_order, name='create_order'),
+    path('api/menu/', views.menu_api, name='menu_api'),
+    path('api/stream/stock/', views.stock_stream, name='stock_stream'),
     path('api/stripe-session/', views.create_stripe_session, name='create_stripe_session'),
     path('success/', views.success, name='success'),
     path('payments/stripe-success/', views.stripe_success, name='stripe_success'),
     path('payments/stripe-cancel/', views.stripe_cancel, name='stripe_cancel'),
+    path('payments/stripe-webhook/', views.stripe_webhook, name='stripe_webhook'),
     path('payment-error/', views.payment_error, name='payment_error'),
     path('generate-qr/', views.generate_qr, name='generate_qr'),
+    path('generate-qr/bulk/', views.generate_qr_bulk, name='generate_qr_bulk'),
     path('admin/orders/', views.admin_orders, name='admin_orders'),
+    path('admin/orders/export/', views.export_orders, name='export_orders'),
+    path('admin/orders/stream/', views.orders_stream, name='orders_stream'),
+    path('api/kitchen/orders/', views.kitchen_orders, name='kitchen_orders'),
+    path('api/kitchen/orders/bulk-status/', views.kitchen_bulk_status, name='kitchen_bulk_status'),
+    path('api/kitchen/orders/<int:order_id>/status/', views.kitchen_order_status, name='kitchen_order_status'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
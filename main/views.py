@@ -1,18 +1,37 @@
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.db import transaction
-from django.db.models import Sum
+from django.db.models import Case, F, IntegerField, Prefetch, Q, Value, When, prefetch_related_objects
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from django.core.cache import cache
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.functional import SimpleLazyObject
+from django.utils.cache import get_conditional_response
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
-from datetime import datetime
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from asgiref.sync import sync_to_async
 from decimal import Decimal
+from urllib.parse import urlencode
+import hmac
+import logging
 import stripe
 import json
-from .models import QRCodePass, FoodItem, Order, OrderItem
+from . import events, exports, menu, metrics, passes, reservations, rollups, search
+from .idempotency import idempotent
+from .models import QRCodePass, FoodItem, Order, OrderItem, PendingCheckout
+
+
+# Stripe sessions expire this long before their stock hold, so a payment
+# finished at the last moment still finds its stock held
+STRIPE_EXPIRY_MARGIN = timedelta(minutes=5)
+# Stripe rejects sessions that expire less than 30 minutes after they are
+# created; the extra minute covers clock skew and the request's own latency
+STRIPE_SESSION_LIFETIME = timedelta(minutes=31)
+
+logger = logging.getLogger(__name__)
 
 
 def home(request):
@@ -73,36 +92,12 @@ def logout(request):
 	return redirect('/')
 
 
-def get_client_ip(request):
-	"""Get client IP address from request"""
-	x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-	if x_forwarded_for:
-		ip = x_forwarded_for.split(',')[0]
-	else:
-		ip = request.META.get('REMOTE_ADDR')
-	return ip
-
-
 @csrf_exempt
 @require_http_methods(["POST"])
-def scan_qr(request):
+async def scan_qr(request):
 	"""API endpoint to verify QR code pass with security measures"""
+	# Rate limiting is applied by main.ratelimit.RateLimitMiddleware
 	try:
-		# Rate limiting: Max 10 attempts per IP per minute
-		ip_address = get_client_ip(request)
-		rate_limit_key = f'qr_scan_{ip_address}'
-		attempts = cache.get(rate_limit_key, 0)
-		
-		if attempts >= 10:
-			return JsonResponse({
-				'success': False,
-				'message': 'Too many attempts. Please wait a minute.',
-				'valid': False
-			}, status=429)
-		
-		# Increment attempt counter
-		cache.set(rate_limit_key, attempts + 1, 60)  # Expires in 60 seconds
-		
 		data = json.loads(request.body)
 		qr_data = data.get('data', '').strip()
 		
@@ -117,24 +112,20 @@ def scan_qr(request):
 		# We're using .filter() and .first() which are safe
 		# Never use raw SQL queries or string concatenation
 		
-		# Find all active passes and check against hashed values
-		# This prevents timing attacks by checking all passes
-		valid_pass = None
-		for qr_pass in QRCodePass.objects.filter(is_active=True):
-			if qr_pass.check_code(qr_data) and qr_pass.is_valid():
-				valid_pass = qr_pass
-				break
+		# Look the pass up by its keyed fingerprint and verify the hash once
+		# (in a worker thread, so hashing never blocks the event loop)
+		valid_pass = await sync_to_async(QRCodePass.find_by_code)(qr_data)
 		
-		if valid_pass:
+		if valid_pass and valid_pass.is_valid():
 			# Mark as used
-			valid_pass.mark_used()
+			await valid_pass.amark_used()
 			
 			# Create a secure session token for access to success page
-			request.session['qr_authenticated'] = True
-			request.session['qr_auth_time'] = timezone.now().isoformat()
-			request.session['user_identifier'] = valid_pass.user_identifier
+			await request.session.aset('qr_authenticated', True)
+			await request.session.aset('qr_auth_time', timezone.now().isoformat())
+			await request.session.aset('user_identifier', valid_pass.user_identifier)
 			# Session expires in 5 minutes
-			request.session.set_expiry(300)
+			await request.session.aset_expiry(300)
 			
 			# Log successful authentication (optional)
 			# You could add a ScanLog model here for audit trail
@@ -155,9 +146,9 @@ def scan_qr(request):
 			
 	except json.JSONDecodeError:
 		return JsonResponse({'error': 'Invalid request format'}, status=400)
-	except Exception as e:
+	except Exception:
 		# Don't leak error details to user
-		print(f"QR Scan Error: {str(e)}")  # Log server-side only
+		logger.exception('QR scan failed')  # Log server-side only
 		return JsonResponse({'error': 'An error occurred'}, status=500)
 
 
@@ -192,21 +183,70 @@ def success(request):
 	# Get user identifier from session
 	user_identifier = request.session.get('user_identifier', 'Guest')
 	
-	# Get all available food items
-	food_items = FoodItem.objects.filter(is_available=True).order_by('name')
+	# The menu grid is fragment-cached per menu version; the items are only
+	# loaded (from the menu cache) when the fragment has to be rendered
+	menu_version = menu.get_menu_version()
+	food_items = SimpleLazyObject(lambda: menu.get_menu_items(menu_version))
 	
 	# Don't clear the session - let it expire naturally after 5 minutes
 	context = {
 		'user_identifier': user_identifier,
 		'remaining_minutes': remaining_minutes,
 		'remaining_seconds': remaining_secs,
-		'food_items': food_items
+		'food_items': food_items,
+		'menu_version': menu_version,
+		'menu_cache_seconds': settings.MENU_CACHE_SECONDS
 	}
 	
 	return render(request, 'success.html', context)
 
 
-def _validate_cart(items):
+@require_http_methods(["GET"])
+def menu_api(request):
+	"""Available food items and stock as JSON, with ETag/If-None-Match support"""
+	if not request.session.get('qr_authenticated'):
+		return JsonResponse({'success': False, 'message': 'Not authenticated'}, status=403)
+
+	version = menu.get_menu_version()
+	etag = f'"{version}"'
+	not_modified = get_conditional_response(request, etag=etag)
+	if not_modified is not None:
+		return not_modified
+
+	response = HttpResponse(menu.get_menu_json(version), content_type='application/json')
+	response['ETag'] = etag
+	response['Cache-Control'] = 'private, no-cache'
+	return response
+
+
+def _event_stream_response(request, kinds):
+	if not isinstance(request, ASGIRequest):
+		# A WSGI worker would be held by the endless stream; 204 makes
+		# EventSource give up, and the page polls instead
+		return HttpResponse(status=204)
+	response = StreamingHttpResponse(events.stream(kinds), content_type='text/event-stream')
+	response['Cache-Control'] = 'no-cache'
+	response['X-Accel-Buffering'] = 'no'  # Stop proxies from buffering the stream
+	return response
+
+
+async def stock_stream(request):
+	"""Server-Sent Events stream of stock changes for students (204 under WSGI)"""
+	if not await request.session.aget('qr_authenticated'):
+		return JsonResponse({'success': False, 'message': 'Not authenticated'}, status=403)
+	return _event_stream_response(request, {'stock'})
+
+
+async def orders_stream(request):
+	"""Server-Sent Events stream of new and updated orders for staff (204 under WSGI)"""
+	user = await request.auser()
+	if not user.is_staff:
+		return JsonResponse({'success': False, 'message': 'Staff only'}, status=403)
+	return _event_stream_response(request, {'order'})
+
+
+def _validate_cart(items, reserved=False):
+	"""Check the cart against the menu. With reserved=True the stock is already held."""
 	item_map = {}
 	for item in items:
 		item_id = item.get('id')
@@ -223,45 +263,82 @@ def _validate_cart(items):
 
 	for item_id, qty in item_map.items():
 		food = food_by_id.get(item_id)
-		if not food or food.stock_count < qty:
+		if not food or (not reserved and food.available_count < qty):
 			raise ValueError(f'Insufficient stock for {food.name if food else "item"}')
 
 	return item_map, food_by_id
 
 
-def _build_order_from_items(items, user_identifier, payment_method, payment_status='pending', status='pending', paid_at=None):
-	item_map, food_by_id = _validate_cart(items)
+def _decrement_stock(item_map, reserved=False):
+	"""Take item_map quantities out of stock in one conditional UPDATE.
+	
+	Every row is only touched if it still has enough stock not held by other
+	checkouts, so the number of updated rows equals the number of lines
+	exactly when all of them fit. With reserved=True the quantities come out
+	of a hold instead (see main.reservations).
+	"""
+	quantities = Case(
+		*[When(id=item_id, then=Value(qty)) for item_id, qty in item_map.items()],
+		output_field=IntegerField()
+	)
+	menu.invalidate_menu(item_map.keys())
+	if reserved:
+		return FoodItem.objects.filter(
+			id__in=item_map.keys(),
+			reserved_count__gte=quantities
+		).update(
+			stock_count=F('stock_count') - quantities,
+			reserved_count=F('reserved_count') - quantities,
+			updated_at=timezone.now()
+		)
+	return FoodItem.objects.filter(
+		id__in=item_map.keys(),
+		is_available=True,
+		stock_count__gte=F('reserved_count') + quantities
+	).update(stock_count=F('stock_count') - quantities, updated_at=timezone.now())
+
+
+def _build_order_from_items(items, user_identifier, payment_method, payment_status='pending', status='pending', paid_at=None, stripe_session_id='', reserved=False):
+	item_map, food_by_id = _validate_cart(items, reserved=reserved)
 	user_identifier = user_identifier or 'Guest'
 	total_amount = Decimal('0.00')
+	for item_id, qty in item_map.items():
+		total_amount += Decimal(str(food_by_id[item_id].price)) * qty
 
 	with transaction.atomic():
+		if _decrement_stock(item_map, reserved=reserved) != len(item_map):
+			# Another checkout took the stock after validation; roll back
+			raise ValueError('Some items just sold out, please review your cart')
+
 		order = Order.objects.create(
 			user_identifier=user_identifier,
 			payment_method=payment_method,
 			payment_status=payment_status,
 			status=status,
 			paid_at=paid_at,
-			total_amount=0
+			total_amount=total_amount,
+			stripe_session_id=stripe_session_id
 		)
-		for item_id, qty in item_map.items():
-			food = food_by_id[item_id]
-			unit_price = Decimal(str(food.price))
-			OrderItem.objects.create(
+		OrderItem.objects.bulk_create([
+			OrderItem(
 				order=order,
-				food_item=food,
+				food_item=food_by_id[item_id],
 				quantity=qty,
-				unit_price=unit_price
+				unit_price=Decimal(str(food_by_id[item_id].price))
 			)
-			total_amount += unit_price * qty
-			food.stock_count = max(0, food.stock_count - qty)
-			food.save(update_fields=['stock_count'])
-		order.total_amount = total_amount
-		order.save(update_fields=['total_amount'])
+			for item_id, qty in item_map.items()
+		])
+		events.publish_order(order)
+		rollups.record_order(order, [
+			(item_id, qty, Decimal(str(food_by_id[item_id].price)))
+			for item_id, qty in item_map.items()
+		])
 
 	return order, total_amount
 
 
 @require_http_methods(["POST"])
+@idempotent('create_order')
 def create_order(request):
 	"""Create a new order from cart items"""
 	if not request.session.get('qr_authenticated'):
@@ -288,15 +365,16 @@ def create_order(request):
 		return JsonResponse({'success': False, 'message': 'Invalid request format'}, status=400)
 	except ValueError as e:
 		return JsonResponse({'success': False, 'message': str(e)}, status=400)
-	except Exception as e:
-		print(f"Order Error: {str(e)}")
+	except Exception:
+		logger.exception('Order creation failed')
 		return JsonResponse({'success': False, 'message': 'An error occurred'}, status=500)
 
 
 @require_http_methods(["POST"])
-def create_stripe_session(request):
+@idempotent('create_stripe_session')
+async def create_stripe_session(request):
 	"""Create a Stripe Checkout session for the current cart"""
-	if not request.session.get('qr_authenticated'):
+	if not await request.session.aget('qr_authenticated'):
 		return JsonResponse({'success': False, 'message': 'Not authenticated'}, status=403)
 
 	if not settings.STRIPE_SECRET_KEY:
@@ -308,9 +386,9 @@ def create_stripe_session(request):
 		if not items:
 			return JsonResponse({'success': False, 'message': 'Cart is empty'}, status=400)
 
-		user_identifier = request.session.get('user_identifier', 'Guest')
+		user_identifier = await request.session.aget('user_identifier', 'Guest')
 		stripe.api_key = settings.STRIPE_SECRET_KEY
-		item_map, food_by_id = _validate_cart(items)
+		item_map, food_by_id = await sync_to_async(_validate_cart)(items)
 		line_items = []
 		for item_id, qty in item_map.items():
 			food = food_by_id[item_id]
@@ -325,21 +403,33 @@ def create_stripe_session(request):
 				'quantity': qty,
 			})
 
-		success_url = request.build_absolute_uri(f"/payments/stripe-success/?session_id={{CHECKOUT_SESSION_ID}}")
-		cancel_url = request.build_absolute_uri("/payments/stripe-cancel/")
-		session = stripe.checkout.Session.create(
-			mode='payment',
-			line_items=line_items,
-			success_url=success_url,
-			cancel_url=cancel_url,
-			metadata={'user_identifier': str(user_identifier)}
-		)
-
-		cache.set(
-			f"stripe_session_{session.id}",
-			{'items': items, 'user_identifier': user_identifier},
-			3600
-		)
+		# Hold the stock while the student pays; Stripe stops accepting the
+		# payment before the hold runs out. The hold and its PendingCheckout
+		# are written together, so release_expired_holds can always find it.
+		pending = await sync_to_async(reservations.hold_checkout)(item_map, user_identifier)
+		if pending is None:
+			raise ValueError('Some items just sold out, please review your cart')
+
+		try:
+			success_url = request.build_absolute_uri(f"/payments/stripe-success/?session_id={{CHECKOUT_SESSION_ID}}")
+			cancel_url = request.build_absolute_uri("/payments/stripe-cancel/")
+			with metrics.stripe_call('checkout.Session.create'):
+				session = await stripe.checkout.Session.create_async(
+					mode='payment',
+					line_items=line_items,
+					success_url=success_url,
+					cancel_url=cancel_url,
+					expires_at=int((timezone.now() + STRIPE_SESSION_LIFETIME).timestamp()),
+					metadata={'user_identifier': str(user_identifier)}
+				)
+		except BaseException:
+			# No Stripe session exists, so nobody can pay for this hold. This
+			# includes CancelledError: Django cancels the view when the client
+			# disconnects.
+			await sync_to_async(reservations.cancel_checkout)(pending.pk)
+			raise
+
+		await PendingCheckout.objects.filter(pk=pending.pk).aupdate(stripe_session_id=session.id)
 
 		return JsonResponse({
 			'success': True,
@@ -349,45 +439,129 @@ def create_stripe_session(request):
 		return JsonResponse({'success': False, 'message': 'Invalid request format'}, status=400)
 	except ValueError as e:
 		return JsonResponse({'success': False, 'message': str(e)}, status=400)
-	except Exception as e:
-		print(f"Stripe Error: {str(e)}")
+	except Exception:
+		logger.exception('Stripe checkout session creation failed')
 		return JsonResponse({'success': False, 'message': 'An error occurred'}, status=500)
 
 
-@require_http_methods(["GET"])
-def stripe_success(request):
-	"""Handle Stripe success redirect and mark order as paid"""
-	if not settings.STRIPE_SECRET_KEY:
-		return redirect('/payment-error/')
+def _finalize_stripe_checkout(session_id):
+	"""Turn a paid Stripe Checkout session into an order, exactly once.
+	
+	Safe to call concurrently and repeatedly (webhook retries, the success
+	redirect): the first caller claims the PendingCheckout with a conditional
+	UPDATE and builds the order, later callers get the same order back.
+	Returns None if the session is unknown or the order could not be built.
+	"""
+	with transaction.atomic():
+		# Claim the checkout; if its hold is still in place, the order is
+		# taken from the reserved stock
+		unfinished = PendingCheckout.objects.filter(stripe_session_id=session_id, completed_at__isnull=True)
+		reserved = bool(unfinished.filter(hold_expires_at__isnull=False).update(
+			completed_at=timezone.now(),
+			hold_expires_at=None
+		))
+		claimed = reserved or unfinished.update(completed_at=timezone.now())
+		pending = PendingCheckout.objects.select_related('order').filter(stripe_session_id=session_id).first()
+		if pending is None or not claimed:
+			return pending.order if pending else None
+
+		try:
+			# Runs in a savepoint, so a failure keeps the claim
+			order, total_amount = _build_order_from_items(
+				pending.items,
+				pending.user_identifier or 'Guest',
+				'stripe',
+				payment_status='paid',
+				status='paid',
+				paid_at=timezone.now(),
+				stripe_session_id=session_id,
+				reserved=reserved
+			)
+		except ValueError as e:
+			# Paid but not fulfilable (e.g. sold out): keep it visible to staff
+			if reserved:
+				# The claim already cleared the hold; give its stock back
+				reservations.release_stock(reservations.cart_item_map(pending.items))
+			pending.error = str(e)[:255]
+			pending.save(update_fields=['error'])
+			return None
 
+		pending.order = order
+		pending.save(update_fields=['order'])
+		return order
+
+
+@require_http_methods(["GET"])
+async def stripe_success(request):
+	"""Handle Stripe success redirect by looking up the finalised order"""
 	session_id = request.GET.get('session_id')
 	if not session_id:
 		return redirect('/payment-error/')
 
 	try:
-		stripe.api_key = settings.STRIPE_SECRET_KEY
-		session = stripe.checkout.Session.retrieve(session_id)
-		pending = cache.get(f"stripe_session_{session.id}")
+		pending = await PendingCheckout.objects.filter(stripe_session_id=session_id).only(
+			'order_id', 'completed_at'
+		).afirst()
 		if not pending:
 			return redirect('/payment-error/')
+		if pending.order_id:
+			return redirect(f'/success/?payment=success&order_id={pending.order_id}')
+		if pending.completed_at:
+			return redirect('/payment-error/')
 
-		order, total_amount = _build_order_from_items(
-			pending.get('items', []),
-			pending.get('user_identifier', 'Guest'),
-			'stripe',
-			payment_status='paid',
-			status='paid',
-			paid_at=timezone.now()
-		)
-		order.stripe_session_id = session.id
-		order.save(update_fields=['stripe_session_id'])
-		cache.delete(f"stripe_session_{session.id}")
+		if settings.STRIPE_WEBHOOK_SECRET:
+			# The checkout.session.completed webhook will create the order
+			return redirect('/success/?payment=processing')
+
+		# No webhook configured: confirm the payment with Stripe directly
+		if not settings.STRIPE_SECRET_KEY:
+			return redirect('/payment-error/')
+		stripe.api_key = settings.STRIPE_SECRET_KEY
+		with metrics.stripe_call('checkout.Session.retrieve'):
+			session = await stripe.checkout.Session.retrieve_async(session_id)
+		if session.payment_status != 'paid':
+			return redirect('/payment-error/')
+
+		order = await sync_to_async(_finalize_stripe_checkout)(session.id)
+		if not order:
+			return redirect('/payment-error/')
 		return redirect(f'/success/?payment=success&order_id={order.id}')
-	except Exception as e:
-		print(f"Stripe Success Error: {str(e)}")
+	except Exception:
+		logger.exception('Stripe success redirect failed', extra={'stripe_session_id': session_id})
 		return redirect('/payment-error/')
 
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def stripe_webhook(request):
+	"""Signature-verified Stripe webhook that finalises paid checkouts"""
+	if not settings.STRIPE_WEBHOOK_SECRET:
+		return HttpResponse(status=404)
+
+	try:
+		event = stripe.Webhook.construct_event(
+			request.body,
+			request.META.get('HTTP_STRIPE_SIGNATURE', ''),
+			settings.STRIPE_WEBHOOK_SECRET
+		)
+	except (ValueError, stripe.SignatureVerificationError):
+		return HttpResponse(status=400)
+
+	try:
+		if event['type'] in ('checkout.session.completed', 'checkout.session.async_payment_succeeded'):
+			session = event['data']['object']
+			if session['payment_status'] == 'paid':
+				_finalize_stripe_checkout(session['id'])
+		elif event['type'] == 'checkout.session.expired':
+			reservations.release_checkout_hold(event['data']['object']['id'])
+	except Exception:
+		logger.exception('Stripe webhook failed', extra={'stripe_event_id': event.get('id'), 'stripe_event_type': event['type']})
+		# Non-2xx makes Stripe retry the event later
+		return HttpResponse(status=500)
+
+	return HttpResponse(status=200)
+
+
 @require_http_methods(["GET"])
 def stripe_cancel(request):
 	"""Stripe cancel redirect"""
@@ -462,9 +636,7 @@ def generate_qr(request):
 	
 	if search_query:
 		# Filter passes by user_identifier containing search query (case-insensitive)
-		all_passes = QRCodePass.objects.filter(
-			user_identifier__icontains=search_query
-		).order_by('-created_at')
+		all_passes = search.filter_contains(QRCodePass.objects.all(), search_query).order_by('-created_at')
 	else:
 		all_passes = QRCodePass.objects.all().order_by('-created_at')
 	
@@ -474,6 +646,86 @@ def generate_qr(request):
 	})
 
 
+@require_http_methods(["POST"])
+def generate_qr_bulk(request):
+	"""Issue one pass per user identifier in an uploaded CSV (Admin only).
+	
+	Responds with a ZIP holding a CSV manifest and a printable sheet of QR codes.
+	"""
+	if not request.user.is_staff:
+		return render(request, 'admin_only.html', status=403)
+
+	upload = request.FILES.get('identifiers')
+	try:
+		if upload is None:
+			raise ValueError('Choose a CSV file of user identifiers')
+		if upload.size > 1024 * 1024:
+			raise ValueError('The CSV file is too large (1 MB max)')
+		try:
+			text = upload.read().decode('utf-8-sig')
+		except UnicodeDecodeError:
+			raise ValueError('The CSV file must be UTF-8 encoded')
+		identifiers = passes.read_identifiers(text)
+	except ValueError as e:
+		return render(request, 'qr_generator.html', {
+			'passes': QRCodePass.objects.all().order_by('-created_at'),
+			'error': str(e)
+		}, status=400)
+
+	issued = passes.issue_passes(identifiers)
+	response = HttpResponse(passes.build_bundle(issued), content_type='application/zip')
+	filename = f"qr-passes-{timezone.localtime().strftime('%Y%m%d-%H%M%S')}.zip"
+	response['Content-Disposition'] = f'attachment; filename="{filename}"'
+	response['Cache-Control'] = 'no-store'
+	return response
+
+
+ORDERS_CURSOR_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _encode_order_cursor(order):
+	"""Opaque keyset cursor for an order: '<created_at in µs>-<id>'"""
+	micros = (order.created_at - ORDERS_CURSOR_EPOCH) // timedelta(microseconds=1)
+	return f"{micros}-{order.id}"
+
+
+def _decode_order_cursor(cursor):
+	"""(created_at, id) from a cursor, or None if it is malformed"""
+	try:
+		micros, order_id = cursor.split('-')
+		return ORDERS_CURSOR_EPOCH + timedelta(microseconds=int(micros)), int(order_id)
+	except (ValueError, OverflowError):
+		return None
+
+
+def _orders_page(orders, before=None, after=None, page_size=50):
+	"""One page of orders (newest first) using (created_at, id) keyset pagination.
+	
+	Only the rows on the page are loaded, and their items are prefetched for
+	that page alone. Returns (orders, has_newer, has_older).
+	"""
+	if after:
+		created_at, order_id = after
+		rows = list(
+			orders.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=order_id))
+			.order_by('created_at', 'id')[:page_size + 1]
+		)
+		has_newer = len(rows) > page_size
+		rows = rows[:page_size][::-1]
+		has_older = True
+	else:
+		if before:
+			created_at, order_id = before
+			orders = orders.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id))
+		rows = list(orders.order_by('-created_at', '-id')[:page_size + 1])
+		has_older = len(rows) > page_size
+		rows = rows[:page_size]
+		has_newer = before is not None
+
+	prefetch_related_objects(rows, Prefetch('items', queryset=OrderItem.objects.select_related('food_item')))
+	return rows, has_newer, has_older
+
+
 def admin_orders(request):
 	"""Admin-only orders panel"""
 	if not request.user.is_staff:
@@ -483,7 +735,13 @@ def admin_orders(request):
 	payment_filter = request.GET.get('payment', '').strip()
 	search_query = request.GET.get('search', '').strip()
 
-	orders = Order.objects.all().prefetch_related('items', 'items__food_item')
+	try:
+		page_size = int(request.GET.get('per_page', settings.ADMIN_ORDERS_PAGE_SIZE))
+	except ValueError:
+		page_size = settings.ADMIN_ORDERS_PAGE_SIZE
+	page_size = min(max(page_size, 1), 200)
+
+	orders = Order.objects.all()
 	if status_filter:
 		orders = orders.filter(status=status_filter)
 	if payment_filter:
@@ -492,14 +750,27 @@ def admin_orders(request):
 		if search_query.isdigit():
 			orders = orders.filter(id=int(search_query))
 		else:
-			orders = orders.filter(user_identifier__icontains=search_query)
-
-	orders = orders.order_by('-created_at')
+			orders = search.filter_contains(orders, search_query)
+
+	orders, has_newer, has_older = _orders_page(
+		orders,
+		before=_decode_order_cursor(request.GET.get('before', '')),
+		after=_decode_order_cursor(request.GET.get('after', '')),
+		page_size=page_size
+	)
+	filter_query = urlencode({
+		key: value for key, value in (
+			('search', search_query),
+			('status', status_filter),
+			('payment', payment_filter),
+			('per_page', request.GET.get('per_page', '')),
+		) if value
+	})
 
-	all_orders = Order.objects.all()
-	paid_total = all_orders.filter(payment_status='paid').aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-	pending_count = all_orders.filter(payment_status='pending').count()
-	paid_count = all_orders.filter(payment_status='paid').count()
+	totals = rollups.summary()
+	paid_total = totals['paid']['total_amount']
+	pending_count = totals['pending']['order_count']
+	paid_count = totals['paid']['order_count']
 
 	context = {
 		'orders': orders,
@@ -510,5 +781,192 @@ def admin_orders(request):
 		'pending_count': pending_count,
 		'paid_count': paid_count,
 		'payment_statuses': Order.PAYMENT_STATUSES,
+		'order_statuses': Order.ORDER_STATUSES,
+		'filter_query': filter_query,
+		'newer_cursor': _encode_order_cursor(orders[0]) if orders and has_newer else '',
+		'older_cursor': _encode_order_cursor(orders[-1]) if orders and has_older else '',
 	}
 	return render(request, 'admin_orders.html', context)
+
+
+def export_orders(request):
+	"""Staff-only streaming export of orders (?kind=orders) or order items as CSV or JSONL"""
+	if not request.user.is_staff:
+		return render(request, 'admin_only.html', status=403)
+
+	export_format = request.GET.get('format', 'csv')
+	kind = request.GET.get('kind', 'items')
+	if export_format not in ('csv', 'jsonl') or kind not in ('orders', 'items'):
+		return JsonResponse({'success': False, 'message': 'Invalid export format'}, status=400)
+
+	orders = Order.objects.all()
+	status_filter = request.GET.get('status', '').strip()
+	payment_filter = request.GET.get('payment', '').strip()
+	if status_filter:
+		orders = orders.filter(status=status_filter)
+	if payment_filter:
+		orders = orders.filter(payment_status=payment_filter)
+
+	# Inclusive YYYY-MM-DD dates in the server's time zone
+	date_range = {}
+	for param in ('from', 'to'):
+		value = request.GET.get(param, '').strip()
+		if not value:
+			continue
+		try:
+			date_range[param] = parse_date(value)
+		except ValueError:
+			date_range[param] = None
+		if date_range[param] is None:
+			return JsonResponse({'success': False, 'message': 'Dates must be YYYY-MM-DD'}, status=400)
+	if 'from' in date_range:
+		orders = orders.filter(created_at__gte=timezone.make_aware(datetime.combine(date_range['from'], time.min)))
+	if 'to' in date_range:
+		orders = orders.filter(created_at__lt=timezone.make_aware(datetime.combine(date_range['to'] + timedelta(days=1), time.min)))
+
+	header, rows, to_row = exports.export_rows(orders, kind)
+	# Under ASGI a sync iterator would be read into a list before sending
+	stream = exports.astream if isinstance(request, ASGIRequest) else exports.stream
+	response = StreamingHttpResponse(
+		stream(export_format, header, rows, to_row),
+		content_type='text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson'
+	)
+	filename = f"{kind}-{timezone.localdate():%Y%m%d}.{export_format}"
+	response['Content-Disposition'] = f'attachment; filename="{filename}"'
+	return response
+
+
+def _kitchen_order(order, items=True):
+	data = {
+		'id': order.id,
+		'user_identifier': order.user_identifier,
+		'created_at': order.created_at.isoformat(),
+		'status': order.status,
+		'version': order.version,
+		'payment_method': order.payment_method,
+		'payment_status': order.payment_status,
+		'total_amount': f"{order.total_amount:.2f}",
+	}
+	if items:
+		data['items'] = [
+			{'name': item.food_item.name, 'quantity': item.quantity}
+			for item in order.items.all()
+		]
+	return data
+
+
+def _staff_only_json(request):
+	if not request.user.is_staff:
+		return JsonResponse({'success': False, 'message': 'Staff only'}, status=403)
+	return None
+
+
+@require_http_methods(["GET"])
+def kitchen_orders(request):
+	"""Open orders for the kitchen queue, oldest first (?status= narrows it down)"""
+	denied = _staff_only_json(request)
+	if denied:
+		return denied
+
+	statuses = [s for s in request.GET.getlist('status') if s in Order.OPEN_STATUSES] or Order.OPEN_STATUSES
+	orders = list(
+		Order.objects.filter(status__in=statuses)
+		.order_by('created_at', 'id')
+		.prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('food_item')))[:500]
+	)
+	return JsonResponse({'success': True, 'orders': [_kitchen_order(order) for order in orders]})
+
+
+@require_http_methods(["POST"])
+def kitchen_order_status(request, order_id):
+	"""Move one order to a new status if it is still at the version the client saw"""
+	denied = _staff_only_json(request)
+	if denied:
+		return denied
+
+	try:
+		data = json.loads(request.body)
+		new_status = data.get('status')
+		version = data.get('version')
+		if new_status not in Order.STATUS_TRANSITIONS or not isinstance(version, int):
+			return JsonResponse({'success': False, 'message': 'Invalid status or version'}, status=400)
+
+		with transaction.atomic():
+			updated = Order.objects.filter(
+				id=order_id,
+				version=version,
+				status__in=Order.STATUS_TRANSITIONS[new_status]
+			).update(status=new_status, version=F('version') + 1)
+			order = Order.objects.filter(id=order_id).first()
+			if order is None:
+				return JsonResponse({'success': False, 'message': 'Order not found'}, status=404)
+			if updated:
+				events.publish_order(order)
+
+		if not updated:
+			# Someone else changed it first, or the transition is not allowed
+			return JsonResponse({
+				'success': False,
+				'message': 'Order was changed by someone else or cannot move to that status',
+				'order': _kitchen_order(order, items=False)
+			}, status=409)
+		return JsonResponse({'success': True, 'order': _kitchen_order(order, items=False)})
+	except json.JSONDecodeError:
+		return JsonResponse({'success': False, 'message': 'Invalid request format'}, status=400)
+
+
+@require_http_methods(["POST"])
+def kitchen_bulk_status(request):
+	"""Move many orders to a status with one UPDATE.
+	
+	Only orders whose current status allows the transition are changed; the
+	rest are reported back unchanged.
+	"""
+	denied = _staff_only_json(request)
+	if denied:
+		return denied
+
+	try:
+		data = json.loads(request.body)
+		new_status = data.get('status')
+		order_ids = data.get('ids')
+		if new_status not in Order.STATUS_TRANSITIONS:
+			return JsonResponse({'success': False, 'message': 'Invalid status'}, status=400)
+		if not isinstance(order_ids, list) or not order_ids or len(order_ids) > 1000 \
+				or not all(isinstance(order_id, int) for order_id in order_ids):
+			return JsonResponse({'success': False, 'message': 'Invalid order ids'}, status=400)
+
+		with transaction.atomic():
+			allowed = Order.objects.filter(id__in=order_ids, status__in=Order.STATUS_TRANSITIONS[new_status])
+			# Only these change, so only these are published; orders already at new_status are left alone
+			moving = set(allowed.select_for_update().values_list('id', flat=True))
+			updated = allowed.filter(id__in=moving).update(status=new_status, version=F('version') + 1) if moving else 0
+			orders = list(Order.objects.filter(id__in=order_ids))
+			if updated:
+				events.publish_orders([order for order in orders if order.id in moving and order.status == new_status])
+
+		return JsonResponse({
+			'success': True,
+			'updated': updated,
+			'orders': [_kitchen_order(order, items=False) for order in orders]
+		})
+	except json.JSONDecodeError:
+		return JsonResponse({'success': False, 'message': 'Invalid request format'}, status=400)
+
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+	"""Prometheus metrics of all workers, for staff or a scraper with METRICS_TOKEN"""
+	authorization = request.META.get('HTTP_AUTHORIZATION', '')
+	token_ok = bool(settings.METRICS_TOKEN) and hmac.compare_digest(
+		authorization.encode(), f'Bearer {settings.METRICS_TOKEN}'.encode()
+	)
+	if not token_ok and not request.user.is_staff:
+		return HttpResponse('Staff only\n', status=403, content_type='text/plain')
+
+	# Include this worker's latest numbers
+	metrics.registry.flush()
+	return HttpResponse(
+		metrics.render(metrics.collect()),
+		content_type='text/plain; version=0.0.4; charset=utf-8'
+	)
@@ -40,5 +40,8 @@ pip install -r requirements.txt
 echo "Running migrations..."
 python manage.py migrate --noinput
 
+echo "Collecting static files..."
+python manage.py collectstatic --noinput
+
 echo "Starting Django server..."
 python manage.py runserver_plus 0.0.0.0:8000 --cert-file localhost+2.pem --key-file localhost+2-key.pem
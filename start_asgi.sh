@@ -0,0 +1,66 @@
+#!/bin/bash
+set -e
+
+# Production launcher: Uvicorn workers serving bufet_project.asgi.
+#   WORKERS  number of worker processes (default: one per CPU core)
+#   HOST     bind address (default: 0.0.0.0)
+#   PORT     port (default: 8000)
+#   FORWARDED_ALLOW_IPS  proxies whose X-Forwarded-For/-Proto headers are
+#            trusted (default: 127.0.0.1); the rate limiter keys on the
+#            resulting client address
+#   SSL_CERT / SSL_KEY  TLS certificate and key (default: the mkcert files
+#            if present; leave both empty when a reverse proxy terminates TLS)
+#   QR_TOKEN_SECRET  key for QR pass hashes (required; DJANGO_DEBUG defaults
+#            to 0 here)
+
+echo "Starting Bufet Web (ASGI)..."
+
+PROJECT_DIR="$(cd "$(dirname "$0")" && pwd)"
+VENV_DIR="$PROJECT_DIR/venv"
+
+cd "$PROJECT_DIR"
+
+if [ ! -d "$VENV_DIR" ]; then
+    echo "Creating virtual environment..."
+    python3 -m venv venv
+fi
+
+source "$VENV_DIR/bin/activate"
+
+echo "Installing dependencies..."
+pip install -r requirements.txt
+
+export DJANGO_DEBUG="${DJANGO_DEBUG:-0}"
+# Each sync_to_async thread would keep its own persistent connection open,
+# and nothing closes them; reconnect per request instead
+export DB_CONN_MAX_AGE="${DB_CONN_MAX_AGE:-0}"
+
+echo "Running migrations..."
+python manage.py migrate --noinput
+
+echo "Collecting static files..."
+python manage.py collectstatic --noinput
+
+# Worker PIDs change on restart; start the /metrics counters from zero
+rm -rf "${METRICS_DIR:-$PROJECT_DIR/.metrics}"
+
+WORKERS="${WORKERS:-$(nproc 2>/dev/null || echo 2)}"
+HOST="${HOST:-0.0.0.0}"
+PORT="${PORT:-8000}"
+SSL_CERT="${SSL_CERT-localhost+2.pem}"
+SSL_KEY="${SSL_KEY-localhost+2-key.pem}"
+
+SSL_ARGS=()
+if [ -n "$SSL_CERT" ] && [ -f "$SSL_CERT" ] && [ -n "$SSL_KEY" ] && [ -f "$SSL_KEY" ]; then
+    SSL_ARGS=(--ssl-certfile "$SSL_CERT" --ssl-keyfile "$SSL_KEY")
+fi
+
+echo "Starting Uvicorn with $WORKERS worker(s) on $HOST:$PORT..."
+exec uvicorn bufet_project.asgi:application \
+    --host "$HOST" \
+    --port "$PORT" \
+    --workers "$WORKERS" \
+    --proxy-headers \
+    --forwarded-allow-ips "${FORWARDED_ALLOW_IPS:-127.0.0.1}" \
+    --timeout-graceful-shutdown 10 \
+    "${SSL_ARGS[@]}"
@@ -0,0 +1,11 @@
+// New or updated orders arrive over Server-Sent Events; offer a reload
+if (window.EventSource) {
+    const banner = document.getElementById('live-orders');
+    const changed = new Set();
+    const orderEvents = new EventSource('/admin/orders/stream/');
+    orderEvents.addEventListener('order', (event) => {
+        changed.add(JSON.parse(event.data).id);
+        banner.textContent = `${changed.size} new or updated order(s) - click to refresh`;
+        banner.hidden = false;
+    });
+}
@@ -0,0 +1,185 @@
+let scannedData = null;
+
+function showSuccessAnimation() {
+  const overlay = document.getElementById('success-overlay');
+  if (!overlay) return;
+  overlay.classList.add('visible');
+  overlay.setAttribute('aria-hidden', 'false');
+}
+
+function hideScannerOverlay() {
+  const scannerOverlay = document.querySelector('.scanner-overlay');
+  if (scannerOverlay) scannerOverlay.style.display = 'none';
+  const videoEl = document.getElementById('camera');
+  if (videoEl) videoEl.style.filter = 'brightness(0.82)';
+}
+
+async function saveQRToDatabase(data) {
+  try {
+    const response = await fetch('/api/scan-qr/', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ data: data })
+    });
+    const result = await response.json();
+    return result;
+  } catch (error) {
+    console.error('Error saving QR code:', error);
+  }
+}
+
+async function startCamera() {
+  const statusEl = document.getElementById('status');
+  const videoEl = document.getElementById('camera');
+  const canvasEl = document.getElementById('canvas');
+  const resultEl = document.getElementById('result');
+
+  if (!navigator.mediaDevices || !navigator.mediaDevices.getUserMedia) {
+    statusEl.textContent = '❌ Camera not supported in this browser.';
+    statusEl.className = 'status error';
+    return;
+  }
+  try {
+    const stream = await navigator.mediaDevices.getUserMedia({ 
+      video: { facingMode: 'environment' }, 
+      audio: false 
+    });
+    videoEl.srcObject = stream;
+
+    // Check if back camera is available, if not fallback to front camera
+    const tracks = stream.getVideoTracks();
+    const settings = tracks[0]?.getSettings?.();
+    if (settings?.facingMode === 'user') {
+      videoEl.classList.add('front-camera');
+    }
+    statusEl.innerHTML = '🔍 Camera is on - scanning for QR codes...';
+    statusEl.className = 'status scanning';
+
+    // Set up canvas for QR scanning
+    const ctx = canvasEl.getContext('2d');
+    canvasEl.width = videoEl.videoWidth || 640;
+    canvasEl.height = videoEl.videoHeight || 480;
+
+    // Start scanning
+    function scanQR() {
+      if (videoEl.readyState === videoEl.HAVE_ENOUGH_DATA) {
+        canvasEl.width = videoEl.videoWidth;
+        canvasEl.height = videoEl.videoHeight;
+        ctx.drawImage(videoEl, 0, 0, canvasEl.width, canvasEl.height);
+
+        const imageData = ctx.getImageData(0, 0, canvasEl.width, canvasEl.height);
+        const code = jsQR(imageData.data, imageData.width, imageData.height);
+
+        if (code && code.data !== scannedData) {
+          scannedData = code.data;
+          statusEl.innerHTML = '✓ QR Code found! Verifying...';
+          statusEl.className = 'status success';
+
+          // Verify against database
+          saveQRToDatabase(code.data).then(result => {
+            if (result && result.valid) {
+              resultEl.innerHTML = `<strong>✓ Access Granted!</strong><br>Welcome to the buffet`;
+              resultEl.className = 'result success';
+              statusEl.style.display = 'none';
+              resultEl.style.display = 'block';
+              hideScannerOverlay();
+              showSuccessAnimation();
+              // Redirect to success page after 1 second
+              setTimeout(() => {
+                window.location.href = result.redirect_url;
+              }, 1000);
+            } else {
+              resultEl.innerHTML = `<strong>✗ Invalid QR Code</strong><br>Code not recognized`;
+              resultEl.className = 'result error';
+              statusEl.innerHTML = '❌ QR code not recognized';
+              statusEl.className = 'status error';
+              resultEl.style.display = 'block';
+              scannedData = null; // Reset to scan again
+            }
+          });
+        }
+      }
+      requestAnimationFrame(scanQR);
+    }
+
+    scanQR();
+  } catch (err) {
+    statusEl.innerHTML = '❌ Camera access denied or unavailable';
+    statusEl.className = 'status error';
+  }
+}
+
+function decodeImageFile(file) {
+  const statusEl = document.getElementById('status');
+  const resultEl = document.getElementById('result');
+  const canvasEl = document.getElementById('canvas');
+  const ctx = canvasEl.getContext('2d');
+
+  statusEl.textContent = '🖼️ Reading image...';
+  statusEl.className = 'status scanning';
+
+  const reader = new FileReader();
+  reader.onload = function (event) {
+    const img = new Image();
+    img.onload = function () {
+      canvasEl.width = img.width;
+      canvasEl.height = img.height;
+      ctx.drawImage(img, 0, 0, img.width, img.height);
+
+      const imageData = ctx.getImageData(0, 0, img.width, img.height);
+      const code = jsQR(imageData.data, imageData.width, imageData.height);
+
+      if (code && code.data) {
+        statusEl.textContent = '✓ QR Code found! Verifying...';
+        statusEl.className = 'status success';
+
+        saveQRToDatabase(code.data).then(result => {
+          if (result && result.valid) {
+            resultEl.innerHTML = `<strong>✓ Access Granted!</strong><br>Welcome to the buffet`;
+            resultEl.className = 'result success';
+            statusEl.style.display = 'none';
+            resultEl.style.display = 'block';
+            hideScannerOverlay();
+            showSuccessAnimation();
+            setTimeout(() => {
+              window.location.href = result.redirect_url;
+            }, 1000);
+          } else {
+            resultEl.innerHTML = `<strong>✗ Invalid QR Code</strong><br>Code not recognized`;
+            resultEl.className = 'result error';
+            statusEl.innerHTML = '❌ QR code not recognized';
+            statusEl.className = 'status error';
+            resultEl.style.display = 'block';
+          }
+        });
+      } else {
+        statusEl.textContent = '❌ No QR code found in the image.';
+        statusEl.className = 'status error';
+      }
+    };
+    img.onerror = function () {
+      statusEl.textContent = '❌ Unable to read the image file.';
+      statusEl.className = 'status error';
+    };
+    img.src = event.target.result;
+  };
+  reader.onerror = function () {
+    statusEl.textContent = '❌ Failed to load the file.';
+    statusEl.className = 'status error';
+  };
+  reader.readAsDataURL(file);
+}
+
+const uploadBtn = document.getElementById('upload-btn');
+const uploadInput = document.getElementById('qr-upload');
+uploadBtn.addEventListener('click', () => uploadInput.click());
+uploadInput.addEventListener('change', (event) => {
+  const file = event.target.files && event.target.files[0];
+  if (file) {
+    decodeImageFile(file);
+  }
+});
+
+startCamera();
@@ -0,0 +1,35 @@
+// Real-time search filtering
+document.addEventListener('DOMContentLoaded', function() {
+    const searchInput = document.querySelector('input[name="search"]');
+    if (searchInput) {
+        searchInput.addEventListener('input', function() {
+            const searchTerm = this.value.toLowerCase().trim();
+            const passItems = document.querySelectorAll('.pass-item');
+            let visibleCount = 0;
+
+            passItems.forEach(function(item) {
+                const userName = item.querySelector('.pass-user').textContent.toLowerCase();
+                if (userName.includes(searchTerm)) {
+                    item.style.display = '';
+                    visibleCount++;
+                } else {
+                    item.style.display = 'none';
+                }
+            });
+
+            // Update search results info
+            let searchInfo = document.querySelector('.search-results-info');
+            if (searchTerm && visibleCount === 0) {
+                if (!searchInfo) {
+                    searchInfo = document.createElement('div');
+                    searchInfo.className = 'search-results-info';
+                    searchInput.parentElement.parentElement.appendChild(searchInfo);
+                }
+                searchInfo.textContent = `No users found matching "${searchTerm}"`;
+                searchInfo.style.display = 'block';
+            } else if (searchInfo) {
+                searchInfo.style.display = 'none';
+            }
+        });
+    }
+});
@@ -0,0 +1,293 @@
+const timerEl = document.getElementById('timer');
+let totalSeconds = Number(timerEl.dataset.remainingMinutes) * 60 + Number(timerEl.dataset.remainingSeconds);
+const countdownEl = document.getElementById('countdown');
+
+function updateTimer() {
+  if (totalSeconds <= 0) {
+    window.location.href = '/success/';
+    return;
+  }
+
+  const minutes = Math.floor(totalSeconds / 60);
+  const seconds = totalSeconds % 60;
+  countdownEl.textContent = `${minutes}:${seconds.toString().padStart(2, '0')}`;
+
+  if (totalSeconds <= 60) {
+    timerEl.className = 'session-timer danger';
+  } else if (totalSeconds <= 120) {
+    timerEl.className = 'session-timer warning';
+  } else {
+    timerEl.className = 'session-timer';
+  }
+
+  totalSeconds--;
+  setTimeout(updateTimer, 1000);
+}
+
+updateTimer();
+
+const cart = new Map();
+const cartItemsEl = document.getElementById('cart-items');
+const cartTotalEl = document.getElementById('cart-total');
+const orderButton = document.getElementById('order-button');
+const cartMessage = document.getElementById('cart-message');
+const cartBar = document.getElementById('cart-bar');
+const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+
+// One Idempotency-Key per submitted cart: retrying the same cart after a
+// network error reuses it, so the server never places the order twice.
+let pendingRequest = null;
+
+function idempotencyKeyFor(url, body) {
+  if (!pendingRequest || pendingRequest.url !== url || pendingRequest.body !== body) {
+    const key = window.crypto && crypto.randomUUID
+      ? crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    pendingRequest = { url, body, key };
+  }
+  return pendingRequest.key;
+}
+
+async function postJson(url, payload) {
+  const body = JSON.stringify(payload);
+  const response = await fetch(url, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'X-CSRFToken': csrfToken,
+      'Idempotency-Key': idempotencyKeyFor(url, body)
+    },
+    body
+  });
+  const result = await response.json();
+  if (response.status !== 409) {
+    pendingRequest = null;
+  }
+  return result;
+}
+
+function formatPrice(value) {
+  return `€${Number(value).toFixed(2)}`;
+}
+
+function renderCart() {
+  cartItemsEl.innerHTML = '';
+  let total = 0;
+
+  if (cart.size === 0) {
+    cartMessage.style.display = 'block';
+    orderButton.disabled = true;
+    cartBar.classList.remove('visible');
+  } else {
+    cartMessage.style.display = 'none';
+    orderButton.disabled = false;
+    cartBar.classList.add('visible');
+  }
+
+  for (const [id, item] of cart.entries()) {
+    const row = document.createElement('div');
+    row.className = 'cart-item';
+    row.dataset.id = id;
+    row.innerHTML = `
+      <div class="cart-item-name">${item.name}</div>
+      <div class="cart-item-qty">
+        <button class="qty-btn" data-action="dec">-</button>
+        <span class="qty-value">${item.quantity}</span>
+        <button class="qty-btn" data-action="inc">+</button>
+      </div>
+      <div class="cart-item-price">${formatPrice(item.price * item.quantity)}</div>
+    `;
+    cartItemsEl.appendChild(row);
+    total += item.price * item.quantity;
+  }
+
+  cartTotalEl.textContent = formatPrice(total);
+}
+
+function addToCart(id, name, price) {
+  if (cart.has(id)) {
+    cart.get(id).quantity += 1;
+  } else {
+    cart.set(id, { id, name, price, quantity: 1 });
+  }
+  renderCart();
+}
+
+document.querySelectorAll('.add-button').forEach(button => {
+  button.addEventListener('click', () => {
+    const id = parseInt(button.dataset.id, 10);
+    const name = button.dataset.name;
+    const price = parseFloat(button.dataset.price);
+    addToCart(id, name, price);
+  });
+});
+
+cartItemsEl.addEventListener('click', (event) => {
+  const actionButton = event.target.closest('.qty-btn');
+  if (!actionButton) return;
+  const row = actionButton.closest('.cart-item');
+  const id = parseInt(row.dataset.id, 10);
+  const action = actionButton.dataset.action;
+  if (!cart.has(id)) return;
+
+  const item = cart.get(id);
+  if (action === 'inc') {
+    item.quantity += 1;
+  } else if (action === 'dec') {
+    item.quantity -= 1;
+    if (item.quantity <= 0) {
+      cart.delete(id);
+    }
+  }
+  renderCart();
+});
+
+const paywall = document.getElementById('paywall');
+const paywallTotal = document.getElementById('paywall-total');
+const paywallCancel = document.getElementById('paywall-cancel');
+const paywallPerson = document.getElementById('paywall-person');
+const paywallPay = document.getElementById('paywall-pay');
+
+function getCartTotal() {
+  let total = 0;
+  for (const item of cart.values()) {
+    total += item.price * item.quantity;
+  }
+  return total;
+}
+
+function openPaywall() {
+  const total = getCartTotal();
+  paywallTotal.textContent = `Total: ${formatPrice(total)}`;
+  paywall.classList.add('visible');
+  paywall.setAttribute('aria-hidden', 'false');
+}
+
+function closePaywall() {
+  paywall.classList.remove('visible');
+  paywall.setAttribute('aria-hidden', 'true');
+}
+
+paywallCancel.addEventListener('click', closePaywall);
+paywall.addEventListener('click', (event) => {
+  if (event.target === paywall) {
+    closePaywall();
+  }
+});
+
+orderButton.addEventListener('click', () => {
+  openPaywall();
+});
+
+paywallPerson.addEventListener('click', async () => {
+  const items = Array.from(cart.values()).map(item => ({
+    id: item.id,
+    quantity: item.quantity
+  }));
+
+  orderButton.disabled = true;
+  orderButton.textContent = 'Placing order...';
+
+  try {
+    const result = await postJson('/api/orders/', { items, payment_method: 'in_person' });
+    if (result.success) {
+      cart.clear();
+      renderCart();
+      closePaywall();
+      cartMessage.textContent = `Order #${result.order_id} placed. Total €${result.total_amount}`;
+      cartMessage.style.display = 'block';
+    } else {
+      cartMessage.textContent = result.message || 'Order failed.';
+      cartMessage.style.display = 'block';
+    }
+  } catch (error) {
+    cartMessage.textContent = 'Order failed. Please try again.';
+    cartMessage.style.display = 'block';
+  } finally {
+    orderButton.textContent = 'Order';
+    orderButton.disabled = cart.size === 0;
+  }
+});
+
+paywallPay.addEventListener('click', async () => {
+  const items = Array.from(cart.values()).map(item => ({
+    id: item.id,
+    quantity: item.quantity
+  }));
+
+  orderButton.disabled = true;
+  orderButton.textContent = 'Redirecting...';
+
+  try {
+    const result = await postJson('/api/stripe-session/', { items });
+    if (result.success && result.checkout_url) {
+      window.location.href = result.checkout_url;
+    } else {
+      cartMessage.textContent = result.message || 'Payment setup failed.';
+      cartMessage.style.display = 'block';
+      orderButton.textContent = 'Order';
+      orderButton.disabled = cart.size === 0;
+    }
+  } catch (error) {
+    cartMessage.textContent = 'Payment setup failed. Please try again.';
+    cartMessage.style.display = 'block';
+    orderButton.textContent = 'Order';
+    orderButton.disabled = cart.size === 0;
+  }
+});
+
+renderCart();
+
+// Keep stock badges current. The browser revalidates with If-None-Match,
+// so an unchanged menu costs an empty 304.
+const stockEls = new Map(
+  Array.from(document.querySelectorAll('[data-stock-id]')).map(el => [Number(el.dataset.stockId), el])
+);
+
+function applyStock(items, complete) {
+  const seen = new Set();
+  for (const item of items) {
+    seen.add(item.id);
+    const el = stockEls.get(item.id);
+    if (!el) continue;
+    el.textContent = `${item.available} available`;
+    el.classList.toggle('low', item.available < 5);
+  }
+  if (!complete) return;
+  for (const [id, el] of stockEls.entries()) {
+    if (!seen.has(id)) {
+      el.textContent = '0 available';
+      el.classList.add('low');
+    }
+  }
+}
+
+async function refreshStock() {
+  try {
+    const response = await fetch('/api/menu/', { cache: 'no-cache', credentials: 'same-origin' });
+    if (!response.ok) return;
+    const menu = await response.json();
+    applyStock(menu.items, true);
+  } catch (error) {
+    // Offline or session expired; the next poll will try again
+  }
+}
+
+// Prefer the live stream; fall back to polling when it is unavailable
+let pollTimer = null;
+function startPolling() {
+  if (!pollTimer) pollTimer = setInterval(refreshStock, 15000);
+}
+
+if (window.EventSource) {
+  const stockEvents = new EventSource('/api/stream/stock/');
+  stockEvents.addEventListener('open', () => {
+    clearInterval(pollTimer);
+    pollTimer = null;
+  });
+  stockEvents.addEventListener('stock', (event) => applyStock(JSON.parse(event.data), false));
+  stockEvents.addEventListener('resync', refreshStock);
+  stockEvents.addEventListener('error', startPolling);
+} else {
+  startPolling();
+}